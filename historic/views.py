@@ -1,7 +1,5 @@
-from datetime import datetime, timedelta
+from datetime import datetime
 
-from django.db.models import Count, DateField
-from django.db.models.functions import Cast
 from django.utils.translation import ugettext_lazy as _
 
 from rest_registration.exceptions import BadRequest
@@ -10,14 +8,14 @@ from rest_framework.response import Response
 from rest_framework.views import APIView
 
 from medications.models import (
+    DailySupplyAggregate,
     MedicationName,
     MedicationNdc,
     MedicationMedicationNameMedicationDosageThrough,
-    Provider,
-    ProviderMedicationNdcThrough,
     State,
     ZipCode,
 )
+from medications.response_cache import VersionedResponseCacheMixin
 from medications.utils import force_user_state_id_and_zipcode
 from .serializers import (
     AverageSupplyLevelSerializer,
@@ -44,23 +42,23 @@ def get_medication_ndc_ids(query_params):
     return med_ndc_ids
 
 
-def get_provider_ids(query_params, state_id=None, zipcode=None):
-    provider_categories = query_params.getlist('provider_categories[]', [])
-    provider_types = query_params.getlist('provider_types[]', [])
-
-    provider_qs = Provider.objects.filter(
-        category__in=provider_categories,
-        type__in=provider_types,
+def get_level_counts(query_params, start_date, end_date, medication_ndc_ids, state_id=None, zipcode=None, per_medication_ndc=True):
+    """
+    Count the supplies of every level per date from the daily aggregates,
+    the supplies unchanged since a previous day are carried forward to
+    every day.
+    """
+    return DailySupplyAggregate.objects.daily_level_counts(
+        medication_ndc_ids,
+        query_params.getlist('provider_categories[]', []),
+        query_params.getlist('provider_types[]', []),
+        start_date.date(),
+        end_date.date(),
+        state_id=state_id,
+        zipcode=zipcode,
+        per_medication_ndc=per_medication_ndc,
     )
 
-    if zipcode:
-        provider_qs = provider_qs.filter(related_zipcode__zipcode=zipcode)
-
-    if state_id:
-        provider_qs = provider_qs.filter(related_zipcode__state=state_id)
-
-    return provider_qs.values_list('id', flat=True)
-
 
 def validate_dates(query_params):
     start_date = query_params.get('start_date')
@@ -85,9 +83,10 @@ def validate_dates(query_params):
 #####################################################################################
 
 
-class HistoricAverageView(APIView):
+class HistoricAverageView(VersionedResponseCacheMixin, APIView):
     permission_classes = (IsAuthenticated,)
     allowed_methods = ['GET']
+    response_cache_name = 'historic_average'
 
     def dispatch(self, request, *args, **kwargs):
         '''
@@ -100,7 +99,7 @@ class HistoricAverageView(APIView):
             self.zipcode = kwargs.pop('zipcode')
         return super().dispatch(request, *args, **kwargs)
 
-    def get(self, request):
+    def get_uncached(self, request):
         '''
         query_params:
             - med_id: MedicationName id
@@ -127,24 +126,16 @@ class HistoricAverageView(APIView):
         # 3 - Find list of medication_ndc_ids
         medication_ndc_ids = get_medication_ndc_ids(request.query_params)
 
-        # 4 - Find list of provider_ids
-        provider_ids = get_provider_ids(
-            request.query_params, state_id=state_id, zipcode=zipcode)
-
-        # 5 - Query ProviderMedicationNdcThrough
-        # to find count of supply levels per date
-        provider_medication_ndcs = ProviderMedicationNdcThrough.objects.filter(
-            medication_ndc_id__in=medication_ndc_ids,
-            provider_id__in=provider_ids,
-            date__gte=start_date,
-            date__lte=end_date + timedelta(days=1),
-        ).distinct(
-        ).values(
-            'medication_ndc_id', 'level'
-        ).annotate(
-            count_for_level=Count('level'),
-            creation_date_only=Cast('creation_date', DateField())
-        ).order_by('creation_date_only')
+        # 4 - Query the daily aggregates of the providers to find count of
+        # supply levels per date
+        provider_medication_ndcs = get_level_counts(
+            request.query_params,
+            start_date,
+            end_date,
+            medication_ndc_ids,
+            state_id=state_id,
+            zipcode=zipcode,
+        )
 
         medication_ndcs = MedicationNdc.objects.filter(
             id__in=medication_ndc_ids
@@ -166,9 +157,10 @@ class HistoricAverageView(APIView):
 ################################## HistoricOverall ##################################
 #####################################################################################
 
-class HistoricOverallView(APIView):
+class HistoricOverallView(VersionedResponseCacheMixin, APIView):
     permission_classes = (IsAuthenticated,)
     allowed_methods = ['GET']
+    response_cache_name = 'historic_overall'
 
     def dispatch(self, request, *args, **kwargs):
         '''
@@ -181,7 +173,7 @@ class HistoricOverallView(APIView):
             self.zipcode = kwargs.pop('zipcode')
         return super().dispatch(request, *args, **kwargs)
 
-    def get(self, request):
+    def get_uncached(self, request):
         '''
         query_params:
             - med_id: MedicationName id
@@ -208,24 +200,17 @@ class HistoricOverallView(APIView):
         # 3 - Find list of medication_ndc_ids
         medication_ndc_ids = get_medication_ndc_ids(self.request.query_params)
 
-        # 4 - Find list of provider_ids
-        provider_ids = get_provider_ids(
-            self.request.query_params, state_id=state_id, zipcode=zipcode)
-
-        # 5 - Query ProviderMedicationNdcThrough to
-        # find count of supply levels per date
-        provider_medication_ndcs = ProviderMedicationNdcThrough.objects.filter(
-            medication_ndc_id__in=medication_ndc_ids,
-            provider_id__in=provider_ids,
-            date__gte=start_date,
-            date__lte=end_date + timedelta(days=1),
-        ).distinct(
-        ).values(
-            'level'
-        ).annotate(
-            count_for_level=Count('level'),
-            creation_date_only=Cast('creation_date', DateField())
-        ).order_by('creation_date_only')
+        # 4 - Query the daily aggregates of the providers to find count of
+        # supply levels per date
+        provider_medication_ndcs = get_level_counts(
+            self.request.query_params,
+            start_date,
+            end_date,
+            medication_ndc_ids,
+            state_id=state_id,
+            zipcode=zipcode,
+            per_medication_ndc=False,
+        )
 
         context = {'request': request}
         data = OverallSupplyLevelSerializer(
@@ -0,0 +1,41 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from medications.archives import archive_supply_history
+
+# python manage.py archive_supply_history
+# docker-compose -f dev.yml run django python manage.py archive_supply_history --retention-days 365
+
+
+class Command(BaseCommand):
+    """
+    Roll up the old supply history entries into daily supplies, archive
+    them and remove them from the history table
+    """
+    help = (
+        'Roll up the old supply history entries into daily supplies, '
+        'archive them and remove them from the history table'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--retention-days',
+            type=int,
+            default=settings.SUPPLY_HISTORY_RETENTION_DAYS,
+            help='Archive the entries older than this number of days, '
+                 'nothing is archived if it is 0',
+        )
+
+    def handle(self, *args, **options):
+        for archive in archive_supply_history(options['retention_days']):
+            self.stdout.write(
+                'Archived {} entries from {} to {} in {}, {} daily supplies '
+                'created and {} entries removed.'.format(
+                    archive.row_count,
+                    archive.start_date,
+                    archive.end_date,
+                    archive.file_name,
+                    archive.rollup_row_count,
+                    archive.deleted_row_count,
+                )
+            )
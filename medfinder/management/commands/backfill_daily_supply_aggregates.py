@@ -0,0 +1,80 @@
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from medications.models import (
+    DailyProviderSupply,
+    DailySupplyAggregate,
+    ProviderMedicationNdcThrough,
+)
+from medications.partitions import add_months, get_month
+from medications.versions import increment_supply_data_version
+
+# python manage.py backfill_daily_supply_aggregates
+# docker-compose -f dev.yml run django python manage.py backfill_daily_supply_aggregates --start-date 2018-06-01
+
+
+def parse_date(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError as e:
+        raise CommandError('Incorrect date: {}'.format(e))
+
+
+class Command(BaseCommand):
+    """
+    Recompute the daily supply aggregates of a range of days one month at
+    a time, from the first day of the supply history by default
+    """
+    help = (
+        'Recompute the daily supply aggregates of a range of days one month '
+        'at a time, from the first day of the supply history by default'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--start-date',
+            type=parse_date,
+            help='First day to recompute, as YYYY-MM-DD',
+        )
+        parser.add_argument(
+            '--end-date',
+            type=parse_date,
+            help='Last day to recompute, as YYYY-MM-DD, today by default',
+        )
+
+    def handle(self, *args, **options):
+        start_date = options['start_date']
+        if start_date is None:
+            first_days = [
+                model.objects.order_by(
+                    'date',
+                ).values_list('date', flat=True).first()
+                for model in (DailyProviderSupply, ProviderMedicationNdcThrough)
+            ]
+            first_days = [day for day in first_days if day is not None]
+            if not first_days:
+                self.stdout.write('There is no supply history.')
+                return
+            start_date = min(first_days)
+        end_date = options['end_date'] or timezone.now().date()
+
+        while start_date <= end_date:
+            chunk_end_date = min(
+                add_months(get_month(start_date), 1) - timedelta(days=1),
+                end_date,
+            )
+            row_count = DailySupplyAggregate.objects.refresh(
+                start_date,
+                chunk_end_date,
+            )
+            self.stdout.write(
+                '{} aggregates created from {} to {}.'.format(
+                    row_count,
+                    start_date,
+                    chunk_end_date,
+                )
+            )
+            start_date = chunk_end_date + timedelta(days=1)
+        increment_supply_data_version()
@@ -0,0 +1,137 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.test import override_settings
+from rest_framework.test import APIRequestFactory
+
+from medications.models import Provider
+from public.constants import (
+    FINDER_ORGANIZATION_IDS,
+    FINDER_VACCINE_FINDER_TYPES,
+)
+from public.provider_index import ProviderIndex, store_provider_index
+from public.views import FindProviderMedicationView
+
+# python manage.py benchmark_provider_search
+# docker-compose -f dev.yml run django python manage.py benchmark_provider_search --searches 200 --distance 25
+
+
+class Command(BaseCommand):
+    """
+    Compare the time of the public finder searches answered by the database
+    and by the in-process provider index, around random providers
+    """
+    help = (
+        'Compare the time of the public finder searches answered by the '
+        'database and by the in-process provider index'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--searches',
+            type=int,
+            default=100,
+            help='Number of searches, 100 by default',
+        )
+        parser.add_argument(
+            '--distance',
+            type=int,
+            default=10,
+            help='Distance of the searches in miles, 10 by default',
+        )
+        parser.add_argument(
+            '--med-id',
+            action='append',
+            dest='med_ids',
+            help='Medication name id of the searches, can be repeated, all '
+                 'the medications by default',
+        )
+        parser.add_argument(
+            '--dosage',
+            action='append',
+            dest='dosages',
+            default=[],
+            help='Dosage id of the searches, can be repeated',
+        )
+
+    def search(self, view, params):
+        request = APIRequestFactory().get('/', params)
+        start = time.perf_counter()
+        response = view(request)
+        response.render()
+        elapsed = time.perf_counter() - start
+        return elapsed, [
+            feature['properties']['id']
+            for feature in response.data['features']
+        ]
+
+    def write_times(self, name, times):
+        times = sorted(times)
+        self.stdout.write(
+            '{}: mean {:.2f} ms, median {:.2f} ms, p95 {:.2f} ms'.format(
+                name,
+                sum(times) / len(times) * 1000,
+                times[len(times) // 2] * 1000,
+                times[int(len(times) * 0.95)] * 1000,
+            )
+        )
+
+    def handle(self, *args, **options):
+        locations = list(
+            Provider.objects.filter(
+                Q(organization_id__in=FINDER_ORGANIZATION_IDS) |
+                Q(vaccine_finder_type__in=FINDER_VACCINE_FINDER_TYPES),
+                geo_localization__isnull=False,
+            ).values_list('geo_localization', flat=True)
+        )
+        if not locations:
+            self.stdout.write('No provider to search around.')
+            return
+
+        view = FindProviderMedicationView.as_view()
+        start = time.perf_counter()
+        # Stored like the build task does, the view loads it
+        index = ProviderIndex().build()
+        store_provider_index(index)
+        self.stdout.write(
+            'Index of {} providers built in {:.2f} s.'.format(
+                len(index),
+                time.perf_counter() - start,
+            )
+        )
+
+        database_times = []
+        index_times = []
+        mismatches = 0
+        for _ in range(options['searches']):
+            location = random.choice(locations)
+            params = {
+                'localization': '{},{}'.format(location.x, location.y),
+                'distance': options['distance'],
+                'med_ids[]': options['med_ids'] or ['all'],
+                'dosages[]': options['dosages'],
+            }
+            # The searches are not cached so the paths are compared
+            with override_settings(
+                PUBLIC_PROVIDER_INDEX_ENABLED=False,
+                PUBLIC_SEARCH_CACHE_CELL_SIZE=0,
+            ):
+                database_time, database_ids = self.search(view, params)
+            with override_settings(
+                PUBLIC_PROVIDER_INDEX_ENABLED=True,
+                PUBLIC_SEARCH_CACHE_CELL_SIZE=0,
+            ):
+                index_time, index_ids = self.search(view, params)
+            database_times.append(database_time)
+            index_times.append(index_time)
+            # The providers with the same sort key can come in any order
+            if sorted(database_ids) != sorted(index_ids):
+                mismatches += 1
+
+        self.write_times('Database', database_times)
+        self.write_times('Index', index_times)
+        self.stdout.write(
+            '{} searches with different providers.'.format(mismatches)
+        )
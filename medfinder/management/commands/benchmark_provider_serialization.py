@@ -0,0 +1,142 @@
+import random
+import time
+
+from collections import OrderedDict
+
+from django.contrib.gis.geos import Point
+from django.contrib.gis.measure import D
+from django.core.management.base import BaseCommand
+from django.db.models import Prefetch, Q
+from rest_framework.renderers import JSONRenderer
+
+from medications.models import (
+    CurrentProviderSupply,
+    MedicationMedicationNameMedicationDosageThrough,
+    Provider,
+)
+from public.constants import (
+    FINDER_ORGANIZATION_IDS,
+    FINDER_VACCINE_FINDER_TYPES,
+)
+from public.features import build_feature
+from public.serializers import FindProviderSerializer
+from public.views import get_database_rows, get_nearby_providers
+
+
+def get_serializer_queryset(location_point, distance, med_ndc_ids):
+    """
+    Return the providers within distance of the point with their current
+    supplies prefetched, as FindProviderSerializer expects them.
+    """
+    return get_nearby_providers(location_point, distance).prefetch_related(
+        Prefetch(
+            'current_supplies',
+            queryset=CurrentProviderSupply.objects.filter(
+                medication_ndc_id__in=med_ndc_ids,
+            ).select_related(
+                'medication_ndc__medication',
+                'medication_ndc__medication__medication_name',
+            ).order_by('-level', '-medication_ndc__medication__drug_type'),
+        ),
+    )
+
+
+# python manage.py benchmark_provider_serialization
+# docker-compose -f dev.yml run django python manage.py benchmark_provider_serialization --searches 50 --distance 50
+
+
+class Command(BaseCommand):
+    """
+    Compare the time and the output of the public finder features built by
+    FindProviderSerializer and from plain rows, around random providers
+    with all the medications
+    """
+    help = (
+        'Compare the time and the output of the public finder features built '
+        'by FindProviderSerializer and from plain rows'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--searches',
+            type=int,
+            default=20,
+            help='Number of searches, 20 by default',
+        )
+        parser.add_argument(
+            '--distance',
+            type=int,
+            default=25,
+            help='Distance of the searches in miles, 25 by default',
+        )
+
+    def write_times(self, name, times):
+        self.stdout.write(
+            '{}: mean {:.2f} ms'.format(name, sum(times) / len(times) * 1000)
+        )
+
+    def handle(self, *args, **options):
+        locations = list(
+            Provider.objects.filter(
+                Q(organization_id__in=FINDER_ORGANIZATION_IDS) |
+                Q(vaccine_finder_type__in=FINDER_VACCINE_FINDER_TYPES),
+                geo_localization__isnull=False,
+            ).values_list('geo_localization', flat=True)
+        )
+        if not locations:
+            self.stdout.write('No provider to search around.')
+            return
+        med_ndc_ids = list(
+            MedicationMedicationNameMedicationDosageThrough.objects.filter(
+                medication__ndc_codes__isnull=False,
+            ).values_list('medication__ndc_codes', flat=True).distinct()
+        )
+
+        renderer = JSONRenderer()
+        serializer_times = []
+        row_times = []
+        differences = 0
+        for _ in range(options['searches']):
+            location = random.choice(locations)
+            location_point = Point(location.x, location.y, srid=4326)
+            distance = D(mi=options['distance'])
+
+            start = time.perf_counter()
+            serializer_data = FindProviderSerializer(
+                get_serializer_queryset(location_point, distance, med_ndc_ids),
+                many=True,
+            ).data
+            serializer_content = renderer.render(serializer_data)
+            serializer_times.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            rows = get_database_rows(location_point, distance, med_ndc_ids)
+            renderer.render({
+                'type': 'FeatureCollection',
+                'features': [
+                    build_feature(row, row['distance']) for row in rows
+                ],
+            })
+            row_times.append(time.perf_counter() - start)
+
+            # The providers with the same sort key can come in any order,
+            # the features are compared in the order of the serializer
+            rows = {row['id']: row for row in rows}
+            row_content = renderer.render(OrderedDict((
+                ('type', 'FeatureCollection'),
+                ('features', [
+                    build_feature(
+                        rows[feature['properties']['id']],
+                        rows[feature['properties']['id']]['distance'],
+                    )
+                    for feature in serializer_data['features']
+                ]),
+            )))
+            if row_content != serializer_content:
+                differences += 1
+
+        self.write_times('Serializer', serializer_times)
+        self.write_times('Rows', row_times)
+        self.stdout.write(
+            '{} searches with a different output.'.format(differences)
+        )
@@ -1,8 +1,6 @@
-import json
-
 from django.core.management.base import BaseCommand
 
-from django.contrib.gis.db.models.functions import Centroid, AsGeoJSON
+from medications.geography import get_centers
 from medications.models import State
 
 
@@ -13,14 +11,8 @@ class Command(BaseCommand):
     help = 'Run Task state_cache_provier_count'
 
     def handle(self, *args, **options):
-        states = State.objects.all().annotate(
-            centroid=AsGeoJSON(Centroid('geometry')),
-        )
-
-        for state in states:
-            center_data = json.loads(state.centroid)
-            lng = center_data['coordinates'][0]
-            lat = center_data['coordinates'][1]
-            state.center_lng = lng
-            state.center_lat = lat
+        for state in State.objects.exclude(geometry=None):
+            centroid, bbox = get_centers(state.geometry)
+            state.center_lng = centroid.x
+            state.center_lat = centroid.y
             state.save()
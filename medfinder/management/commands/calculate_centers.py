@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from medications.geography import update_centers
+from medications.models import County, State, ZipCode
+
+# python manage.py calculate_centers
+# docker-compose -f dev.yml run django python manage.py calculate_centers
+
+
+class Command(BaseCommand):
+    """
+    Compute the centroids and bounding boxes of the states, counties and
+    zip codes from their geometries
+    """
+    help = (
+        'Compute the centroids and bounding boxes of the states, counties '
+        'and zip codes from their geometries'
+    )
+
+    def handle(self, *args, **options):
+        with connection.cursor() as cursor:
+            for model in (State, County, ZipCode):
+                row_count = update_centers(cursor, model._meta.db_table)
+                self.stdout.write(
+                    '{} {} updated.'.format(
+                        row_count,
+                        model._meta.verbose_name_plural,
+                    )
+                )
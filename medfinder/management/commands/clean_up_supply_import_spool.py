@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from medications.tasks import clean_up_supply_import_spool
+
+# python manage.py clean_up_supply_import_spool
+# docker-compose -f dev.yml run django python manage.py clean_up_supply_import_spool --days 2
+
+
+class Command(BaseCommand):
+    """
+    Delete the spooled supply CSV files left by failed imports
+    """
+    help = 'Delete the spooled supply CSV files left by failed imports'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=settings.SUPPLY_IMPORT_SPOOL_MAX_AGE_DAYS,
+            help='Delete the files older than this number of days',
+        )
+
+    def handle(self, *args, **options):
+        deleted = clean_up_supply_import_spool(options['days'])
+        self.stdout.write('{} spooled files deleted.'.format(deleted))
@@ -0,0 +1,68 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from medications.models import ProviderMedicationNdcThrough
+
+# python manage.py compact_supply_history
+# docker-compose -f dev.yml run django python manage.py compact_supply_history --batch-size 20000 --sleep 0.5
+
+
+class Command(BaseCommand):
+    """
+    Copy the level of the supply history to its smallint column in small
+    batches before migration 0080 swaps the columns
+    """
+    help = (
+        'Copy the level of the supply history to its smallint column in '
+        'small batches before migration 0080 swaps the columns'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=50000,
+            help='Number of ids rewritten by every UPDATE',
+        )
+        parser.add_argument(
+            '--sleep',
+            type=float,
+            default=0,
+            help='Seconds to wait between two batches',
+        )
+
+    def handle(self, *args, **options):
+        table = ProviderMedicationNdcThrough._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT 1 FROM information_schema.columns '
+                'WHERE table_name = %s AND column_name = %s',
+                [table, 'level_smallint'],
+            )
+            if not cursor.fetchone():
+                self.stdout.write('The supply history is already compact.')
+                return
+
+            cursor.execute('SELECT min(id), max(id) FROM {}'.format(table))
+            start_id, last_id = cursor.fetchone()
+            rewritten = 0
+            # Every batch is its own transaction and only locks its rows,
+            # the rows inserted meanwhile are rewritten by the next loop
+            while start_id is not None and start_id <= last_id:
+                cursor.execute(
+                    'UPDATE {} SET level_smallint = level '
+                    'WHERE id >= %s AND id < %s '
+                    'AND level_smallint IS NULL'.format(table),
+                    [start_id, start_id + options['batch_size']],
+                )
+                rewritten += cursor.rowcount
+                start_id += options['batch_size']
+                if options['sleep']:
+                    time.sleep(options['sleep'])
+                if start_id > last_id:
+                    cursor.execute('SELECT max(id) FROM {}'.format(table))
+                    last_id, = cursor.fetchone()
+
+        self.stdout.write('{} supply history rows rewritten.'.format(rewritten))
@@ -0,0 +1,61 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from medications.loaders import LOADERS
+from medications.models import Organization
+from medications.tasks import import_supplies
+
+# python manage.py import_supply_csv supplies.csv --organization 5 --loader copy
+# docker-compose -f dev.yml run django python manage.py import_supply_csv supplies.csv --organization 5
+
+
+class Command(BaseCommand):
+    """
+    Import a supply level CSV file for an organization
+    """
+    help = 'Import a supply level CSV file for an organization'
+
+    def add_arguments(self, parser):
+        parser.add_argument('csv_path')
+        parser.add_argument(
+            '--organization',
+            type=int,
+            required=True,
+            help='Id of the organization the stores belong to',
+        )
+        parser.add_argument(
+            '--import-date',
+            default=False,
+            help='Import the rows as past entries of this date '
+                 '(YYYY-MM-DDTHH:MM:SS+00:00)',
+        )
+        parser.add_argument(
+            '--loader',
+            choices=sorted(LOADERS),
+            default=None,
+            help='Backend used to write the rows, '
+                 'defaults to settings.SUPPLY_IMPORT_LOADER',
+        )
+        parser.add_argument(
+            '--delta',
+            action='store_true',
+            default=None,
+            help='Only write the supplies that changed, '
+                 'defaults to settings.SUPPLY_IMPORT_DELTA',
+        )
+
+    def handle(self, *args, **options):
+        organization_id = options['organization']
+        if not Organization.objects.filter(pk=organization_id).exists():
+            raise CommandError(
+                'Organization {} does not exist.'.format(organization_id),
+            )
+
+        with open(options['csv_path'], 'rb') as csv_file:
+            index = import_supplies(
+                csv_file,
+                organization_id,
+                options['import_date'],
+                options['loader'],
+                delta=options['delta'],
+            )
+        self.stdout.write('{} CSV rows imported.'.format(index))
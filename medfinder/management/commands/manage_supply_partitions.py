@@ -0,0 +1,65 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from medications.models import ProviderMedicationNdcThrough
+from medications.partitions import add_months, get_month
+
+# python manage.py manage_supply_partitions
+# docker-compose -f dev.yml run django python manage.py manage_supply_partitions --keep-months 24 --drop
+
+
+class Command(BaseCommand):
+    """
+    Create the monthly partitions of the supply history ahead of time and
+    detach the old ones
+    """
+    help = (
+        'Create the monthly partitions of the supply history ahead of time '
+        'and detach the old ones'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--months-ahead',
+            type=int,
+            default=settings.SUPPLY_HISTORY_PARTITION_MONTHS_AHEAD,
+            help='Number of partitions created after the current month',
+        )
+        parser.add_argument(
+            '--keep-months',
+            type=int,
+            default=settings.SUPPLY_HISTORY_RETENTION_MONTHS,
+            help='Detach the partitions older than this number of months, '
+                 'none are detached if it is 0',
+        )
+        parser.add_argument(
+            '--drop',
+            action='store_true',
+            help='Drop the detached partitions instead of keeping them as '
+                 'standalone tables',
+        )
+
+    def handle(self, *args, **options):
+        manager = ProviderMedicationNdcThrough.objects
+        current_month = get_month(timezone.now().date())
+        created = manager.create_partitions(
+            current_month,
+            add_months(current_month, options['months_ahead']),
+        )
+        # Past entries imported before their month had a partition
+        for month in manager.get_default_partition_months():
+            created.extend(manager.create_partitions(month, month))
+        for name in created:
+            self.stdout.write('Partition {} created.'.format(name))
+
+        if options['keep_months']:
+            detached = manager.detach_partitions(
+                add_months(current_month, -options['keep_months']),
+                options['drop'],
+            )
+            for name in detached:
+                self.stdout.write('Partition {} {}.'.format(
+                    name,
+                    'dropped' if options['drop'] else 'detached',
+                ))
@@ -5,7 +5,10 @@ from django.db.models import Max
 
 from django.core.management.base import BaseCommand
 
-from medications.models import ProviderMedicationNdcThrough
+from medications.models import (
+    CurrentProviderSupply,
+    ProviderMedicationNdcThrough,
+)
 
 # heroku run python manage.py mark_medicationndcthrough_as_latest -a medfinder-api
 # python manage.py mark_medicationndcthrough_as_latest
@@ -21,6 +24,8 @@ class Command(BaseCommand):
     def handle(self, *args, **options):
         print("STARTING mark_medicationndcthrough_as_latest")
         self.mark_medicationndcthrough_as_latest()
+        # The snapshot of the current supplies follows the latest entries
+        CurrentProviderSupply.objects.refresh()
 
     def mark_medicationndcthrough_as_latest(self):
         provider_medication_ndcs = ProviderMedicationNdcThrough.objects.filter(
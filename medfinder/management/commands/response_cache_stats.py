@@ -0,0 +1,61 @@
+from django.core.management.base import BaseCommand
+
+from medications.cache_warmup import get_cached_views
+from medications.response_cache import (
+    get_response_cache_latency,
+    get_response_cache_stats,
+    reset_response_cache_stats,
+)
+from public.search_cache import SEARCH_CACHE_NAME
+
+# python manage.py response_cache_stats
+# docker-compose -f dev.yml run django python manage.py response_cache_stats --reset
+
+
+class Command(BaseCommand):
+    """
+    Show the hits, misses and hit rate of the cached responses of every
+    endpoint, and their latency when measured
+    """
+    help = (
+        'Show the hits, misses and hit rate of the cached responses of every '
+        'endpoint, and their latency when measured'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--reset',
+            action='store_true',
+            help='Reset the counters after showing them',
+        )
+
+    def handle(self, *args, **options):
+        names = [view.response_cache_name for view in get_cached_views()]
+        names.append(SEARCH_CACHE_NAME)
+        for name in names:
+            stats = get_response_cache_stats(name)
+            self.stdout.write(
+                '{}: {} hits, {} misses, hit rate {}'.format(
+                    name,
+                    stats['hits'],
+                    stats['misses'],
+                    '-' if stats['hit_rate'] is None else '{:.1%}'.format(
+                        stats['hit_rate'],
+                    ),
+                )
+            )
+            latency = get_response_cache_latency(name)
+            if latency['hits'] is not None or latency['misses'] is not None:
+                self.stdout.write(
+                    '{}: hit latency {} ms, miss latency {} ms'.format(
+                        name,
+                        '-' if latency['hits'] is None else '{:.2f}'.format(
+                            latency['hits'],
+                        ),
+                        '-' if latency['misses'] is None else '{:.2f}'.format(
+                            latency['misses'],
+                        ),
+                    )
+                )
+            if options['reset']:
+                reset_response_cache_stats(name)
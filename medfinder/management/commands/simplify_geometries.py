@@ -0,0 +1,45 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from medications.models import County, SimplifiedGeometry, State, ZipCode
+
+# python manage.py simplify_geometries
+# docker-compose -f dev.yml run django python manage.py simplify_geometries --zoom 3 --zoom 7
+
+
+class Command(BaseCommand):
+    """
+    Store the geometries of the states, counties and zip codes simplified
+    for the zoom levels of the maps
+    """
+    help = (
+        'Store the geometries of the states, counties and zip codes '
+        'simplified for the zoom levels of the maps'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--zoom',
+            type=int,
+            action='append',
+            dest='zooms',
+            help='Zoom level to simplify the geometries for, the zoom levels '
+                 'of the maps by default',
+        )
+
+    def handle(self, *args, **options):
+        zooms = options['zooms'] or [
+            settings.ZOOM_US,
+            settings.ZOOM_STATE,
+            settings.ZOOM_ZIPCODE,
+        ]
+        for model in (State, County, ZipCode):
+            for zoom in zooms:
+                count = SimplifiedGeometry.objects.generate(model, zoom)
+                self.stdout.write(
+                    '{} {} geometries simplified for zoom {}.'.format(
+                        count,
+                        model._meta.verbose_name,
+                        zoom,
+                    )
+                )
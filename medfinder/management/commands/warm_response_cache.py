@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from medications.cache_warmup import warm_response_cache
+
+# python manage.py warm_response_cache
+# docker-compose -f dev.yml run django python manage.py warm_response_cache --state-id 5
+
+
+class Command(BaseCommand):
+    """
+    Compute and cache the national and state maps and filters of every
+    medication with its default filters
+    """
+    help = (
+        'Compute and cache the national and state maps and filters of every '
+        'medication with its default filters'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--state-id',
+            type=int,
+            action='append',
+            dest='state_ids',
+            help='Only warm up the state views of this state, can be '
+                 'repeated, all the states by default',
+        )
+
+    def handle(self, *args, **options):
+        request_count = warm_response_cache(options['state_ids'])
+        self.stdout.write('{} responses computed.'.format(request_count))
@@ -13,6 +13,8 @@ import environ
 import datetime
 import django_heroku
 
+from celery.schedules import crontab
+
 root = environ.Path(__file__) - 3
 env = environ.Env(DEBUG=(bool, False), )
 environ.Env.read_env(env_file=root('.env'))
@@ -137,7 +139,8 @@ LANGUAGE_CODE = 'en-us'
 
 # --- FILE UPLOAD ---
 DATA_UPLOAD_MAX_MEMORY_SIZE = 104857600  # 100 * 1024 * 1024  # i.e. 100 MB
-FILE_UPLOAD_MAX_MEMORY_SIZE = 104857600  # 100 * 1024 * 1024  # i.e. 100 MB
+# Bigger uploads are streamed to a temporary file instead of the memory
+FILE_UPLOAD_MAX_MEMORY_SIZE = 2621440  # 2.5 * 1024 * 1024  # i.e. 2.5 MB
 FILE_UPLOAD_PERMISSIONS = None
 FILE_UPLOAD_DIRECTORY_PERMISSIONS = None
 
@@ -198,9 +201,76 @@ REGISTRATION_AUTO_LOGIN = False
 
 # --- CELERY ---
 CELERY_BROKER_URL = env('CELERY_BROKER_URL', default='redis://redis:6379/')
+# Results are needed by the chords of the sharded supply import
+CELERY_RESULT_BACKEND = env(
+    'CELERY_RESULT_BACKEND',
+    default='{}2'.format(CELERY_BROKER_URL),
+)
 
 CELERYD_TASK_SOFT_TIME_LIMIT = 60 * 60 * 24
 
+# --- SUPPLY IMPORT ---
+# Number of CSV rows sorted in memory before being spilled to disk
+SUPPLY_IMPORT_SORT_CHUNK_SIZE = env.int(
+    'SUPPLY_IMPORT_SORT_CHUNK_SIZE',
+    default=100000,
+)
+# Number of ProviderMedicationNdcThrough rows inserted per batch
+SUPPLY_IMPORT_BATCH_SIZE = env.int(
+    'SUPPLY_IMPORT_BATCH_SIZE',
+    default=5000,
+)
+# Backend used to write the imported rows, one of 'copy' or 'bulk_create'
+SUPPLY_IMPORT_LOADER = env('SUPPLY_IMPORT_LOADER', default='copy')
+# Storage directory of the uploaded files waiting to be imported
+SUPPLY_IMPORT_SPOOL_DIR = env(
+    'SUPPLY_IMPORT_SPOOL_DIR',
+    default='supply_imports',
+)
+# Spooled files of failed imports are deleted after this number of days
+SUPPLY_IMPORT_SPOOL_MAX_AGE_DAYS = env.int(
+    'SUPPLY_IMPORT_SPOOL_MAX_AGE_DAYS',
+    default=7,
+)
+# Only write the supplies that changed since the previous import
+SUPPLY_IMPORT_DELTA = env.bool('SUPPLY_IMPORT_DELTA', default=False)
+# Number of stores whose missing providers are created in one query
+SUPPLY_IMPORT_PROVIDER_BATCH_SIZE = env.int(
+    'SUPPLY_IMPORT_PROVIDER_BATCH_SIZE',
+    default=1000,
+)
+# Number of stores imported by every parallel import task
+SUPPLY_IMPORT_SHARD_SIZE = env.int('SUPPLY_IMPORT_SHARD_SIZE', default=250)
+# Number of times a failed import shard is retried
+SUPPLY_IMPORT_SHARD_MAX_RETRIES = env.int(
+    'SUPPLY_IMPORT_SHARD_MAX_RETRIES',
+    default=3,
+)
+
+# --- SUPPLY HISTORY ---
+# Number of monthly history partitions created ahead of the current month
+SUPPLY_HISTORY_PARTITION_MONTHS_AHEAD = env.int(
+    'SUPPLY_HISTORY_PARTITION_MONTHS_AHEAD',
+    default=3,
+)
+# Monthly history partitions older than this number of months are
+# detached, they are all kept if it is 0
+SUPPLY_HISTORY_RETENTION_MONTHS = env.int(
+    'SUPPLY_HISTORY_RETENTION_MONTHS',
+    default=0,
+)
+# Supply history entries older than this number of days are rolled up
+# into daily supplies, archived and removed, nothing is archived if it is 0
+SUPPLY_HISTORY_RETENTION_DAYS = env.int(
+    'SUPPLY_HISTORY_RETENTION_DAYS',
+    default=0,
+)
+# Directory of the supply history archives in the default file storage
+SUPPLY_HISTORY_ARCHIVE_DIR = env(
+    'SUPPLY_HISTORY_ARCHIVE_DIR',
+    default='supply_history',
+)
+
 # --- CACHE ---
 CACHES = {
     "default": {
@@ -212,13 +282,96 @@ CACHES = {
     }
 }
 
-# CELERY_BEAT_SCHEDULE = {
-#     'import_existing_medications': {
-#         'task': 'medications.tasks.import_existing_medications',
-#         'schedule': crontab(day_of_month=15),
-#         'relative': True,
-#     },
-# }
+# --- SUPPLY TILES ---
+# Seconds the vector tiles are cached for, their cache key changes with
+# every supply import anyway
+SUPPLY_TILE_CACHE_TIMEOUT = env.int(
+    'SUPPLY_TILE_CACHE_TIMEOUT',
+    default=60 * 60 * 24,
+)
+
+# --- RESPONSE CACHE ---
+# Seconds the map, filters and historic responses are cached for, their
+# cache key changes with every supply import anyway
+RESPONSE_CACHE_TIMEOUT = env.int(
+    'RESPONSE_CACHE_TIMEOUT',
+    default=60 * 60 * 24,
+)
+# Compute the most requested responses once an import is finished
+RESPONSE_CACHE_WARM_UP = env.bool(
+    'RESPONSE_CACHE_WARM_UP',
+    default=True,
+)
+
+# --- RESPONSE COMPRESSION ---
+# Compress the map and public finder responses with brotli, when installed,
+# or gzip for the requests accepting it
+RESPONSE_COMPRESSION = env.bool(
+    'RESPONSE_COMPRESSION',
+    default=True,
+)
+RESPONSE_GZIP_LEVEL = env.int(
+    'RESPONSE_GZIP_LEVEL',
+    default=6,
+)
+RESPONSE_BROTLI_QUALITY = env.int(
+    'RESPONSE_BROTLI_QUALITY',
+    default=5,
+)
+
+# --- PUBLIC PROVIDER INDEX ---
+# Answer the searches of the public finder from an index of the providers
+# held in memory by every worker, built by a task after every import and
+# loaded by the workers from the cache
+PUBLIC_PROVIDER_INDEX_ENABLED = env.bool(
+    'PUBLIC_PROVIDER_INDEX_ENABLED',
+    default=False,
+)
+# Size in degrees of the cells of the grid of the index
+PUBLIC_PROVIDER_INDEX_CELL_SIZE = env.float(
+    'PUBLIC_PROVIDER_INDEX_CELL_SIZE',
+    default=0.25,
+)
+
+# --- PUBLIC SEARCH CACHE ---
+# Size in degrees of the cells the public finder searches are cached by,
+# 0.02 is about 2 km, 0 disables the cache
+PUBLIC_SEARCH_CACHE_CELL_SIZE = env.float(
+    'PUBLIC_SEARCH_CACHE_CELL_SIZE',
+    default=0,
+)
+# Most candidates of a cached cell, the cells with more are not cached
+PUBLIC_SEARCH_CACHE_MAX_CANDIDATES = env.int(
+    'PUBLIC_SEARCH_CACHE_MAX_CANDIDATES',
+    default=500,
+)
+# Most cells cached per supply data version
+PUBLIC_SEARCH_CACHE_MAX_ENTRIES = env.int(
+    'PUBLIC_SEARCH_CACHE_MAX_ENTRIES',
+    default=10000,
+)
+# Seconds the candidates of a cell are cached for, their cache key changes
+# with every supply import anyway
+PUBLIC_SEARCH_CACHE_TIMEOUT = env.int(
+    'PUBLIC_SEARCH_CACHE_TIMEOUT',
+    default=60 * 60,
+)
+
+CELERY_BEAT_SCHEDULE = {
+    # 'import_existing_medications': {
+    #     'task': 'medications.tasks.import_existing_medications',
+    #     'schedule': crontab(day_of_month=15),
+    #     'relative': True,
+    # },
+    'archive_supply_history': {
+        'task': 'medications.tasks.archive_supply_history',
+        'schedule': crontab(hour=4, minute=0),
+    },
+    'clean_up_supply_import_spool': {
+        'task': 'medications.tasks.clean_up_supply_import_spool',
+        'schedule': crontab(hour=4, minute=30),
+    },
+}
 
 # DEBUG TOOLBAR
 ENABLE_DEBUG_TOOLBAR = env.bool(
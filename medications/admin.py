@@ -4,7 +4,10 @@ from django.utils.translation import ugettext_lazy as _
 from .forms import ProviderAdminForm
 from .models import (
     County,
+    CurrentProviderSupply,
     ExistingMedication,
+    ImportRun,
+    ImportShard,
     Medication,
     MedicationName,
     MedicationNdc,
@@ -14,6 +17,7 @@ from .models import (
     ProviderType,
     ProviderCategory,
     State,
+    SupplyHistoryArchive,
     ZipCode,
 )
 
@@ -32,6 +36,40 @@ class ProviderMedicationNDCThroughAdmin(admin.ModelAdmin):
         'level',
     )
     readonly_fields = (
+        'creation_date',
+        'date',
+    )
+    search_fields = (
+        'provider__name',
+        'medication_ndc__ndc'
+    )
+
+    def get_queryset(self, request):
+        return super().get_queryset(
+            request
+        ).select_related(
+            'medication_ndc',
+            'medication_ndc__medication',
+            'provider',
+        )
+
+
+@admin.register(CurrentProviderSupply)
+class CurrentProviderSupplyAdmin(admin.ModelAdmin):
+
+    list_display = (
+        '__str__',
+        'creation_date',
+        'date',
+        'level',
+    )
+    list_filter = (
+        'level',
+    )
+    readonly_fields = (
+        'provider',
+        'medication_ndc',
+        'supply',
         'level',
         'creation_date',
         'date',
@@ -51,6 +89,71 @@ class ProviderMedicationNDCThroughAdmin(admin.ModelAdmin):
         )
 
 
+class ImportShardInline(admin.TabularInline):
+    model = ImportShard
+    extra = 0
+    can_delete = False
+    fields = (
+        'number',
+        'status',
+        'row_count',
+        'file_size',
+        'completion_date',
+    )
+    readonly_fields = fields
+
+
+@admin.register(ImportRun)
+class ImportRunAdmin(admin.ModelAdmin):
+
+    inlines = (
+        ImportShardInline,
+    )
+
+    list_display = (
+        '__str__',
+        'creation_date',
+        'status',
+        'row_count',
+        'rejected_row_count',
+        'rows_per_second',
+    )
+    list_filter = (
+        'status',
+    )
+    readonly_fields = [
+        field.name for field in ImportRun._meta.fields
+    ]
+    search_fields = (
+        'file_name',
+        'organization__organization_name',
+        'task_id',
+    )
+
+    def get_queryset(self, request):
+        return super().get_queryset(
+            request
+        ).select_related(
+            'organization',
+        )
+
+
+@admin.register(SupplyHistoryArchive)
+class SupplyHistoryArchiveAdmin(admin.ModelAdmin):
+
+    list_display = (
+        '__str__',
+        'row_count',
+        'rollup_row_count',
+        'deleted_row_count',
+        'file_size',
+        'creation_date',
+    )
+    readonly_fields = [
+        field.name for field in SupplyHistoryArchive._meta.fields
+    ]
+
+
 @admin.register(State)
 class StateAdmin(admin.ModelAdmin):
 
@@ -66,13 +169,17 @@ class StateAdmin(admin.ModelAdmin):
         'population',
         'state_us_id',
         'geometry',
+        'centroid',
+        'bbox',
     )
     readonly_fields = (
         'display_state_code',
         'state_name',
         'population',
         'geometry',
-        'state_us_id'
+        'state_us_id',
+        'centroid',
+        'bbox',
     )
     search_fields = (
         'state_name',
@@ -101,6 +208,8 @@ class ZipCodeAdmin(admin.ModelAdmin):
         'counties',
         'population',
         'geometry',
+        'centroid',
+        'bbox',
     )
     list_filter = (
         'state',
@@ -134,6 +243,8 @@ class CountyAdmin(admin.ModelAdmin):
         'population',
         'geo_id',
         'geometry',
+        'centroid',
+        'bbox',
     )
     readonly_fields = (
         'county_name',
@@ -142,6 +253,8 @@ class CountyAdmin(admin.ModelAdmin):
         'population',
         'geo_id',
         'geometry',
+        'centroid',
+        'bbox',
     )
     search_fields = (
         'county_name',
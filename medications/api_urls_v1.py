@@ -8,9 +8,11 @@ from .views import (
     GeoStatsStatesWithMedicationsView,
     GeoStatsCountiesWithMedicationsView,
     GeoZipCodeWithMedicationsView,
+    ImportRunViewSet,
     MedicationFiltersView,
     MedicationNameViewSet,
     OrganizationViewSet,
+    SupplyTileView,
 )
 
 router = DefaultRouter()
@@ -30,6 +32,11 @@ router.register(
     OrganizationViewSet,
     base_name='organization',
 )
+router.register(
+    r'import_runs',
+    ImportRunViewSet,
+    base_name='import_run',
+)
 
 medications_api_urlpatterns = [
     path(
@@ -48,6 +55,10 @@ medications_api_urlpatterns = [
         'geo_stats/zipcode/<str:zipcode>/',
         GeoZipCodeWithMedicationsView.as_view(),
     ),
+    path(
+        'tiles/<str:layer>/<int:z>/<int:x>/<int:y>.mvt',
+        SupplyTileView.as_view(),
+    ),
     path(
         'csv_export/',
         CSVExportView.as_view(),
@@ -0,0 +1,263 @@
+"""
+Retention of the supply history.
+
+The ProviderMedicationNdcThrough entries older than
+SUPPLY_HISTORY_RETENTION_DAYS days are rolled up into the
+DailyProviderSupply table, which keeps the level of every (provider,
+medication ndc) pair day by day, and written to compressed columnar
+archive files on the default file storage, a local directory or S3
+depending on the settings. The archived entries are then deleted from the
+table, except the last entry of every pair which is carried forward to
+the following days.
+
+An archive is a zip file with a deflated member per column holding the
+bytes of a typed array, and a columns.json member describing them.
+"""
+import hashlib
+import io
+import json
+import os
+import sys
+import zipfile
+
+from array import array
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import prefetch_related_objects
+from django.utils import timezone
+
+from .models import (
+    ProviderMedicationNdcThrough,
+    SupplyHistoryArchive,
+)
+from .partitions import add_months, get_month
+from .spool import open_spooled_file
+
+ARCHIVE_VERSION = 1
+# Column name and array typecode, dates are stored as proleptic Gregorian
+# ordinals and creation dates as microseconds since the epoch
+ARCHIVE_COLUMNS = (
+    ('id', 'i'),
+    ('provider_id', 'i'),
+    ('medication_ndc_id', 'i'),
+    ('level', 'b'),
+    ('date', 'i'),
+    ('creation_date', 'q'),
+    ('latest', 'b'),
+)
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+MICROSECOND = timedelta(microseconds=1)
+
+ArchivedEntry = namedtuple(
+    'ArchivedEntry',
+    [column for column, typecode in ARCHIVE_COLUMNS],
+)
+
+
+def get_archive_name(start_date, end_date):
+    return os.path.join(
+        settings.SUPPLY_HISTORY_ARCHIVE_DIR,
+        'supply_history_{}_{}.zip'.format(
+            start_date.isoformat(),
+            end_date.isoformat(),
+        ),
+    )
+
+
+def build_archive(rows):
+    """
+    Return the bytes of the archive of the rows, tuples of the
+    ARCHIVE_COLUMNS values, and the number of rows.
+    """
+    columns = [array(typecode) for column, typecode in ARCHIVE_COLUMNS]
+    (
+        ids,
+        provider_ids,
+        medication_ndc_ids,
+        levels,
+        dates,
+        creation_dates,
+        latests,
+    ) = columns
+    for row in rows:
+        ids.append(row[0])
+        provider_ids.append(row[1])
+        medication_ndc_ids.append(row[2])
+        levels.append(row[3])
+        dates.append(row[4].toordinal())
+        creation_dates.append((row[5] - EPOCH) // MICROSECOND)
+        latests.append(row[6])
+
+    buff = io.BytesIO()
+    with zipfile.ZipFile(buff, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('columns.json', json.dumps({
+            'version': ARCHIVE_VERSION,
+            'byteorder': sys.byteorder,
+            'row_count': len(ids),
+            'columns': ARCHIVE_COLUMNS,
+        }))
+        for (column, typecode), values in zip(ARCHIVE_COLUMNS, columns):
+            archive.writestr('{}.bin'.format(column), values.tobytes())
+    return buff.getvalue(), len(ids)
+
+
+def read_archive(file_obj):
+    """Return the columns of an archive as a dict of arrays."""
+    with zipfile.ZipFile(file_obj) as archive:
+        description = json.loads(archive.read('columns.json').decode())
+        columns = {}
+        for column, typecode in description['columns']:
+            values = array(typecode)
+            values.frombytes(archive.read('{}.bin'.format(column)))
+            if description['byteorder'] != sys.byteorder:
+                values.byteswap()
+            columns[column] = values
+    return columns
+
+
+def iter_archived_entries(columns):
+    for row in zip(*[columns[column] for column, _ in ARCHIVE_COLUMNS]):
+        (
+            entry_id,
+            provider_id,
+            medication_ndc_id,
+            level,
+            ordinal,
+            creation_date,
+            latest,
+        ) = row
+        yield ArchivedEntry(
+            id=entry_id,
+            provider_id=provider_id,
+            medication_ndc_id=medication_ndc_id,
+            level=level,
+            date=date.fromordinal(ordinal),
+            creation_date=EPOCH + creation_date * MICROSECOND,
+            latest=bool(latest),
+        )
+
+
+def write_archive(start_date, end_date):
+    """
+    Write the archive of the entries between the start_date and end_date
+    dates to the default storage and return its reference.
+    """
+    content, row_count = build_archive(
+        ProviderMedicationNdcThrough.objects.filter(
+            date__range=(start_date, end_date),
+        ).order_by(
+            'id',
+        ).values_list(
+            *[column for column, typecode in ARCHIVE_COLUMNS]
+        ).iterator()
+    )
+    name = default_storage.save(
+        get_archive_name(start_date, end_date),
+        ContentFile(content),
+    )
+    return {
+        'name': name,
+        'checksum': hashlib.sha256(content).hexdigest(),
+        'size': len(content),
+        'row_count': row_count,
+    }
+
+
+def archive_supply_history_range(start_date, end_date):
+    """
+    Roll up, archive and delete the entries between the start_date and
+    end_date dates in a single transaction.
+    """
+    with transaction.atomic():
+        archive_file = write_archive(start_date, end_date)
+        try:
+            rollup_row_count = (
+                ProviderMedicationNdcThrough.objects.rollup_daily_supplies(
+                    start_date,
+                    end_date,
+                )
+            )
+            deleted_row_count = (
+                ProviderMedicationNdcThrough.objects.delete_replaced_entries(
+                    end_date,
+                )
+            )
+            return SupplyHistoryArchive.objects.create(
+                deleted_row_count=deleted_row_count,
+                end_date=end_date,
+                file_checksum=archive_file['checksum'],
+                file_name=archive_file['name'],
+                file_size=archive_file['size'],
+                rollup_row_count=rollup_row_count,
+                row_count=archive_file['row_count'],
+                start_date=start_date,
+            )
+        except Exception:
+            default_storage.delete(archive_file['name'])
+            raise
+
+
+def archive_supply_history(retention_days=None):
+    """
+    Archive the entries older than retention_days days, one month at a
+    time, and return the created SupplyHistoryArchive objects. Nothing is
+    archived if retention_days is 0.
+    """
+    if retention_days is None:
+        retention_days = settings.SUPPLY_HISTORY_RETENTION_DAYS
+    if not retention_days:
+        return []
+
+    horizon = timezone.now().date() - timedelta(days=retention_days)
+    start_date = SupplyHistoryArchive.objects.get_archived_until()
+    if start_date is None:
+        start_date = ProviderMedicationNdcThrough.objects.order_by(
+            'date',
+        ).values_list('date', flat=True).first()
+
+    archives = []
+    while start_date is not None and start_date < horizon:
+        end_date = min(
+            add_months(get_month(start_date), 1),
+            horizon,
+        ) - timedelta(days=1)
+        archives.append(archive_supply_history_range(start_date, end_date))
+        start_date = end_date + timedelta(days=1)
+    return archives
+
+
+def get_archived_entries(entry_ids):
+    """
+    Return a dict of unsaved ProviderMedicationNdcThrough objects of the
+    archived entries with the given ids, with their provider and
+    medication ndc prefetched like the CSV export does.
+    """
+    entry_ids = set(entry_ids)
+    entries = {}
+    for archive in SupplyHistoryArchive.objects.order_by('-start_date'):
+        if not entry_ids:
+            break
+        with open_spooled_file(archive.get_archive_file()) as archive_file:
+            columns = read_archive(archive_file)
+        for archived_entry in iter_archived_entries(columns):
+            if archived_entry.id in entry_ids:
+                entry_ids.discard(archived_entry.id)
+                entries[archived_entry.id] = ProviderMedicationNdcThrough(
+                    **archived_entry._asdict()
+                )
+
+    prefetch_related_objects(
+        list(entries.values()),
+        'provider',
+        'provider__organization',
+        'provider__type',
+        'provider__category',
+        'medication_ndc__medication',
+        'medication_ndc__medication__medication_name',
+    )
+    return entries
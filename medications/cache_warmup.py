@@ -0,0 +1,117 @@
+"""
+Warm up of the response cache after the supply imports.
+
+The most requested views are the national and state maps and filters of a
+medication with all its dosages and all the provider categories and types,
+as first shown by the frontend. They are requested through the views
+themselves, as a national level user, so the cached responses are the ones
+the users get.
+"""
+from django.contrib.auth import get_user_model
+
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from .models import (
+    MedicationMedicationNameMedicationDosageThrough,
+    MedicationName,
+    ProviderCategory,
+    ProviderType,
+    State,
+)
+
+
+def get_cached_views():
+    """Return the views caching their responses."""
+    from historic.views import HistoricAverageView, HistoricOverallView
+    from .views import (
+        GeoStatsCountiesWithMedicationsView,
+        GeoStatsStatesWithMedicationsView,
+        GeoZipCodeWithMedicationsView,
+        MedicationFiltersView,
+    )
+
+    return (
+        GeoStatsStatesWithMedicationsView,
+        GeoStatsCountiesWithMedicationsView,
+        GeoZipCodeWithMedicationsView,
+        MedicationFiltersView,
+        HistoricAverageView,
+        HistoricOverallView,
+    )
+
+
+def get_default_filters():
+    """
+    Yield the query params of the default map of every medication name.
+    """
+    provider_category_ids = list(
+        ProviderCategory.objects.values_list('id', flat=True),
+    )
+    provider_type_ids = list(ProviderType.objects.values_list('id', flat=True))
+    dosage_ids = {}
+    for medication_name_id, dosage_id in (
+        MedicationMedicationNameMedicationDosageThrough.objects.values_list(
+            'medication_name_id',
+            'medication_dosage_id',
+        ).distinct()
+    ):
+        dosage_ids.setdefault(medication_name_id, []).append(dosage_id)
+
+    for medication_name_id in MedicationName.objects.order_by(
+        'id',
+    ).values_list('id', flat=True):
+        yield {
+            'med_id': medication_name_id,
+            'dosages[]': sorted(dosage_ids.get(medication_name_id, [])),
+            'provider_categories[]': provider_category_ids,
+            'provider_types[]': provider_type_ids,
+        }
+
+
+def warm_response_cache(state_ids=None):
+    """
+    Request the national and state maps and filters of the default
+    filters of every medication name, for the given states or all of them,
+    and return the number of responses requested.
+    """
+    from .views import (
+        GeoStatsCountiesWithMedicationsView,
+        GeoStatsStatesWithMedicationsView,
+        MedicationFiltersView,
+    )
+
+    User = get_user_model()
+    user = User(permission_level=User.NATIONAL_LEVEL)
+    factory = APIRequestFactory()
+    if state_ids is None:
+        state_ids = State.objects.order_by('id').values_list('id', flat=True)
+    state_ids = list(state_ids)
+
+    views = [
+        (GeoStatsStatesWithMedicationsView.as_view(), {}, {}),
+        (MedicationFiltersView.as_view(), {}, {}),
+    ]
+    for state_id in state_ids:
+        views.append((
+            GeoStatsCountiesWithMedicationsView.as_view(),
+            {'state_id': state_id},
+            {},
+        ))
+        views.append((
+            MedicationFiltersView.as_view(),
+            {},
+            {'state_id': state_id},
+        ))
+
+    request_count = 0
+    for filters in get_default_filters():
+        for view, kwargs, params in views:
+            request = factory.get(
+                '/',
+                dict(filters, **params),
+                HTTP_ACCEPT='application/json',
+            )
+            force_authenticate(request, user=user)
+            view(request, **kwargs)
+            request_count += 1
+    return request_count
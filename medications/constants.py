@@ -1,3 +1,6 @@
+from collections import OrderedDict
+from enum import IntEnum
+
 # List of the required rows in the CSV medications file
 field_rows = [
     'store #',
@@ -10,3 +13,59 @@ field_rows = [
     'med_name',
     'supply_level',
 ]
+
+
+class SupplyLevel(IntEnum):
+    """
+    Supply level of a medication in a provider, stored as a smallint. The
+    supply strings of the CSV files are only used to display the levels.
+    """
+    NO_REPORT = -1
+    NO_SUPPLY = 0
+    LESS_THAN_24_HOURS = 1
+    HOURS_24 = 2
+    HOURS_24_TO_48 = 3
+    MORE_THAN_48_HOURS = 4
+
+    @property
+    def supply(self):
+        return supply_strings[self]
+
+    @classmethod
+    def from_supply(cls, supply):
+        """Return the level of a supply string, NO_SUPPLY if unknown."""
+        return supply_levels.get(supply, cls.NO_SUPPLY)
+
+    @classmethod
+    def get(cls, level):
+        """Return the SupplyLevel of a stored level, NO_SUPPLY if unknown."""
+        try:
+            return cls(level)
+        except ValueError:
+            return cls.NO_SUPPLY
+
+
+# Supply strings of the supply_level column of the CSV medications file
+supply_strings = {
+    SupplyLevel.NO_REPORT: 'NO REPORT',
+    SupplyLevel.NO_SUPPLY: 'NO SUPPLY',
+    SupplyLevel.LESS_THAN_24_HOURS: '<24',
+    SupplyLevel.HOURS_24: '24',
+    SupplyLevel.HOURS_24_TO_48: '24-48',
+    SupplyLevel.MORE_THAN_48_HOURS: '>48',
+}
+supply_levels = {
+    supply: level for level, supply in supply_strings.items()
+}
+SUPPLY_LEVEL_CHOICES = [
+    (level.value, supply) for level, supply in sorted(supply_strings.items())
+]
+# Groups of levels counted by the maps, from the supplies of the providers
+# of a geography
+SUPPLY_LEVEL_GROUPS = OrderedDict((
+    ('noreport', (SupplyLevel.NO_REPORT,)),
+    ('nosupply', (SupplyLevel.NO_SUPPLY,)),
+    ('low', (SupplyLevel.LESS_THAN_24_HOURS,)),
+    ('medium', (SupplyLevel.HOURS_24, SupplyLevel.HOURS_24_TO_48)),
+    ('high', (SupplyLevel.MORE_THAN_48_HOURS,)),
+))
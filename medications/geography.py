@@ -0,0 +1,37 @@
+"""
+Centroids and bounding boxes of the states, counties and zip codes.
+
+They are stored along the geometries so the views do not compute them on
+every request. The save method of the models keeps them up to date and
+update_centers computes them in bulk for the rows loaded or changed
+without it. The function takes a cursor so it can be used by the
+migration adding the columns as well as by the calculate_centers command.
+"""
+
+
+def update_centers(cursor, table, ids=None):
+    """
+    Compute the centroid and bounding box of the geographies of a table,
+    all of them or the ones with the given ids, and return the number of
+    updated rows.
+    """
+    cursor.execute(
+        'UPDATE {table} '
+        'SET centroid = ST_Centroid(geometry), bbox = ST_Envelope(geometry) '
+        '{ids_filter}'.format(
+            ids_filter='WHERE id = ANY(%(ids)s)' if ids is not None else '',
+            table=table,
+        ),
+        {'ids': list(ids or [])},
+    )
+    return cursor.rowcount
+
+
+def get_centers(geometry):
+    """
+    Return the centroid and bounding box of a geometry, computed by GEOS
+    like PostGIS does.
+    """
+    if geometry is None:
+        return None, None
+    return geometry.centroid, geometry.envelope
@@ -0,0 +1,141 @@
+"""
+Helpers to read the supply level CSV files uploaded by the organizations.
+
+The files are read incrementally and grouped per store with an external
+merge sort: rows are sorted in chunks of a bounded size, every chunk is
+spilled to a temporary file and the chunks are merged back while grouping
+them by store number. This way the memory used by an import does not
+depend on the size of the uploaded file.
+
+The sorted stores can also be split in shards of whole stores, written
+back as smaller CSV files, so several workers can import them in parallel.
+"""
+import csv
+import heapq
+import io
+import itertools
+import tempfile
+
+from django.conf import settings
+
+from .constants import field_rows
+
+
+def store_sort_key(row):
+    return float(row['store #'])
+
+
+def iter_csv_rows(file_obj, encoding='utf-8'):
+    """
+    Yield the rows of a binary CSV file object as dicts, decoding the
+    file on the fly instead of loading it whole in memory.
+    """
+    binary_file = getattr(file_obj, 'file', file_obj)
+    text_file = io.TextIOWrapper(binary_file, encoding=encoding, newline='')
+    try:
+        for row in csv.DictReader(text_file):
+            yield row
+    finally:
+        # Do not close the underlying file, it belongs to the caller
+        text_file.detach()
+
+
+def _spill_chunk(chunk):
+    spill_file = tempfile.TemporaryFile(mode='w+', newline='')
+    writer = csv.writer(spill_file)
+    for row in chunk:
+        writer.writerow([row.get(field) for field in field_rows])
+    spill_file.seek(0)
+    return spill_file
+
+
+def _iter_spilled_rows(spill_file):
+    for values in csv.reader(spill_file):
+        yield dict(zip(field_rows, values))
+
+
+def sort_rows_by_store(rows, chunk_size=None):
+    """
+    Sort an iterable of CSV rows by store number keeping at most
+    `chunk_size` rows in memory at the same time.
+    """
+    if chunk_size is None:
+        chunk_size = settings.SUPPLY_IMPORT_SORT_CHUNK_SIZE
+
+    rows = iter(rows)
+    first_chunk = list(itertools.islice(rows, chunk_size))
+    first_chunk.sort(key=store_sort_key)
+    next_chunk = list(itertools.islice(rows, chunk_size))
+
+    # Small files fit in one chunk, no need to touch the disk
+    if not next_chunk:
+        yield from first_chunk
+        return
+
+    spill_files = [_spill_chunk(first_chunk)]
+    del first_chunk
+    try:
+        while next_chunk:
+            next_chunk.sort(key=store_sort_key)
+            spill_files.append(_spill_chunk(next_chunk))
+            next_chunk = list(itertools.islice(rows, chunk_size))
+
+        yield from heapq.merge(
+            *[_iter_spilled_rows(spill_file) for spill_file in spill_files],
+            key=store_sort_key
+        )
+    finally:
+        for spill_file in spill_files:
+            spill_file.close()
+
+
+def get_store_data(row):
+    return {
+        'address': row.get('address'),
+        'city': row.get('city'),
+        'phone': row.get('phone'),
+        'state': row.get('state'),
+        'store_number': row.get('store #'),
+        'zip': row.get('zipcode'),
+    }
+
+
+def iter_store_groups(file_obj, chunk_size=None):
+    """
+    Yield a (store_data, rows) tuple for every store in the CSV file,
+    where rows is the list of CSV rows of that store.
+    """
+    sorted_rows = sort_rows_by_store(iter_csv_rows(file_obj), chunk_size)
+    for store_number, store_rows in itertools.groupby(
+        sorted_rows,
+        key=lambda row: row.get('store #'),
+    ):
+        store_rows = list(store_rows)
+        yield get_store_data(store_rows[0]), store_rows
+
+
+def _write_shard(store_groups):
+    buff = io.StringIO(newline='')
+    writer = csv.writer(buff)
+    writer.writerow(field_rows)
+    for store_data, rows in store_groups:
+        for row in rows:
+            writer.writerow([row.get(field) for field in field_rows])
+    return buff.getvalue().encode('utf-8')
+
+
+def iter_store_shards(file_obj, stores_per_shard=None, chunk_size=None):
+    """
+    Split the CSV file in shards of at most `stores_per_shard` stores and
+    yield every shard as the bytes of a CSV file. The rows of a store are
+    never split across two shards.
+    """
+    if stores_per_shard is None:
+        stores_per_shard = settings.SUPPLY_IMPORT_SHARD_SIZE
+
+    store_groups = iter_store_groups(file_obj, chunk_size)
+    while True:
+        shard = list(itertools.islice(store_groups, stores_per_shard))
+        if not shard:
+            return
+        yield _write_shard(shard)
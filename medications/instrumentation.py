@@ -0,0 +1,79 @@
+"""
+Counters and per phase timings of the supply imports.
+
+An ImportStats is filled by every task taking part in an import and the
+stats of the shards are merged by the task finishing the import, which
+records them in the ImportRun of the upload.
+"""
+import resource
+import time
+
+from contextlib import contextmanager
+
+
+class ImportStats:
+    PHASES = (
+        'read',
+        'parse',
+        'provider_resolution',
+        'no_report_fill',
+        'insert',
+        'finish',
+    )
+    COUNTERS = (
+        'rows',
+        'rejected_rows',
+        'unchanged_rows',
+        'no_report_rows',
+        'providers',
+        'created_providers',
+    )
+
+    def __init__(self):
+        self.durations = dict.fromkeys(self.PHASES, 0.0)
+        self.counters = dict.fromkeys(self.COUNTERS, 0)
+        self.peak_memory = 0
+
+    @contextmanager
+    def phase(self, name):
+        """Add the time spent in the with block to the given phase."""
+        beginning_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.durations[name] += time.perf_counter() - beginning_time
+
+    def count(self, name, value=1):
+        self.counters[name] += value
+
+    def measure_peak_memory(self):
+        # ru_maxrss is in kilobytes on Linux, it is the high water mark of
+        # the worker process, not only of the current task
+        self.peak_memory = max(
+            self.peak_memory,
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        )
+
+    def merge(self, other):
+        """Add the durations and counters of another ImportStats."""
+        for name, duration in other.durations.items():
+            self.durations[name] += duration
+        for name, value in other.counters.items():
+            self.counters[name] += value
+        self.peak_memory = max(self.peak_memory, other.peak_memory)
+
+    def as_dict(self):
+        """Return the stats as a dict that can be sent to a task."""
+        return {
+            'durations': self.durations,
+            'counters': self.counters,
+            'peak_memory': self.peak_memory,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        stats = cls()
+        stats.durations.update(data['durations'])
+        stats.counters.update(data['counters'])
+        stats.peak_memory = data['peak_memory']
+        return stats
@@ -0,0 +1,211 @@
+"""
+Backends used by the supply level import to write the imported rows into
+the ProviderMedicationNdcThrough table.
+
+Every backend consumes either an iterable of SupplyRow tuples in chunks of
+a configurable size or an iterable of SupplyBatch, writing every chunk or
+batch inside its own transaction, so the rows of an import are never held
+in memory all at once.
+"""
+import csv
+import io
+import itertools
+
+from array import array
+from collections import namedtuple
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from .models import ProviderMedicationNdcThrough
+
+
+SupplyRow = namedtuple(
+    'SupplyRow',
+    [
+        'provider_id',
+        'medication_ndc_id',
+        'level',
+        'date',
+        'creation_date',
+        'latest',
+    ],
+)
+
+
+class SupplyBatch:
+    """
+    Columnar batch of imported rows sharing the same date, creation date
+    and latest flag. Instead of an object per row the batch keeps typed
+    arrays: int32 provider and medication ndc ids and int8 levels.
+    """
+
+    def __init__(self, date, creation_date, latest):
+        self.date = date
+        self.creation_date = creation_date
+        self.latest = latest
+        self.provider_ids = array('i')
+        self.medication_ndc_ids = array('i')
+        self.levels = array('b')
+
+    def __len__(self):
+        return len(self.provider_ids)
+
+    def append(self, provider_id, medication_ndc_id, level):
+        self.provider_ids.append(provider_id)
+        self.medication_ndc_ids.append(medication_ndc_id)
+        self.levels.append(level)
+
+    def iter_rows(self):
+        for provider_id, medication_ndc_id, level in zip(
+            self.provider_ids,
+            self.medication_ndc_ids,
+            self.levels,
+        ):
+            yield SupplyRow(
+                provider_id=provider_id,
+                medication_ndc_id=medication_ndc_id,
+                level=level,
+                date=self.date,
+                creation_date=self.creation_date,
+                latest=self.latest,
+            )
+
+
+class BulkCreateLoader:
+    """Insert the rows with the ORM bulk_create."""
+    name = 'bulk_create'
+
+    def __init__(self, chunk_size=None):
+        self.chunk_size = chunk_size or settings.SUPPLY_IMPORT_BATCH_SIZE
+
+    def iter_chunks(self, rows):
+        rows = iter(rows)
+        while True:
+            chunk = list(itertools.islice(rows, self.chunk_size))
+            if not chunk:
+                return
+            yield chunk
+
+    def load(self, rows):
+        """Write all the rows and return how many of them were written."""
+        count = 0
+        for chunk in self.iter_chunks(rows):
+            with transaction.atomic():
+                self.load_chunk(chunk)
+            count += len(chunk)
+        return count
+
+    def load_batches(self, batches):
+        """Write all the batches and return how many rows were written."""
+        count = 0
+        for batch in batches:
+            with transaction.atomic():
+                self.load_batch(batch)
+            count += len(batch)
+        return count
+
+    def load_chunk(self, chunk):
+        ProviderMedicationNdcThrough.objects.bulk_create(
+            [ProviderMedicationNdcThrough(**row._asdict()) for row in chunk]
+        )
+
+    def load_batch(self, batch):
+        ProviderMedicationNdcThrough.objects.bulk_create(
+            [
+                ProviderMedicationNdcThrough(**row._asdict())
+                for row in batch.iter_rows()
+            ],
+            batch_size=self.chunk_size,
+        )
+
+
+class CopyLoader(BulkCreateLoader):
+    """Stream the rows with PostgreSQL COPY FROM STDIN in CSV format."""
+    name = 'copy'
+
+    def __init__(self, chunk_size=None):
+        super().__init__(chunk_size)
+        opts = ProviderMedicationNdcThrough._meta
+        columns = [opts.get_field(field).column for field in SupplyRow._fields]
+        self.copy_sql = (
+            'COPY {table} ({columns}) FROM STDIN WITH (FORMAT csv)'
+        ).format(
+            table=connection.ops.quote_name(opts.db_table),
+            columns=', '.join(connection.ops.quote_name(c) for c in columns),
+        )
+
+    @staticmethod
+    def format_value(value):
+        if value is None:
+            return ''
+        if isinstance(value, bool):
+            return 't' if value else 'f'
+        if isinstance(value, int):
+            # SupplyLevel members are written as their value
+            return int(value)
+        if hasattr(value, 'isoformat'):
+            return value.isoformat()
+        return value
+
+    @classmethod
+    def format_csv_value(cls, value):
+        buff = io.StringIO()
+        csv.writer(buff, lineterminator='').writerow([cls.format_value(value)])
+        return buff.getvalue()
+
+    def format_batch(self, batch):
+        """Return the batch rows as a CSV file object for COPY."""
+        # Columns shared by all the rows are formatted only once
+        line_format = '%d,%d,%d,{},{},{}\n'.format(
+            *[
+                self.format_csv_value(value).replace('%', '%%')
+                for value in (batch.date, batch.creation_date, batch.latest)
+            ]
+        )
+        buff = io.StringIO()
+        buff.writelines(
+            line_format % row
+            for row in zip(
+                batch.provider_ids,
+                batch.medication_ndc_ids,
+                batch.levels,
+            )
+        )
+        buff.seek(0)
+        return buff
+
+    def copy(self, buff):
+        with connection.cursor() as cursor:
+            cursor.copy_expert(self.copy_sql, buff)
+
+    def load_chunk(self, chunk):
+        buff = io.StringIO()
+        writer = csv.writer(buff)
+        for row in chunk:
+            writer.writerow([self.format_value(value) for value in row])
+        buff.seek(0)
+        self.copy(buff)
+
+    def load_batch(self, batch):
+        self.copy(self.format_batch(batch))
+
+
+LOADERS = {
+    loader_class.name: loader_class
+    for loader_class in (BulkCreateLoader, CopyLoader)
+}
+
+
+def get_loader(name=None, chunk_size=None):
+    name = name or settings.SUPPLY_IMPORT_LOADER
+    try:
+        loader_class = LOADERS[name]
+    except KeyError:
+        raise ValueError(
+            'Unknown supply loader "{}", use one of: {}'.format(
+                name,
+                ', '.join(sorted(LOADERS)),
+            )
+        )
+    return loader_class(chunk_size)
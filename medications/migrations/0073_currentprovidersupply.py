@@ -0,0 +1,50 @@
+# Generated by Django 2.0.9 on 2019-01-22 15:04
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medications', '0072_auto_20190118_0127'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CurrentProviderSupply',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('supply', models.CharField(max_length=32, verbose_name='medication supply')),
+                ('level', models.IntegerField(default=0, verbose_name='medication level')),
+                ('date', models.DateField(verbose_name='date')),
+                ('creation_date', models.DateTimeField(verbose_name='creation date')),
+                ('medication_ndc', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='current_supplies', to='medications.MedicationNdc')),
+                ('provider', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='current_supplies', to='medications.Provider')),
+            ],
+            options={
+                'verbose_name': 'current provider supply',
+                'verbose_name_plural': 'current provider supplies',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='currentprovidersupply',
+            index=models.Index(fields=['medication_ndc_id', 'provider_id'], name='medications_medicat_6be3b0_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='currentprovidersupply',
+            unique_together={('provider', 'medication_ndc')},
+        ),
+        migrations.RunSQL(
+            sql=(
+                'INSERT INTO medications_currentprovidersupply '
+                '(provider_id, medication_ndc_id, supply, level, date, creation_date) '
+                'SELECT DISTINCT ON (provider_id, medication_ndc_id) '
+                'provider_id, medication_ndc_id, supply, level, date, creation_date '
+                'FROM medications_providermedicationndcthrough '
+                'WHERE latest AND medication_ndc_id IS NOT NULL '
+                'ORDER BY provider_id, medication_ndc_id, creation_date DESC'
+            ),
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 2.0.9 on 2019-01-24 10:12
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('medications', '0073_currentprovidersupply'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportRun',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file_name', models.CharField(blank=True, max_length=255, verbose_name='file name')),
+                ('import_date', models.DateTimeField(blank=True, help_text='Date of the supplies when importing past supplies.', null=True, verbose_name='import date')),
+                ('task_id', models.CharField(blank=True, max_length=255, verbose_name='task id')),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('success', 'Success'), ('failed', 'Failed')], default='queued', max_length=10, verbose_name='status')),
+                ('error', models.TextField(blank=True, verbose_name='error')),
+                ('creation_date', models.DateTimeField(default=django.utils.timezone.now, verbose_name='creation date')),
+                ('start_date', models.DateTimeField(blank=True, null=True, verbose_name='start date')),
+                ('end_date', models.DateTimeField(blank=True, null=True, verbose_name='end date')),
+                ('row_count', models.PositiveIntegerField(default=0, verbose_name='rows')),
+                ('rejected_row_count', models.PositiveIntegerField(default=0, help_text='Rows with an unknown NDC code.', verbose_name='rejected rows')),
+                ('no_report_row_count', models.PositiveIntegerField(default=0, verbose_name='no report rows')),
+                ('provider_count', models.PositiveIntegerField(default=0, verbose_name='providers')),
+                ('created_provider_count', models.PositiveIntegerField(default=0, verbose_name='created providers')),
+                ('shard_count', models.PositiveIntegerField(default=0, verbose_name='shards')),
+                ('rows_per_second', models.FloatField(blank=True, null=True, verbose_name='rows per second')),
+                ('peak_memory', models.PositiveIntegerField(blank=True, help_text='Highest resident memory of the workers, in kilobytes.', null=True, verbose_name='peak memory')),
+                ('read_duration', models.FloatField(default=0, verbose_name='read duration')),
+                ('parse_duration', models.FloatField(default=0, verbose_name='parse and sort duration')),
+                ('provider_resolution_duration', models.FloatField(default=0, verbose_name='provider resolution duration')),
+                ('no_report_fill_duration', models.FloatField(default=0, verbose_name='no report fill duration')),
+                ('insert_duration', models.FloatField(default=0, verbose_name='insert duration')),
+                ('finish_duration', models.FloatField(default=0, verbose_name='mark past and active duration')),
+                ('organization', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='import_runs', to='medications.Organization')),
+                ('user', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='import_runs', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'import run',
+                'verbose_name_plural': 'import runs',
+                'ordering': ('-creation_date',),
+            },
+        ),
+        migrations.AddIndex(
+            model_name='importrun',
+            index=models.Index(fields=['organization_id', 'creation_date'], name='medications_organiz_c311ef_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 2.0.9 on 2019-01-28 09:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medications', '0074_importrun'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='provider',
+            name='supply_as_of',
+            field=models.DateTimeField(blank=True, help_text='Last import confirming the supplies of this provider, the latest supplies are still valid until this date even if they were created before.', null=True, verbose_name='supply unchanged as of'),
+        ),
+        migrations.AddField(
+            model_name='importrun',
+            name='unchanged_row_count',
+            field=models.PositiveIntegerField(default=0, help_text='Rows skipped by a delta import.', verbose_name='unchanged rows'),
+        ),
+        # The providers were confirmed by their last full import
+        migrations.RunSQL(
+            'UPDATE medications_provider SET supply_as_of = last_import_date',
+            migrations.RunSQL.noop,
+        ),
+    ]
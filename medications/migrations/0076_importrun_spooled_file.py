@@ -0,0 +1,28 @@
+# Generated by Django 2.0.9 on 2019-01-30 14:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medications', '0075_delta_supply_import'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importrun',
+            name='spool_name',
+            field=models.CharField(blank=True, max_length=255, verbose_name='spooled file name'),
+        ),
+        migrations.AddField(
+            model_name='importrun',
+            name='file_checksum',
+            field=models.CharField(blank=True, help_text='SHA-256 checksum of the uploaded file.', max_length=64, verbose_name='file checksum'),
+        ),
+        migrations.AddField(
+            model_name='importrun',
+            name='file_size',
+            field=models.BigIntegerField(blank=True, help_text='Size of the uploaded file, in bytes.', null=True, verbose_name='file size'),
+        ),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 2.0.9 on 2019-02-04 10:37
+
+import django.contrib.postgres.fields
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medications', '0076_importrun_spooled_file'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importrun',
+            name='import_key',
+            field=models.CharField(blank=True, db_index=True, help_text='Hash of the file checksum, the organization and the day of the supplies, identifying the duplicate uploads.', max_length=64, verbose_name='import key'),
+        ),
+        migrations.AlterField(
+            model_name='importrun',
+            name='status',
+            field=models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('success', 'Success'), ('failed', 'Failed'), ('skipped', 'Skipped')], default='queued', max_length=10, verbose_name='status'),
+        ),
+        # Only one active run per import key, a failed import can be
+        # uploaded again to resume it
+        migrations.RunSQL(
+            sql="""
+                CREATE UNIQUE INDEX medications_importrun_active_import_key
+                ON medications_importrun (import_key)
+                WHERE import_key <> ''
+                AND status IN ('queued', 'running', 'success');
+            """,
+            reverse_sql="""
+                DROP INDEX medications_importrun_active_import_key;
+            """,
+        ),
+        migrations.CreateModel(
+            name='ImportShard',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number', models.PositiveIntegerField(verbose_name='number')),
+                ('spool_name', models.CharField(max_length=255, verbose_name='spooled file name')),
+                ('file_checksum', models.CharField(max_length=64, verbose_name='file checksum')),
+                ('file_size', models.BigIntegerField(verbose_name='file size')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('done', 'Done')], default='pending', max_length=10, verbose_name='status')),
+                ('row_count', models.PositiveIntegerField(default=0, verbose_name='rows')),
+                ('provider_ids', django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), blank=True, default=list, size=None, verbose_name='updated providers')),
+                ('stats', django.contrib.postgres.fields.jsonb.JSONField(blank=True, null=True, verbose_name='stats')),
+                ('completion_date', models.DateTimeField(blank=True, null=True, verbose_name='completion date')),
+                ('import_run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shards', to='medications.ImportRun')),
+            ],
+            options={
+                'verbose_name': 'import shard',
+                'verbose_name_plural': 'import shards',
+                'ordering': ('import_run', 'number'),
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='importshard',
+            unique_together={('import_run', 'number')},
+        ),
+    ]
@@ -0,0 +1,276 @@
+# Generated by Django 2.0.9 on 2019-02-06 16:05
+
+import re
+
+from django.db import migrations, transaction
+from django.utils import timezone
+
+from medications.partitions import (
+    add_months,
+    get_default_partition_name,
+    get_month,
+    get_next_month,
+    get_partition_name,
+    iter_months,
+)
+
+HISTORY_TABLE = 'medications_providermedicationndcthrough'
+# The new table is built under this name and swapped at the end
+NEW_HISTORY_TABLE = '{}_new'.format(HISTORY_TABLE)
+# Months created ahead of the current one, manage_supply_partitions
+# creates the following ones
+MONTHS_AHEAD = 3
+
+
+def get_temporary_name(name):
+    # Identifiers are truncated to 63 bytes by PostgreSQL
+    return '{}_new'.format(name[:59])
+
+
+def get_table_definition(cursor, table):
+    """
+    Return the definitions of the indexes, the foreign keys, the primary key
+    name and the id sequence of the table.
+    """
+    cursor.execute(
+        'SELECT indexname, indexdef FROM pg_indexes '
+        'WHERE tablename = %s AND indexname NOT IN ('
+        '    SELECT conname FROM pg_constraint'
+        '    WHERE conrelid = %s::regclass'
+        ')',
+        [table, table],
+    )
+    indexes = cursor.fetchall()
+    cursor.execute(
+        'SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint '
+        'WHERE conrelid = %s::regclass AND contype = %s',
+        [table, 'f'],
+    )
+    foreign_keys = cursor.fetchall()
+    cursor.execute(
+        'SELECT conname FROM pg_constraint '
+        'WHERE conrelid = %s::regclass AND contype = %s',
+        [table, 'p'],
+    )
+    primary_key, = cursor.fetchone()
+    cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [table])
+    sequence, = cursor.fetchone()
+    return indexes, foreign_keys, primary_key, sequence
+
+
+def rebuild_history_table(schema_editor, partitioned):
+    """
+    Copy the history table into a new table, partitioned by month on its
+    date column or not, keeping its sequence, indexes and foreign keys.
+
+    The history is too big to be copied in a single transaction, it would
+    block the imports during the whole copy. The migration is not atomic:
+
+    1. the new table is created under a temporary name and the rows
+       existing when the migration starts are copied month by month, each
+       month in its own transaction, while the imports keep writing to the
+       current table,
+    2. its primary key, indexes and foreign keys are built,
+    3. a last short transaction blocks the writes to the current table,
+       copies the rows written and the latest flags cleared meanwhile and
+       swaps the tables.
+
+    The reads are never blocked. Runbook:
+
+    - the database needs the free space of a second copy of the history,
+      the current table being only dropped by the last transaction,
+    - archive_supply_history deletes history rows, which would be kept by
+      the copy, so disable its periodic task during the migration,
+    - if the migration is interrupted, drop the
+      medications_providermedicationndcthrough_new table and its
+      partitions before running it again.
+    """
+    table = HISTORY_TABLE
+    new_table = NEW_HISTORY_TABLE
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        indexes, foreign_keys, primary_key, sequence = get_table_definition(
+            cursor,
+            table,
+        )
+        cursor.execute(
+            'SELECT min(date), max(date), max(id) FROM {}'.format(table)
+        )
+        min_date, max_date, max_id = cursor.fetchone()
+        max_id = max_id or 0
+        today = timezone.now().date()
+        first_month = get_month(min(min_date or today, today))
+        last_month = add_months(get_month(today), MONTHS_AHEAD)
+        last_month = max(last_month, get_month(max_date or last_month))
+
+        with transaction.atomic(using=connection.alias):
+            if partitioned:
+                cursor.execute(
+                    'CREATE TABLE {} (LIKE {} INCLUDING DEFAULTS) '
+                    'PARTITION BY RANGE (date)'.format(new_table, table)
+                )
+                # The partitions have their final names already, the
+                # current table not being partitioned
+                cursor.execute(
+                    'CREATE TABLE {} PARTITION OF {} DEFAULT'.format(
+                        get_default_partition_name(table),
+                        new_table,
+                    )
+                )
+            else:
+                cursor.execute(
+                    'CREATE TABLE {} (LIKE {} INCLUDING DEFAULTS)'.format(
+                        new_table,
+                        table,
+                    )
+                )
+
+        for month in iter_months(first_month, last_month):
+            params = {
+                'start_date': month,
+                'end_date': get_next_month(month),
+                'max_id': max_id,
+            }
+            with transaction.atomic(using=connection.alias):
+                if partitioned:
+                    # Filled before being attached, so the rows are only
+                    # checked once against the partition bounds
+                    target = get_partition_name(table, month)
+                    cursor.execute(
+                        'CREATE TABLE {} (LIKE {} INCLUDING DEFAULTS)'.format(
+                            target,
+                            new_table,
+                        )
+                    )
+                else:
+                    target = new_table
+                cursor.execute(
+                    'INSERT INTO {target} SELECT * FROM {table} '
+                    'WHERE date >= %(start_date)s AND date < %(end_date)s '
+                    'AND id <= %(max_id)s'.format(target=target, table=table),
+                    params,
+                )
+                if partitioned:
+                    cursor.execute(
+                        'ALTER TABLE {} ATTACH PARTITION {} '
+                        'FOR VALUES FROM (%(start_date)s) '
+                        'TO (%(end_date)s)'.format(new_table, target),
+                        params,
+                    )
+        with transaction.atomic(using=connection.alias):
+            cursor.execute(
+                'INSERT INTO {} SELECT * FROM {} '
+                'WHERE (date < %(start_date)s OR date >= %(end_date)s) '
+                'AND id <= %(max_id)s'.format(new_table, table),
+                {
+                    'start_date': first_month,
+                    'end_date': get_next_month(last_month),
+                    'max_id': max_id,
+                },
+            )
+
+        # The partition key has to be part of the primary key
+        cursor.execute(
+            'ALTER TABLE {} ADD CONSTRAINT {} PRIMARY KEY {}'.format(
+                new_table,
+                get_temporary_name(primary_key),
+                '(id, date)' if partitioned else '(id)',
+            )
+        )
+        for name, definition in indexes:
+            cursor.execute(re.sub(
+                r'^(CREATE (?:UNIQUE )?INDEX )\S+ ON (?:\S+\.)?{} '.format(
+                    table,
+                ),
+                r'\g<1>{} ON {} '.format(get_temporary_name(name), new_table),
+                definition,
+            ))
+        for name, definition in foreign_keys:
+            cursor.execute(
+                'ALTER TABLE {} ADD CONSTRAINT {} {}'.format(
+                    new_table,
+                    name,
+                    definition,
+                )
+            )
+        # Finds the latest entries to check in the last transaction
+        latest_index = get_temporary_name('{}_latest'.format(table))
+        cursor.execute(
+            'CREATE INDEX {} ON {} (id) WHERE latest'.format(
+                latest_index,
+                new_table,
+            )
+        )
+
+        with transaction.atomic(using=connection.alias):
+            # The reads go on, the writes wait for the swap
+            cursor.execute('LOCK TABLE {} IN EXCLUSIVE MODE'.format(table))
+            cursor.execute(
+                'INSERT INTO {} SELECT * FROM {} WHERE id > %s'.format(
+                    new_table,
+                    table,
+                ),
+                [max_id],
+            )
+            # The imports only clear the latest flag of the entries they
+            # replace, the few latest copied entries are checked
+            cursor.execute(
+                'UPDATE {new_table} AS entry SET latest = false '
+                'FROM {table} AS current '
+                'WHERE entry.latest AND entry.id <= %s '
+                'AND current.id = entry.id AND current.date = entry.date '
+                'AND NOT current.latest'.format(
+                    new_table=new_table,
+                    table=table,
+                ),
+                [max_id],
+            )
+            cursor.execute('DROP INDEX {}'.format(latest_index))
+            cursor.execute('ALTER SEQUENCE {} OWNED BY NONE'.format(sequence))
+            cursor.execute('DROP TABLE {}'.format(table))
+            cursor.execute(
+                'ALTER TABLE {} RENAME TO {}'.format(new_table, table)
+            )
+            cursor.execute(
+                'ALTER TABLE {} RENAME CONSTRAINT {} TO {}'.format(
+                    table,
+                    get_temporary_name(primary_key),
+                    primary_key,
+                )
+            )
+            for name, definition in indexes:
+                cursor.execute(
+                    'ALTER INDEX {} RENAME TO {}'.format(
+                        get_temporary_name(name),
+                        name,
+                    )
+                )
+            cursor.execute(
+                'ALTER SEQUENCE {} OWNED BY {}.id'.format(sequence, table)
+            )
+
+
+def partition_history_table(apps, schema_editor):
+    rebuild_history_table(schema_editor, partitioned=True)
+
+
+def unpartition_history_table(apps, schema_editor):
+    rebuild_history_table(schema_editor, partitioned=False)
+
+
+class Migration(migrations.Migration):
+    # Declarative partitioning with a primary key and foreign keys needs
+    # PostgreSQL 11. The copy is done in several transactions, see
+    # rebuild_history_table
+    atomic = False
+
+    dependencies = [
+        ('medications', '0077_importshard'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            partition_history_table,
+            unpartition_history_table,
+        ),
+    ]
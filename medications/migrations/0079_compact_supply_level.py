@@ -0,0 +1,40 @@
+# Generated by Django 2.0.9 on 2019-02-11 11:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # The level of the history is moved to a smallint column by the
+    # compact_supply_history command, migration 0080 swaps the columns
+
+    dependencies = [
+        ('medications', '0078_partition_providermedicationndcthrough'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='currentprovidersupply',
+            name='supply',
+        ),
+        migrations.AlterField(
+            model_name='currentprovidersupply',
+            name='level',
+            field=models.SmallIntegerField(choices=[(-1, 'NO REPORT'), (0, 'NO SUPPLY'), (1, '<24'), (2, '24'), (3, '24-48'), (4, '>48')], default=0, verbose_name='medication level'),
+        ),
+        # Dropping a column only changes the catalog, the table is not
+        # rewritten
+        migrations.RemoveField(
+            model_name='providermedicationndcthrough',
+            name='supply',
+        ),
+        migrations.RunSQL(
+            sql="""
+                ALTER TABLE medications_providermedicationndcthrough
+                ADD COLUMN level_smallint smallint;
+            """,
+            reverse_sql="""
+                ALTER TABLE medications_providermedicationndcthrough
+                DROP COLUMN level_smallint;
+            """,
+        ),
+    ]
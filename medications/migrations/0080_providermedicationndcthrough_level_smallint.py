@@ -0,0 +1,144 @@
+# Generated by Django 2.0.9 on 2019-02-11 11:52
+
+from django.db import migrations, models, transaction
+
+HISTORY_TABLE = 'medications_providermedicationndcthrough'
+LEVEL_CONSTRAINT = '{}_level_not_null'.format(HISTORY_TABLE)
+# Rows left for this migration to copy, in batches of BATCH_SIZE ids
+MAX_PENDING_ROWS = 100000
+BATCH_SIZE = 10000
+
+
+def swap_level_columns(apps, schema_editor):
+    """
+    Replace the integer level of the history by the smallint copy written
+    by the compact_supply_history command. Only the rows written since the
+    command ran are copied here, refuse to migrate if there are too many.
+
+    The pending rows are copied in batches, each in its own transaction.
+    The last transaction copies the rows written meanwhile and only
+    changes the catalog: the columns are swapped and the level is checked
+    by a NOT VALID constraint, validated afterwards without blocking the
+    writes. SET NOT NULL would scan the whole table under an exclusive
+    lock.
+    """
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT count(*) FROM ('
+            '    SELECT 1 FROM {} WHERE level_smallint IS NULL LIMIT %s'
+            ') AS pending'.format(HISTORY_TABLE),
+            [MAX_PENDING_ROWS + 1],
+        )
+        if cursor.fetchone()[0] > MAX_PENDING_ROWS:
+            raise RuntimeError(
+                'More than {} supply history rows still have to be '
+                'rewritten, run "python manage.py compact_supply_history" '
+                'before migrating.'.format(MAX_PENDING_ROWS)
+            )
+        cursor.execute(
+            'SELECT min(id), max(id) FROM {} '
+            'WHERE level_smallint IS NULL'.format(HISTORY_TABLE)
+        )
+        first_id, last_id = cursor.fetchone()
+        # The rows written by the imports have increasing ids, the pending
+        # ones are all after first_id
+        start_id = first_id
+        while start_id is not None and start_id <= last_id:
+            with transaction.atomic(using=connection.alias):
+                cursor.execute(
+                    'UPDATE {} SET level_smallint = level '
+                    'WHERE id >= %s AND id < %s '
+                    'AND level_smallint IS NULL'.format(HISTORY_TABLE),
+                    [start_id, start_id + BATCH_SIZE],
+                )
+            start_id += BATCH_SIZE
+
+        with transaction.atomic(using=connection.alias):
+            cursor.execute(
+                'LOCK TABLE {} IN ACCESS EXCLUSIVE MODE'.format(HISTORY_TABLE)
+            )
+            if first_id is not None:
+                cursor.execute(
+                    'UPDATE {} SET level_smallint = level '
+                    'WHERE id >= %s AND level_smallint IS NULL'.format(
+                        HISTORY_TABLE,
+                    ),
+                    [first_id],
+                )
+            cursor.execute(
+                'ALTER TABLE {} DROP COLUMN level'.format(HISTORY_TABLE)
+            )
+            cursor.execute(
+                'ALTER TABLE {} RENAME COLUMN level_smallint TO level'.format(
+                    HISTORY_TABLE,
+                )
+            )
+            cursor.execute(
+                'ALTER TABLE {} ADD CONSTRAINT {} '
+                'CHECK (level IS NOT NULL) NOT VALID'.format(
+                    HISTORY_TABLE,
+                    LEVEL_CONSTRAINT,
+                )
+            )
+
+        with transaction.atomic(using=connection.alias):
+            cursor.execute(
+                'ALTER TABLE {} VALIDATE CONSTRAINT {}'.format(
+                    HISTORY_TABLE,
+                    LEVEL_CONSTRAINT,
+                )
+            )
+
+
+def unswap_level_columns(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            'ALTER TABLE {} DROP CONSTRAINT {}'.format(
+                HISTORY_TABLE,
+                LEVEL_CONSTRAINT,
+            )
+        )
+        cursor.execute(
+            'ALTER TABLE {} RENAME COLUMN level TO level_smallint'.format(
+                HISTORY_TABLE,
+            )
+        )
+        cursor.execute(
+            'ALTER TABLE {} ADD COLUMN level integer'.format(HISTORY_TABLE)
+        )
+        cursor.execute(
+            'UPDATE {} SET level = level_smallint'.format(HISTORY_TABLE)
+        )
+        cursor.execute(
+            'ALTER TABLE {} ALTER COLUMN level SET NOT NULL'.format(
+                HISTORY_TABLE,
+            )
+        )
+
+
+class Migration(migrations.Migration):
+    # The rows are copied in several transactions, see swap_level_columns
+    atomic = False
+
+    dependencies = [
+        ('medications', '0079_compact_supply_level'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunPython(
+                    swap_level_columns,
+                    unswap_level_columns,
+                ),
+            ],
+            state_operations=[
+                migrations.AlterField(
+                    model_name='providermedicationndcthrough',
+                    name='level',
+                    field=models.SmallIntegerField(choices=[(-1, 'NO REPORT'), (0, 'NO SUPPLY'), (1, '<24'), (2, '24'), (3, '24-48'), (4, '>48')], default=0, verbose_name='medication level'),
+                ),
+            ],
+        ),
+    ]
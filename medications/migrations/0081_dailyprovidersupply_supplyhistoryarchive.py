@@ -0,0 +1,58 @@
+# Generated by Django 2.0.9 on 2019-02-11 11:22
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medications', '0080_providermedicationndcthrough_level_smallint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyProviderSupply',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='date')),
+                ('level', models.SmallIntegerField(choices=[(-1, 'NO REPORT'), (0, 'NO SUPPLY'), (1, '<24'), (2, '24'), (3, '24-48'), (4, '>48')], default=0, verbose_name='medication level')),
+                ('entry_id', models.IntegerField(verbose_name='entry id')),
+                ('medication_ndc', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_supplies', to='medications.MedicationNdc')),
+                ('provider', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_supplies', to='medications.Provider')),
+            ],
+            options={
+                'verbose_name': 'daily provider supply',
+                'verbose_name_plural': 'daily provider supplies',
+            },
+        ),
+        migrations.CreateModel(
+            name='SupplyHistoryArchive',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start_date', models.DateField(verbose_name='start date')),
+                ('end_date', models.DateField(verbose_name='end date')),
+                ('file_name', models.CharField(max_length=255, verbose_name='file name')),
+                ('file_checksum', models.CharField(help_text='SHA-256 checksum of the archive file.', max_length=64, verbose_name='file checksum')),
+                ('file_size', models.BigIntegerField(help_text='Size of the archive file, in bytes.', verbose_name='file size')),
+                ('row_count', models.PositiveIntegerField(default=0, verbose_name='archived rows')),
+                ('rollup_row_count', models.PositiveIntegerField(default=0, verbose_name='rolled up rows')),
+                ('deleted_row_count', models.PositiveIntegerField(default=0, verbose_name='deleted rows')),
+                ('creation_date', models.DateTimeField(default=django.utils.timezone.now, verbose_name='creation date')),
+            ],
+            options={
+                'verbose_name': 'supply history archive',
+                'verbose_name_plural': 'supply history archives',
+                'ordering': ('start_date',),
+            },
+        ),
+        migrations.AddIndex(
+            model_name='dailyprovidersupply',
+            index=models.Index(fields=['date', 'medication_ndc_id'], name='medications_date_45751a_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='dailyprovidersupply',
+            unique_together={('date', 'provider', 'medication_ndc')},
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 2.0.9 on 2019-02-13 09:48
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medications', '0081_dailyprovidersupply_supplyhistoryarchive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailySupplyAggregate',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='date')),
+                ('level', models.SmallIntegerField(choices=[(-1, 'NO REPORT'), (0, 'NO SUPPLY'), (1, '<24'), (2, '24'), (3, '24-48'), (4, '>48')], default=0, verbose_name='medication level')),
+                ('count', models.PositiveIntegerField(default=0, verbose_name='count')),
+                ('county', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='daily_supply_aggregates', to='medications.County')),
+                ('medication_ndc', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_supply_aggregates', to='medications.MedicationNdc')),
+                ('provider_category', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='daily_supply_aggregates', to='medications.ProviderCategory')),
+                ('provider_type', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='daily_supply_aggregates', to='medications.ProviderType')),
+                ('state', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='daily_supply_aggregates', to='medications.State')),
+                ('zipcode', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='daily_supply_aggregates', to='medications.ZipCode')),
+            ],
+            options={
+                'verbose_name': 'daily supply aggregate',
+                'verbose_name_plural': 'daily supply aggregates',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='dailysupplyaggregate',
+            index=models.Index(fields=['date', 'medication_ndc_id'], name='medications_date_2f5d73_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='dailysupplyaggregate',
+            index=models.Index(fields=['state_id', 'date'], name='medications_state_i_9154f3_idx'),
+        ),
+    ]
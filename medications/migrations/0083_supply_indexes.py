@@ -0,0 +1,101 @@
+# Generated by Django 2.0.9 on 2019-02-14 15:31
+
+from django.db import migrations, models
+
+HISTORY_TABLE = 'medications_providermedicationndcthrough'
+# Single column b-tree indexes of the history replaced by the indexes below
+REPLACED_INDEX_COLUMNS = ('date', 'latest')
+
+
+def drop_column_indexes(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        for column in REPLACED_INDEX_COLUMNS:
+            cursor.execute(
+                'SELECT indexname FROM pg_indexes '
+                'WHERE tablename = %s AND indexdef LIKE %s',
+                [HISTORY_TABLE, '% USING btree ({})'.format(column)],
+            )
+            for index_name, in cursor.fetchall():
+                cursor.execute('DROP INDEX {}'.format(index_name))
+
+
+def create_column_indexes(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        for column in REPLACED_INDEX_COLUMNS:
+            cursor.execute(
+                'CREATE INDEX {table}_{column} ON {table} ({column})'.format(
+                    column=column,
+                    table=HISTORY_TABLE,
+                )
+            )
+
+
+class Migration(migrations.Migration):
+    # Indexes created on the partitioned history table are created on
+    # every partition, CONCURRENTLY is not available for them
+
+    dependencies = [
+        ('medications', '0082_dailysupplyaggregate'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunPython(
+                    drop_column_indexes,
+                    create_column_indexes,
+                ),
+            ],
+            state_operations=[
+                migrations.AlterField(
+                    model_name='providermedicationndcthrough',
+                    name='date',
+                    field=models.DateField(help_text='Date', verbose_name='date'),
+                ),
+                migrations.AlterField(
+                    model_name='providermedicationndcthrough',
+                    name='latest',
+                    field=models.BooleanField(default=False, verbose_name='latest'),
+                ),
+            ],
+        ),
+        # Latest supplies of some medications, read without visiting the
+        # history rows
+        migrations.RunSQL(
+            sql="""
+                CREATE INDEX medications_providermedicationndcthrough_latest_supply
+                ON medications_providermedicationndcthrough
+                (medication_ndc_id, provider_id)
+                INCLUDE (level, creation_date)
+                WHERE latest;
+            """,
+            reverse_sql="""
+                DROP INDEX medications_providermedicationndcthrough_latest_supply;
+            """,
+        ),
+        # The history is appended in date order, a few pages per block
+        # range are enough to skip the other days of a partition
+        migrations.RunSQL(
+            sql="""
+                CREATE INDEX medications_providermedicationndcthrough_date_brin
+                ON medications_providermedicationndcthrough
+                USING brin (date);
+                CREATE INDEX medications_providermedicationndcthrough_creation_date_brin
+                ON medications_providermedicationndcthrough
+                USING brin (creation_date);
+            """,
+            reverse_sql="""
+                DROP INDEX medications_providermedicationndcthrough_date_brin;
+                DROP INDEX medications_providermedicationndcthrough_creation_date_brin;
+            """,
+        ),
+        # The import only looks the providers up by organization and store
+        migrations.RemoveIndex(
+            model_name='provider',
+            name='medications_address_7f9d65_idx',
+        ),
+        migrations.AddIndex(
+            model_name='provider',
+            index=models.Index(fields=['organization_id', 'store_number'], name='medications_organiz_aeb07c_idx'),
+        ),
+    ]
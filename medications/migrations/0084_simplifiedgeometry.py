@@ -0,0 +1,34 @@
+# Generated by Django 2.0.9 on 2019-02-18 10:12
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medications', '0083_supply_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SimplifiedGeometry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('geography_type', models.CharField(choices=[('state', 'State'), ('county', 'County'), ('zipcode', 'Zip code')], max_length=10, verbose_name='geography type')),
+                ('geography_id', models.PositiveIntegerField(verbose_name='geography id')),
+                ('zoom', models.PositiveSmallIntegerField(verbose_name='zoom')),
+                ('tolerance', models.FloatField(help_text='Simplification tolerance, in degrees.', verbose_name='tolerance')),
+                ('geojson', models.TextField(verbose_name='GeoJSON')),
+                ('creation_date', models.DateTimeField(default=django.utils.timezone.now, verbose_name='creation date')),
+            ],
+            options={
+                'verbose_name': 'simplified geometry',
+                'verbose_name_plural': 'simplified geometries',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='simplifiedgeometry',
+            unique_together={('geography_type', 'geography_id', 'zoom')},
+        ),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 2.0.9 on 2019-02-20 15:40
+
+import django.contrib.gis.db.models.fields
+from django.db import migrations
+
+from medications.geography import update_centers
+
+GEOGRAPHY_TABLES = (
+    'medications_state',
+    'medications_county',
+    'medications_zipcode',
+)
+
+
+def compute_centers(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        for table in GEOGRAPHY_TABLES:
+            update_centers(cursor, table)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medications', '0084_simplifiedgeometry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='county',
+            name='bbox',
+            field=django.contrib.gis.db.models.fields.GeometryField(null=True, spatial_index=False, srid=4326, verbose_name='bounding box'),
+        ),
+        migrations.AddField(
+            model_name='county',
+            name='centroid',
+            field=django.contrib.gis.db.models.fields.PointField(null=True, srid=4326, verbose_name='centroid'),
+        ),
+        migrations.AddField(
+            model_name='state',
+            name='bbox',
+            field=django.contrib.gis.db.models.fields.GeometryField(null=True, spatial_index=False, srid=4326, verbose_name='bounding box'),
+        ),
+        migrations.AddField(
+            model_name='state',
+            name='centroid',
+            field=django.contrib.gis.db.models.fields.PointField(null=True, srid=4326, verbose_name='centroid'),
+        ),
+        migrations.AddField(
+            model_name='zipcode',
+            name='bbox',
+            field=django.contrib.gis.db.models.fields.GeometryField(null=True, spatial_index=False, srid=4326, verbose_name='bounding box'),
+        ),
+        migrations.AddField(
+            model_name='zipcode',
+            name='centroid',
+            field=django.contrib.gis.db.models.fields.PointField(null=True, srid=4326, verbose_name='centroid'),
+        ),
+        migrations.RunPython(
+            compute_centers,
+            migrations.RunPython.noop,
+        ),
+    ]
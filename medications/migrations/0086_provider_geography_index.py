@@ -0,0 +1,25 @@
+# Generated by Django 2.0.9 on 2019-02-22 11:05
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medications', '0085_geography_centers'),
+    ]
+
+    operations = [
+        # Distances in meters of the public finder, ST_DWithin and the <->
+        # nearest neighbour ordering use the index of the geography cast
+        migrations.RunSQL(
+            sql="""
+                CREATE INDEX medications_provider_geo_localization_geography
+                ON medications_provider
+                USING gist ((geo_localization::geography));
+            """,
+            reverse_sql="""
+                DROP INDEX medications_provider_geo_localization_geography;
+            """,
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 2.0.9 on 2019-02-25 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # The existing aggregates count the inactive providers as active until
+    # they are computed again by the backfill_daily_supply_aggregates
+    # command. With a constant default, PostgreSQL 11 adds the column
+    # without rewriting the table
+
+    dependencies = [
+        ('medications', '0086_provider_geography_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dailysupplyaggregate',
+            name='active',
+            field=models.BooleanField(default=True, verbose_name='active'),
+        ),
+    ]
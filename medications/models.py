@@ -1,8 +1,13 @@
-from datetime import datetime
-from django.db import models, IntegrityError
+import hashlib
+import math
+
+from datetime import datetime, timedelta
+from django.db import connection, models, transaction, IntegrityError
 from django.conf import settings
 from django.contrib.gis.db.models import GeometryField, PointField
 from django.contrib.gis.geos import Point
+from django.contrib.postgres.fields import ArrayField, JSONField
+from django.core.cache import cache
 from django.core.exceptions import MultipleObjectsReturned
 from django.utils import timezone
 from django.utils.text import slugify
@@ -12,6 +17,18 @@ from localflavor.us.models import USStateField, USZipCodeField
 
 from phonenumber_field.modelfields import PhoneNumberField
 
+from .constants import (
+    SUPPLY_LEVEL_CHOICES,
+    SUPPLY_LEVEL_GROUPS,
+    SupplyLevel,
+)
+from .geography import get_centers
+from .partitions import (
+    create_month_partitions,
+    detach_month_partitions,
+    get_default_partition_months,
+    get_partitions,
+)
 from .utils import get_lat_lng
 from .validators import validate_state, validate_zip
 
@@ -86,6 +103,16 @@ class State(models.Model):
         _('geometry'),
         null=True,
     )
+    centroid = PointField(
+        _('centroid'),
+        null=True,
+    )
+    # The envelope of the geometry, a point for the point geometries
+    bbox = GeometryField(
+        _('bounding box'),
+        null=True,
+        spatial_index=False,
+    )
     state_us_id = models.PositiveIntegerField(
         _('state us id'),
         null=True,
@@ -103,6 +130,10 @@ class State(models.Model):
     def __str__(self):
         return '{} - {}'.format(self.state_code, self.state_name)
 
+    def save(self, *args, **kwargs):
+        self.centroid, self.bbox = get_centers(self.geometry)
+        super().save(*args, **kwargs)
+
 
 class County(models.Model):
     county_name = models.CharField(
@@ -124,6 +155,16 @@ class County(models.Model):
         _('geometry'),
         null=True,
     )
+    centroid = PointField(
+        _('centroid'),
+        null=True,
+    )
+    # The envelope of the geometry, a point for the point geometries
+    bbox = GeometryField(
+        _('bounding box'),
+        null=True,
+        spatial_index=False,
+    )
     county_id = models.PositiveIntegerField(
         _('county us id'),
         null=True,
@@ -147,6 +188,7 @@ class County(models.Model):
     def save(self, *args, **kwargs):
         if not self.county_name_slug and self.county_name:
             self.county_name_slug = slugify(self.county_name)
+        self.centroid, self.bbox = get_centers(self.geometry)
         super().save(*args, **kwargs)
 
 
@@ -159,6 +201,16 @@ class ZipCode(models.Model):
         _('geometry'),
         null=True,
     )
+    centroid = PointField(
+        _('centroid'),
+        null=True,
+    )
+    # The envelope of the geometry, a point for the point geometries
+    bbox = GeometryField(
+        _('bounding box'),
+        null=True,
+        spatial_index=False,
+    )
     state = models.ForeignKey(
         State,
         related_name='state_zipcodes',
@@ -184,6 +236,161 @@ class ZipCode(models.Model):
     def __str__(self):
         return '{} - {}'.format(self.zipcode, self.state)
 
+    def save(self, *args, **kwargs):
+        self.centroid, self.bbox = get_centers(self.geometry)
+        super().save(*args, **kwargs)
+
+
+class SimplifiedGeometryManager(models.Manager):
+    """Custom manager to generate and read the simplified geometries."""
+
+    def get_cache_key(self, geography_type, zoom, geography_id):
+        return 'simplified_geometry:{}:{}:{}'.format(
+            geography_type,
+            zoom,
+            geography_id,
+        )
+
+    def generate(self, model, zoom):
+        """
+        Simplify the geometries of the State, County or ZipCode objects
+        for a zoom level, keeping the topology of every geometry, and store
+        them as GeoJSON. Returns the number of geometries stored.
+        """
+        geography_type = model._meta.model_name
+        tolerance = get_zoom_tolerance(zoom)
+        sql = (
+            'INSERT INTO {simplified_table} '
+            '(geography_type, geography_id, zoom, tolerance, geojson,'
+            ' creation_date) '
+            'SELECT %(geography_type)s, id, %(zoom)s, %(tolerance)s,'
+            '    ST_AsGeoJSON('
+            '        ST_SimplifyPreserveTopology(geometry, %(tolerance)s),'
+            '        %(precision)s'
+            '    ),'
+            '    now() '
+            'FROM {geography_table} '
+            'WHERE geometry IS NOT NULL '
+            'ON CONFLICT (geography_type, geography_id, zoom) DO UPDATE SET '
+            'tolerance = EXCLUDED.tolerance, '
+            'geojson = EXCLUDED.geojson, '
+            'creation_date = EXCLUDED.creation_date '
+            'RETURNING geography_id'
+        ).format(
+            geography_table=model._meta.db_table,
+            simplified_table=self.model._meta.db_table,
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, {
+                'geography_type': geography_type,
+                'precision': get_zoom_precision(zoom),
+                'tolerance': tolerance,
+                'zoom': zoom,
+            })
+            geography_ids = [geography_id for geography_id, in cursor]
+        cache.delete_many([
+            self.get_cache_key(geography_type, zoom, geography_id)
+            for geography_id in geography_ids
+        ])
+        return len(geography_ids)
+
+    def get_geojson(self, model, geography_ids, zoom):
+        """
+        Return the encoded GeoJSON of the simplified geometries of the
+        geographies for a zoom level by geography id, read from the cache
+        first. The geographies without simplified geometry are missing.
+        """
+        geography_type = model._meta.model_name
+        keys = {
+            self.get_cache_key(geography_type, zoom, geography_id): geography_id
+            for geography_id in geography_ids
+        }
+        geojson = {
+            keys[key]: value for key, value in cache.get_many(keys).items()
+        }
+        missing_ids = set(keys.values()) - set(geojson)
+        if missing_ids:
+            loaded = {
+                geography_id: geometry.encode()
+                for geography_id, geometry in self.filter(
+                    geography_type=geography_type,
+                    geography_id__in=missing_ids,
+                    zoom=zoom,
+                ).values_list('geography_id', 'geojson')
+            }
+            cache.set_many(
+                {
+                    self.get_cache_key(geography_type, zoom, geography_id): geometry
+                    for geography_id, geometry in loaded.items()
+                },
+                timeout=None,
+            )
+            geojson.update(loaded)
+        return geojson
+
+
+def get_zoom_tolerance(zoom):
+    """Return the size in degrees of a 256 pixels tile pixel at a zoom."""
+    return 360 / (256 * 2 ** zoom)
+
+
+def get_zoom_precision(zoom):
+    """Return the decimal digits needed to place a point in a pixel."""
+    return max(0, math.ceil(-math.log10(get_zoom_tolerance(zoom)))) + 1
+
+
+class SimplifiedGeometry(models.Model):
+    """
+    Geometry of a State, County or ZipCode simplified for a zoom level of
+    the maps and encoded as GeoJSON, generated by the simplify_geometries
+    command so the map responses do not carry the census geometries.
+    """
+    STATE = 'state'
+    COUNTY = 'county'
+    ZIPCODE = 'zipcode'
+    GEOGRAPHY_TYPE_CHOICES = (
+        (STATE, _('State')),
+        (COUNTY, _('County')),
+        (ZIPCODE, _('Zip code')),
+    )
+
+    geography_type = models.CharField(
+        _('geography type'),
+        max_length=10,
+        choices=GEOGRAPHY_TYPE_CHOICES,
+    )
+    geography_id = models.PositiveIntegerField(
+        _('geography id'),
+    )
+    zoom = models.PositiveSmallIntegerField(
+        _('zoom'),
+    )
+    tolerance = models.FloatField(
+        _('tolerance'),
+        help_text=_('Simplification tolerance, in degrees.'),
+    )
+    geojson = models.TextField(
+        _('GeoJSON'),
+    )
+    creation_date = models.DateTimeField(
+        _('creation date'),
+        default=timezone.now,
+    )
+
+    objects = SimplifiedGeometryManager()
+
+    class Meta:
+        verbose_name = _('simplified geometry')
+        verbose_name_plural = _('simplified geometries')
+        unique_together = ('geography_type', 'geography_id', 'zoom')
+
+    def __str__(self):
+        return '{} {} - zoom {}'.format(
+            self.geography_type,
+            self.geography_id,
+            self.zoom,
+        )
+
 
 class ProviderType(models.Model):
     code = models.CharField(
@@ -229,6 +436,24 @@ class ProviderCategory(models.Model):
         return '{} - {}'.format(self.code, self.name)
 
 
+# Bounds of the integer columns of the sort keys, the ids being integers
+MAX_SORT_INTEGER = 2 ** 31
+
+
+def is_valid_sort_value(column, value):
+    """
+    Return whether the value of a sort key sent back by a client, like in
+    a page cursor, has the type of its column.
+    """
+    if column == 'active':
+        return isinstance(value, bool)
+    if isinstance(value, bool):
+        return False
+    if column == 'distance':
+        return isinstance(value, (int, float)) and math.isfinite(value)
+    return isinstance(value, int) and abs(value) < MAX_SORT_INTEGER
+
+
 class ActiveProviderManager(models.Manager):
     """Custom manager to return active providers."""
 
@@ -236,6 +461,312 @@ class ActiveProviderManager(models.Manager):
         """Method to return active providers."""
         return self.get_queryset().filter(active=True)
 
+    def get_supply_level_counts_sql(self, geography_field, medication_ndc_ids, provider_category_ids, provider_type_ids, date=None, geography_ids=None):
+        """
+        Return the SQL query, its params and its count columns of
+        supply_level_counts.
+        """
+        column = self.model._meta.get_field(geography_field).column
+        aggregate_column = DailySupplyAggregate._meta.get_field(
+            geography_field.replace('related_', ''),
+        ).column
+        provider_filters = (
+            'provider.category_id = ANY(%(provider_category_ids)s::int[]) '
+            'AND provider.type_id = ANY(%(provider_type_ids)s::int[])'
+        )
+
+        def filter_geography(geography_column):
+            if geography_ids is None:
+                return ''
+            return 'AND {} = ANY(%(geography_ids)s)'.format(geography_column)
+
+        if date:
+            # The providers with a supply that day, carried forward like
+            # the aggregates, read from the rollup for the archived days
+            history_manager = ProviderMedicationNdcThrough.objects
+            archived_days, days = history_manager._split_at_archived_days(
+                date,
+                date,
+            )
+            if archived_days:
+                daily_supplies = (
+                    'SELECT provider_id FROM {rollup_table} '
+                    'WHERE date = %(date)s '
+                    'AND medication_ndc_id = ANY(%(medication_ndc_ids)s)'
+                ).format(
+                    rollup_table=DailyProviderSupply._meta.db_table,
+                )
+            else:
+                daily_supplies = history_manager._get_daily_entries_sql(
+                    by_provider=False,
+                )
+            # Not correlated, so the supplies are read once
+            supplied = (
+                'provider.id IN ('
+                '    SELECT provider_id FROM ({daily_supplies}) AS supplies'
+                ')'
+            ).format(daily_supplies=daily_supplies)
+            levels = (
+                'SELECT {column} AS geography_id, level, count '
+                'FROM {aggregate_table} '
+                'WHERE date = %(date)s AND active '
+                'AND medication_ndc_id = ANY(%(medication_ndc_ids)s) '
+                'AND provider_category_id = ANY(%(provider_category_ids)s::int[]) '
+                'AND provider_type_id = ANY(%(provider_type_ids)s::int[]) '
+                '{geography_filter}'
+            ).format(
+                aggregate_table=DailySupplyAggregate._meta.db_table,
+                column=aggregate_column,
+                geography_filter=filter_geography(aggregate_column),
+            )
+        else:
+            supplied = (
+                'EXISTS ('
+                '    SELECT 1 FROM {current_table}'
+                '    WHERE provider_id = provider.id'
+                '    AND medication_ndc_id = ANY(%(medication_ndc_ids)s)'
+                ')'
+            ).format(
+                current_table=CurrentProviderSupply._meta.db_table,
+            )
+            levels = (
+                'SELECT provider.{column} AS geography_id, supply.level,'
+                '    1 AS count '
+                'FROM {current_table} supply '
+                'JOIN {provider_table} provider'
+                '    ON provider.id = supply.provider_id '
+                'WHERE supply.medication_ndc_id = ANY(%(medication_ndc_ids)s) '
+                'AND provider.active AND {provider_filters} '
+                '{geography_filter}'
+            ).format(
+                column=column,
+                current_table=CurrentProviderSupply._meta.db_table,
+                geography_filter=filter_geography('provider.' + column),
+                provider_filters=provider_filters,
+                provider_table=self.model._meta.db_table,
+            )
+
+        count_columns = ['total_provider_count', 'active_provider_count']
+        level_counts = []
+        for group, group_levels in SUPPLY_LEVEL_GROUPS.items():
+            count_columns.append('{}_count'.format(group))
+            level_counts.append(
+                'SUM(count) FILTER (WHERE level IN ({})) AS {}_count'.format(
+                    ', '.join(str(level.value) for level in group_levels),
+                    group,
+                )
+            )
+        sql = (
+            'WITH providers AS ('
+            '    SELECT {column} AS geography_id,'
+            '        COUNT(*) AS total_provider_count,'
+            '        COUNT(*) FILTER ('
+            '            WHERE provider.active AND {provider_filters}'
+            '            AND {supplied}'
+            '        ) AS active_provider_count'
+            '    FROM {provider_table} provider'
+            '    WHERE {column} IS NOT NULL {geography_filter}'
+            '    GROUP BY 1'
+            '), levels AS ('
+            '    SELECT geography_id, {level_counts}'
+            '    FROM ({levels}) AS supplies'
+            '    GROUP BY 1'
+            ') '
+            'SELECT GROUPING(providers.geography_id), providers.geography_id,'
+            '    {sums} '
+            'FROM providers LEFT JOIN levels USING (geography_id) '
+            'GROUP BY GROUPING SETS ((providers.geography_id), ())'
+        ).format(
+            column=column,
+            geography_filter=filter_geography(column),
+            level_counts=', '.join(level_counts),
+            levels=levels,
+            provider_filters=provider_filters,
+            provider_table=self.model._meta.db_table,
+            sums=', '.join(
+                'COALESCE(SUM({0}), 0)::int'.format(count_column)
+                for count_column in count_columns
+            ),
+            supplied=supplied,
+        )
+        params = {
+            'date': date,
+            'end_date': date,
+            'start_date': date,
+            'geography_ids': list(geography_ids or []),
+            'medication_ndc_ids': list(medication_ndc_ids),
+            'provider_category_ids': list(provider_category_ids),
+            'provider_type_ids': list(provider_type_ids),
+        }
+        return sql, params, count_columns
+
+    def supply_level_counts(self, geography_field, medication_ndc_ids, provider_category_ids, provider_type_ids, date=None, geography_ids=None):
+        """
+        Count the providers of every geography, related_state,
+        related_county or related_zipcode, and the supplies of every SUPPLY_LEVEL_GROUPS
+        group of their active providers. The supplies are the current ones,
+        or the ones of a date read from the daily supply aggregates.
+
+        Returns a dict of the counts by geography id and the counts of all
+        the geographies, computed by the same query through GROUPING SETS.
+        The counts are dicts with the total_provider_count,
+        active_provider_count and <group>_count keys.
+        """
+        sql, params, count_columns = self.get_supply_level_counts_sql(
+            geography_field,
+            medication_ndc_ids,
+            provider_category_ids,
+            provider_type_ids,
+            date,
+            geography_ids,
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+
+        counts = {}
+        total_counts = dict.fromkeys(count_columns, 0)
+        for is_total, geography_id, *row in rows:
+            if is_total:
+                total_counts = dict(zip(count_columns, row))
+            else:
+                counts[geography_id] = dict(zip(count_columns, row))
+        return counts, total_counts
+
+    def get_nearest_providers_sql(self, medication_ndc_ids, organization_ids, vaccine_finder_types, order='supply', after=None):
+        """
+        Return the SQL query and the sort key columns of
+        nearest_providers.
+        """
+        # The distance in meters on the sphere, as ordered by the <->
+        # operator of the geography index
+        distance = (
+            'provider.geo_localization::geography '
+            '<-> %(location)s::geography'
+        )
+        filters = (
+            '(provider.organization_id = ANY(%(organization_ids)s::int[]) '
+            'OR provider.vaccine_finder_type = ANY(%(vaccine_finder_types)s::int[])) '
+            'AND ST_DWithin('
+            '    provider.geo_localization::geography,'
+            '    %(location)s::geography,'
+            '    %(distance)s'
+            ')'
+        )
+        if order == 'nearest':
+            # The index is scanned from the nearest provider and the scan
+            # stops at the limit
+            key_columns = ['distance', 'id']
+            sql = (
+                'SELECT provider.id, provider.active,'
+                '    0 AS total_supply, 0 AS amount_medications,'
+                '    {distance} AS distance '
+                'FROM {provider_table} provider '
+                'WHERE {filters} {keyset_filter}'
+                'ORDER BY {distance} '
+                'LIMIT %(limit)s'
+            ).format(
+                distance=distance,
+                filters=filters,
+                keyset_filter=(
+                    'AND ({}, provider.id) > (%(after_distance)s, %(after_id)s) '.format(
+                        distance,
+                    ) if after else ''
+                ),
+                provider_table=self.model._meta.db_table,
+            )
+            return sql, key_columns
+
+        # The supplies of the inactive providers do not count, like the
+        # list of all the providers
+        key_columns = ['total_supply', 'active', 'amount_medications', 'distance', 'id']
+        sql = (
+            'SELECT * FROM ('
+            '    SELECT provider.id, provider.active,'
+            '        COALESCE(supplies.total_supply, 0) AS total_supply,'
+            '        COALESCE(supplies.amount_medications, 0)'
+            '            AS amount_medications,'
+            '        {distance} AS distance'
+            '    FROM {provider_table} provider'
+            '    LEFT JOIN LATERAL ('
+            '        SELECT SUM(level) AS total_supply,'
+            '            COUNT(*) AS amount_medications'
+            '        FROM {current_table}'
+            '        WHERE provider_id = provider.id AND provider.active'
+            '        AND medication_ndc_id = ANY(%(medication_ndc_ids)s::int[])'
+            '    ) AS supplies ON true'
+            '    WHERE {filters}'
+            ') AS providers '
+            '{keyset_filter}'
+            'ORDER BY total_supply DESC, active DESC,'
+            '    amount_medications DESC, distance, id '
+            'LIMIT %(limit)s'
+        ).format(
+            current_table=CurrentProviderSupply._meta.db_table,
+            distance=distance,
+            filters=filters,
+            keyset_filter=(
+                'WHERE (-total_supply, -active::int, -amount_medications,'
+                '    distance, id) > ('
+                '    -(%(after_total_supply)s), -(%(after_active)s::int),'
+                '    -(%(after_amount_medications)s), %(after_distance)s,'
+                '    %(after_id)s'
+                ') ' if after else ''
+            ),
+            provider_table=self.model._meta.db_table,
+        )
+        return sql, key_columns
+
+    def nearest_providers(self, location, distance, medication_ndc_ids, organization_ids, vaccine_finder_types, order='supply', after=None, limit=50):
+        """
+        Return a page of the providers of the organizations or vaccine
+        finder types within distance meters of the location, and the sort
+        key of its last provider to pass as after to get the next page, or
+        None for the last page. Raises a ValueError if after is not a sort
+        key of the order.
+
+        The providers are sorted by total supply of the medication ndcs,
+        active first, number of medications and distance, or only by
+        distance for the nearest order. The page is a list of dicts with
+        the id, active, total_supply, amount_medications and distance in
+        meters of the providers.
+        """
+        sql, key_columns = self.get_nearest_providers_sql(
+            medication_ndc_ids,
+            organization_ids,
+            vaccine_finder_types,
+            order,
+            after,
+        )
+        if after and (
+                len(after) != len(key_columns) or
+                not all(map(is_valid_sort_value, key_columns, after))):
+            raise ValueError('Invalid sort key {!r}'.format(after))
+        params = {
+            'distance': distance,
+            'limit': limit + 1,
+            'location': location.ewkt,
+            'medication_ndc_ids': list(medication_ndc_ids),
+            'organization_ids': list(organization_ids),
+            'vaccine_finder_types': list(vaccine_finder_types),
+        }
+        if after:
+            params.update(
+                ('after_{}'.format(column), value)
+                for column, value in zip(key_columns, after)
+            )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            columns = [column[0] for column in cursor.description]
+            providers = [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+        # One more provider than the limit is read to know if there is a
+        # next page
+        if len(providers) <= limit:
+            return providers, None
+        providers = providers[:limit]
+        return providers, [providers[-1][column] for column in key_columns]
+
 
 class Provider(models.Model):
     organization = models.ForeignKey(
@@ -380,6 +911,16 @@ class Provider(models.Model):
             'Last time this provider uploaded new information.'
         ),
     )
+    supply_as_of = models.DateTimeField(
+        _('supply unchanged as of'),
+        null=True,
+        blank=True,
+        help_text=_(
+            'Last import confirming the supplies of this provider, the'
+            ' latest supplies are still valid until this date even if'
+            ' they were created before.'
+        ),
+    )
     active = models.BooleanField(
         _('active'),
         default=True,
@@ -408,8 +949,7 @@ class Provider(models.Model):
         verbose_name = _('provider')
         verbose_name_plural = _('providers')
         indexes = [
-            models.Index(fields=['address', 'city', 'organization_id', 'phone',
-                                 'related_zipcode_id', 'state', 'store_number', 'zip'])
+            models.Index(fields=['organization_id', 'store_number'])
         ]
 
     def __str__(self):
@@ -610,7 +1150,316 @@ class MedicationNdc(models.Model):
         return self.ndc
 
 
+class ProviderMedicationNdcThroughManager(models.Manager):
+    """Custom manager to read the supplies history day by day."""
+
+    def _get_daily_entries_sql(self, filtered=True, by_provider=True):
+        """
+        SQL selecting, for every day between %(start_date)s and
+        %(end_date)s, the entries valid that day: the entries created that
+        day and the last entry of every (provider, medication ndc) pair,
+        carried forward until the next entry of the pair or the
+        supply_as_of date of its provider. Delta imports only write the
+        supplies that changed, the days in between have no entry. Only the
+        pairs of %(medication_ndc_ids)s, and of %(provider_ids)s unless
+        by_provider is False, are selected unless filtered is False.
+        """
+        filters = ''
+        if filtered:
+            filters = 'medication_ndc_id = ANY(%(medication_ndc_ids)s) AND '
+            if by_provider:
+                filters += 'provider_id = ANY(%(provider_ids)s) AND '
+
+        return (
+            'WITH entries AS ('
+            '    SELECT id, provider_id, medication_ndc_id, level,'
+            '        creation_date, creation_date::date AS day'
+            '    FROM {history_table}'
+            '    WHERE {filters}'
+            '        date >= %(start_date)s AND date <= %(end_date)s'
+            '    UNION ALL ('
+            '        SELECT DISTINCT ON (provider_id, medication_ndc_id)'
+            '            id, provider_id, medication_ndc_id, level,'
+            '            creation_date, creation_date::date AS day'
+            '        FROM {history_table}'
+            '        WHERE {filters} date < %(start_date)s'
+            '        ORDER BY provider_id, medication_ndc_id,'
+            '            creation_date DESC'
+            '    )'
+            '), ranges AS ('
+            '    SELECT entries.*, LEAD(day) OVER ('
+            '        PARTITION BY provider_id, medication_ndc_id'
+            '        ORDER BY creation_date, id'
+            '    ) AS next_day'
+            '    FROM entries'
+            ') '
+            'SELECT series.day::date AS day, ranges.id,'
+            '    ranges.provider_id, ranges.medication_ndc_id, ranges.level,'
+            '    ranges.creation_date '
+            'FROM ranges '
+            'JOIN {provider_table} provider'
+            '    ON provider.id = ranges.provider_id '
+            'CROSS JOIN LATERAL generate_series('
+            '    GREATEST(ranges.day, %(start_date)s),'
+            '    LEAST('
+            '        GREATEST('
+            '            ranges.day,'
+            '            COALESCE('
+            '                ranges.next_day - 1,'
+            '                provider.supply_as_of::date,'
+            '                ranges.day'
+            '            )'
+            '        ),'
+            '        %(end_date)s'
+            '    ),'
+            "    interval '1 day'"
+            ') AS series(day)'
+        ).format(
+            filters=filters,
+            history_table=self.model._meta.db_table,
+            provider_table=Provider._meta.db_table,
+        )
+
+    def _split_at_archived_days(self, start_date, end_date):
+        """
+        Return the (start, end) ranges of the days read from the
+        DailyProviderSupply rollup and from the table, None if empty.
+        """
+        archived_until = SupplyHistoryArchive.objects.get_archived_until()
+        if archived_until is None or start_date >= archived_until:
+            return None, (start_date, end_date)
+        if end_date < archived_until:
+            return (start_date, end_date), None
+        return (
+            (start_date, archived_until - timedelta(days=1)),
+            (archived_until, end_date),
+        )
+
+    def _execute_daily_query(self, sql, medication_ndc_ids, provider_ids, start_date, end_date):
+        with connection.cursor() as cursor:
+            cursor.execute(sql, {
+                'medication_ndc_ids': list(medication_ndc_ids),
+                'provider_ids': list(provider_ids),
+                'start_date': start_date,
+                'end_date': end_date,
+            })
+            return cursor.fetchall()
+
+    def daily_level_counts(self, medication_ndc_ids, provider_ids, start_date, end_date, per_medication_ndc=True):
+        """
+        Count the entries of every level day by day between the start_date
+        and end_date dates, per medication ndc unless per_medication_ndc is
+        False. Returns dicts with the creation_date_only, level,
+        count_for_level and medication_ndc_id keys. The archived days are
+        counted from the DailyProviderSupply rollup.
+        """
+        medication_ndc_ids = list(medication_ndc_ids)
+        provider_ids = list(provider_ids)
+        columns = ['creation_date_only', 'level']
+        if per_medication_ndc:
+            columns.append('medication_ndc_id')
+        archived_days, days = self._split_at_archived_days(
+            start_date,
+            end_date,
+        )
+
+        level_counts = []
+        if archived_days:
+            group_by = ['date', 'level']
+            if per_medication_ndc:
+                group_by.append('medication_ndc_id')
+            level_counts.extend(
+                dict(zip(columns + ['count_for_level'], row))
+                for row in DailyProviderSupply.objects.filter(
+                    date__range=archived_days,
+                    medication_ndc_id__in=medication_ndc_ids,
+                    provider_id__in=provider_ids,
+                ).values(
+                    *group_by
+                ).annotate(
+                    count_for_level=models.Count('id'),
+                ).order_by(
+                    'date',
+                ).values_list(
+                    *(group_by + ['count_for_level'])
+                )
+            )
+        if days:
+            sql = (
+                'SELECT day, level{medication_ndc_id}, COUNT(*) '
+                'FROM ({daily_entries}) AS daily_entries '
+                'GROUP BY day, level{medication_ndc_id} '
+                'ORDER BY day'
+            ).format(
+                daily_entries=self._get_daily_entries_sql(),
+                medication_ndc_id=(
+                    ', medication_ndc_id' if per_medication_ndc else ''
+                ),
+            )
+            level_counts.extend(
+                dict(zip(columns + ['count_for_level'], row))
+                for row in self._execute_daily_query(
+                    sql,
+                    medication_ndc_ids,
+                    provider_ids,
+                    *days
+                )
+            )
+        return level_counts
+
+    def daily_entry_ids(self, medication_ndc_ids, provider_ids, start_date, end_date):
+        """
+        Return the (day, entry id) tuples of the entries valid every day
+        between the start_date and end_date dates, ordered by day. The
+        entries of the archived days may not be in the table anymore.
+        """
+        medication_ndc_ids = list(medication_ndc_ids)
+        provider_ids = list(provider_ids)
+        archived_days, days = self._split_at_archived_days(
+            start_date,
+            end_date,
+        )
+
+        entry_ids = []
+        if archived_days:
+            entry_ids.extend(
+                DailyProviderSupply.objects.filter(
+                    date__range=archived_days,
+                    medication_ndc_id__in=medication_ndc_ids,
+                    provider_id__in=provider_ids,
+                ).order_by(
+                    'date',
+                    'entry_id',
+                ).values_list('date', 'entry_id')
+            )
+        if days:
+            sql = (
+                'SELECT day, id FROM ({daily_entries}) AS daily_entries '
+                'ORDER BY day, id'
+            ).format(daily_entries=self._get_daily_entries_sql())
+            entry_ids.extend(
+                self._execute_daily_query(
+                    sql,
+                    medication_ndc_ids,
+                    provider_ids,
+                    *days
+                )
+            )
+        return entry_ids
+
+    def rollup_daily_supplies(self, start_date, end_date):
+        """
+        Copy the level of every (provider, medication ndc) pair day by day
+        between the start_date and end_date dates into the
+        DailyProviderSupply rollup, keeping the last entry of every day.
+        """
+        sql = (
+            'INSERT INTO {rollup_table} '
+            '(date, provider_id, medication_ndc_id, level, entry_id) '
+            'SELECT DISTINCT ON (day, provider_id, medication_ndc_id) '
+            '    day, provider_id, medication_ndc_id, level, id '
+            'FROM ({daily_entries}) AS daily_entries '
+            'ORDER BY day, provider_id, medication_ndc_id, '
+            '    creation_date DESC, id DESC'
+        ).format(
+            daily_entries=self._get_daily_entries_sql(filtered=False),
+            rollup_table=DailyProviderSupply._meta.db_table,
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, {
+                'start_date': start_date,
+                'end_date': end_date,
+            })
+            return cursor.rowcount
+
+    def delete_replaced_entries(self, end_date):
+        """
+        Delete the entries up to end_date replaced by a newer entry of the
+        same (provider, medication ndc) pair up to end_date. The last
+        entry of every pair is kept, it is carried forward to the
+        following days.
+        """
+        sql = (
+            'DELETE FROM {history_table} AS entry '
+            'WHERE entry.date <= %(end_date)s '
+            'AND EXISTS ('
+            '    SELECT 1 FROM {history_table} AS new_entry'
+            '    WHERE new_entry.provider_id = entry.provider_id'
+            '        AND new_entry.medication_ndc_id = entry.medication_ndc_id'
+            '        AND new_entry.date <= %(end_date)s'
+            '        AND (new_entry.creation_date, new_entry.id)'
+            '            > (entry.creation_date, entry.id)'
+            ')'
+        ).format(history_table=self.model._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(sql, {'end_date': end_date})
+            return cursor.rowcount
+
+    def mark_replaced_entries_as_past(self, older_than, provider_ids):
+        """
+        Unset the latest flag of the entries created before older_than
+        that were replaced by a newer latest entry of the same
+        (provider, medication ndc) pair.
+        """
+        sql = (
+            'UPDATE {history_table} AS entry SET latest = false '
+            'WHERE entry.latest AND entry.creation_date < %s '
+            'AND entry.provider_id = ANY(%s) '
+            'AND EXISTS ('
+            '    SELECT 1 FROM {history_table} AS new_entry'
+            '    WHERE new_entry.provider_id = entry.provider_id'
+            '        AND new_entry.medication_ndc_id = entry.medication_ndc_id'
+            '        AND new_entry.creation_date >= %s'
+            '        AND new_entry.latest'
+            ')'
+        ).format(history_table=self.model._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [older_than, list(provider_ids), older_than])
+            return cursor.rowcount
+
+    def get_partitions(self):
+        """Return the (month, name) of the monthly partitions."""
+        with connection.cursor() as cursor:
+            return get_partitions(cursor, self.model._meta.db_table)
+
+    def get_default_partition_months(self):
+        """Return the months of the entries without a monthly partition."""
+        with connection.cursor() as cursor:
+            return get_default_partition_months(
+                cursor,
+                self.model._meta.db_table,
+            )
+
+    def create_partitions(self, start_date, end_date):
+        """
+        Create the missing monthly partitions between the two dates and
+        return their names.
+        """
+        with connection.cursor() as cursor:
+            return create_month_partitions(
+                cursor,
+                self.model._meta.db_table,
+                start_date,
+                end_date,
+            )
+
+    def detach_partitions(self, older_than, drop=False):
+        """
+        Detach, or drop, the monthly partitions ending before older_than
+        and return their names.
+        """
+        with connection.cursor() as cursor:
+            return detach_month_partitions(
+                cursor,
+                self.model._meta.db_table,
+                older_than,
+                drop,
+            )
+
+
 class ProviderMedicationNdcThrough(models.Model):
+    # The table is partitioned by month on the date column, see
+    # medications.partitions and migration 0078
     provider = models.ForeignKey(
         Provider,
         db_index=True,
@@ -624,33 +1473,31 @@ class ProviderMedicationNdcThrough(models.Model):
         on_delete=models.CASCADE,
         null=True,
     )
-    supply = models.CharField(
-        _('medication supply'),
-        max_length=32,
-        help_text=_(
-            'Use one of the following strings to add a valide supply: '
-            '<24, 24, 24-48, >48'
-        ),
-    )
-    level = models.IntegerField(
+    # The supply string is derived from the level, see the supply property
+    level = models.SmallIntegerField(
         _('medication level'),
-        default=0,
+        choices=SUPPLY_LEVEL_CHOICES,
+        default=SupplyLevel.NO_SUPPLY.value,
     )
+    # The date and creation_date columns have BRIN indexes, see migration
+    # 0083
     date = models.DateField(
         _('date'),
-        db_index=True,
         help_text=_('Date'),
     )
     creation_date = models.DateTimeField(
         _('creation date'),
         help_text=_('Creation date'),
     )
+    # The latest entries have a partial covering index on
+    # (medication_ndc_id, provider_id), see migration 0083
     latest = models.BooleanField(
         _('latest'),
-        db_index=True,
         default=False,
     )
 
+    objects = ProviderMedicationNdcThroughManager()
+
     class Meta:
         verbose_name = _('provider medication relation')
         verbose_name_plural = _('provider medication relations')
@@ -676,17 +1523,829 @@ class ProviderMedicationNdcThrough(models.Model):
             if self.date is None:
                 self.date = now
 
-        supply_to_level_map = {
-            'NO REPORT': -1,
-            'NO SUPPLY': 0,
-            '<24': 1,
-            '24': 2,
-            '24-48': 3,
-            '>48': 4,
-        }
-        self.level = supply_to_level_map.get(self.supply, 0)
+        self.level = SupplyLevel.get(self.level).value
         super().save(*args, **kwargs)
 
+    @property
+    def supply(self):
+        """Supply string of the level, as written in the CSV files."""
+        return SupplyLevel.get(self.level).supply
+
+    @supply.setter
+    def supply(self, supply):
+        self.level = SupplyLevel.from_supply(supply).value
+
+
+class CurrentProviderSupplyManager(models.Manager):
+    """Custom manager to keep the current supplies up to date."""
+
+    def refresh(self, provider_ids=None, since=None, medication_ndc_ids=None):
+        """
+        Upsert the latest ProviderMedicationNdcThrough entry of every
+        (provider, medication ndc) pair, optionally restricted to some
+        providers, medication ndcs or to the entries created since a date.
+        """
+        conditions = ['latest']
+        params = []
+        if provider_ids is not None:
+            conditions.append('provider_id = ANY(%s)')
+            params.append(list(provider_ids))
+        if medication_ndc_ids is not None:
+            conditions.append('medication_ndc_id = ANY(%s)')
+            params.append(list(medication_ndc_ids))
+        if since is not None:
+            conditions.append('creation_date >= %s')
+            params.append(since)
+
+        sql = (
+            'INSERT INTO {current_table} '
+            '(provider_id, medication_ndc_id, level, date, creation_date) '
+            'SELECT DISTINCT ON (provider_id, medication_ndc_id) '
+            'provider_id, medication_ndc_id, level, date, creation_date '
+            'FROM {history_table} '
+            'WHERE {conditions} '
+            'ORDER BY provider_id, medication_ndc_id, creation_date DESC '
+            'ON CONFLICT (provider_id, medication_ndc_id) DO UPDATE SET '
+            'level = EXCLUDED.level, '
+            'date = EXCLUDED.date, '
+            'creation_date = EXCLUDED.creation_date '
+            'WHERE {current_table}.creation_date <= EXCLUDED.creation_date'
+        ).format(
+            current_table=self.model._meta.db_table,
+            history_table=ProviderMedicationNdcThrough._meta.db_table,
+            conditions=' AND '.join(conditions),
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.rowcount
+
+
+class CurrentProviderSupply(models.Model):
+    """
+    Snapshot of the latest supply of every (provider, medication ndc)
+    pair, so reading the current supplies does not depend on the size of
+    the ProviderMedicationNdcThrough history.
+    """
+    provider = models.ForeignKey(
+        Provider,
+        related_name='current_supplies',
+        on_delete=models.CASCADE,
+    )
+    medication_ndc = models.ForeignKey(
+        MedicationNdc,
+        related_name='current_supplies',
+        on_delete=models.CASCADE,
+    )
+    level = models.SmallIntegerField(
+        _('medication level'),
+        choices=SUPPLY_LEVEL_CHOICES,
+        default=SupplyLevel.NO_SUPPLY.value,
+    )
+    date = models.DateField(
+        _('date'),
+    )
+    creation_date = models.DateTimeField(
+        _('creation date'),
+    )
+
+    objects = CurrentProviderSupplyManager()
+
+    class Meta:
+        verbose_name = _('current provider supply')
+        verbose_name_plural = _('current provider supplies')
+        unique_together = ('provider', 'medication_ndc')
+        indexes = [
+            models.Index(fields=['medication_ndc_id', 'provider_id'])
+        ]
+
+    def __str__(self):
+        return '{} - {}: {}'.format(
+            self.provider_id,
+            self.medication_ndc_id,
+            self.supply,
+        )
+
+    @property
+    def supply(self):
+        """Supply string of the level, as written in the CSV files."""
+        return SupplyLevel.get(self.level).supply
+
+
+class ImportRun(models.Model):
+    """
+    Record of a supply CSV upload with the counters and the per phase
+    timings of its import.
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCESS = 'success'
+    FAILED = 'failed'
+    SKIPPED = 'skipped'
+    STATUS_CHOICES = (
+        (QUEUED, _('Queued')),
+        (RUNNING, _('Running')),
+        (SUCCESS, _('Success')),
+        (FAILED, _('Failed')),
+        (SKIPPED, _('Skipped')),
+    )
+    # Runs that can not be started again by uploading the same file
+    ACTIVE_STATUSES = (QUEUED, RUNNING, SUCCESS)
+    organization = models.ForeignKey(
+        Organization,
+        related_name='import_runs',
+        on_delete=models.SET_NULL,
+        null=True,
+    )
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        related_name='import_runs',
+        on_delete=models.SET_NULL,
+        null=True,
+    )
+    file_name = models.CharField(
+        _('file name'),
+        max_length=255,
+        blank=True,
+    )
+    spool_name = models.CharField(
+        _('spooled file name'),
+        max_length=255,
+        blank=True,
+    )
+    file_checksum = models.CharField(
+        _('file checksum'),
+        max_length=64,
+        blank=True,
+        help_text=_('SHA-256 checksum of the uploaded file.'),
+    )
+    file_size = models.BigIntegerField(
+        _('file size'),
+        null=True,
+        blank=True,
+        help_text=_('Size of the uploaded file, in bytes.'),
+    )
+    # Unique among the active runs, see migration 0077
+    import_key = models.CharField(
+        _('import key'),
+        max_length=64,
+        blank=True,
+        db_index=True,
+        help_text=_(
+            'Hash of the file checksum, the organization and the day of '
+            'the supplies, identifying the duplicate uploads.'
+        ),
+    )
+    import_date = models.DateTimeField(
+        _('import date'),
+        null=True,
+        blank=True,
+        help_text=_('Date of the supplies when importing past supplies.'),
+    )
+    task_id = models.CharField(
+        _('task id'),
+        max_length=255,
+        blank=True,
+    )
+    status = models.CharField(
+        _('status'),
+        max_length=10,
+        choices=STATUS_CHOICES,
+        default=QUEUED,
+    )
+    error = models.TextField(
+        _('error'),
+        blank=True,
+    )
+    creation_date = models.DateTimeField(
+        _('creation date'),
+        default=timezone.now,
+    )
+    start_date = models.DateTimeField(
+        _('start date'),
+        null=True,
+        blank=True,
+    )
+    end_date = models.DateTimeField(
+        _('end date'),
+        null=True,
+        blank=True,
+    )
+    row_count = models.PositiveIntegerField(
+        _('rows'),
+        default=0,
+    )
+    rejected_row_count = models.PositiveIntegerField(
+        _('rejected rows'),
+        default=0,
+        help_text=_('Rows with an unknown NDC code.'),
+    )
+    unchanged_row_count = models.PositiveIntegerField(
+        _('unchanged rows'),
+        default=0,
+        help_text=_('Rows skipped by a delta import.'),
+    )
+    no_report_row_count = models.PositiveIntegerField(
+        _('no report rows'),
+        default=0,
+    )
+    provider_count = models.PositiveIntegerField(
+        _('providers'),
+        default=0,
+    )
+    created_provider_count = models.PositiveIntegerField(
+        _('created providers'),
+        default=0,
+    )
+    shard_count = models.PositiveIntegerField(
+        _('shards'),
+        default=0,
+    )
+    rows_per_second = models.FloatField(
+        _('rows per second'),
+        null=True,
+        blank=True,
+    )
+    peak_memory = models.PositiveIntegerField(
+        _('peak memory'),
+        null=True,
+        blank=True,
+        help_text=_('Highest resident memory of the workers, in kilobytes.'),
+    )
+    # Time spent in every phase in seconds, summed over all the shards
+    read_duration = models.FloatField(
+        _('read duration'),
+        default=0,
+    )
+    parse_duration = models.FloatField(
+        _('parse and sort duration'),
+        default=0,
+    )
+    provider_resolution_duration = models.FloatField(
+        _('provider resolution duration'),
+        default=0,
+    )
+    no_report_fill_duration = models.FloatField(
+        _('no report fill duration'),
+        default=0,
+    )
+    insert_duration = models.FloatField(
+        _('insert duration'),
+        default=0,
+    )
+    finish_duration = models.FloatField(
+        _('mark past and active duration'),
+        default=0,
+    )
+
+    class Meta:
+        verbose_name = _('import run')
+        verbose_name_plural = _('import runs')
+        ordering = ('-creation_date',)
+        indexes = [
+            models.Index(fields=['organization_id', 'creation_date'])
+        ]
+
+    def __str__(self):
+        return '{} - {}: {}'.format(
+            self.organization_id,
+            self.file_name,
+            self.status,
+        )
+
+    def record_stats(self, stats):
+        """Copy the counters and timings of an ImportStats."""
+        self.row_count = stats.counters['rows']
+        self.rejected_row_count = stats.counters['rejected_rows']
+        self.unchanged_row_count = stats.counters['unchanged_rows']
+        self.no_report_row_count = stats.counters['no_report_rows']
+        self.provider_count = stats.counters['providers']
+        self.created_provider_count = stats.counters['created_providers']
+        self.peak_memory = stats.peak_memory
+        for phase, duration in stats.durations.items():
+            setattr(self, '{}_duration'.format(phase), duration)
+
+        if self.start_date and self.end_date:
+            duration = (self.end_date - self.start_date).total_seconds()
+            if duration > 0:
+                self.rows_per_second = self.row_count / duration
+
+    @staticmethod
+    def get_import_key(file_checksum, organization_id, import_date=None):
+        """
+        Return the key of an import: the same file imported for the same
+        organization and day of supplies is a duplicate. The day of a
+        current import is the day it is uploaded.
+        """
+        if import_date:
+            import_day = import_date.date()
+        else:
+            import_day = timezone.localdate()
+        return hashlib.sha256(
+            '{}:{}:{}'.format(
+                organization_id,
+                import_day.isoformat(),
+                file_checksum,
+            ).encode()
+        ).hexdigest()
+
+    def get_duplicate(self):
+        """Return the active run importing the same file, if any."""
+        return ImportRun.objects.filter(
+            import_key=self.import_key,
+            status__in=self.ACTIVE_STATUSES,
+        ).exclude(
+            id=self.id,
+        ).first()
+
+    def get_upload(self):
+        """Return the reference of the spooled upload."""
+        return {
+            'name': self.spool_name,
+            'checksum': self.file_checksum,
+            'size': self.file_size,
+        }
+
+
+class ImportShard(models.Model):
+    """
+    Checkpoint of a shard of an import. A shard is marked as done in the
+    transaction loading its supplies, so a restarted import only loads
+    the shards that are not done yet.
+    """
+    PENDING = 'pending'
+    DONE = 'done'
+    STATUS_CHOICES = (
+        (PENDING, _('Pending')),
+        (DONE, _('Done')),
+    )
+    import_run = models.ForeignKey(
+        ImportRun,
+        related_name='shards',
+        on_delete=models.CASCADE,
+    )
+    number = models.PositiveIntegerField(
+        _('number'),
+    )
+    spool_name = models.CharField(
+        _('spooled file name'),
+        max_length=255,
+    )
+    file_checksum = models.CharField(
+        _('file checksum'),
+        max_length=64,
+    )
+    file_size = models.BigIntegerField(
+        _('file size'),
+    )
+    status = models.CharField(
+        _('status'),
+        max_length=10,
+        choices=STATUS_CHOICES,
+        default=PENDING,
+    )
+    row_count = models.PositiveIntegerField(
+        _('rows'),
+        default=0,
+    )
+    provider_ids = ArrayField(
+        models.IntegerField(),
+        verbose_name=_('updated providers'),
+        default=list,
+        blank=True,
+    )
+    stats = JSONField(
+        _('stats'),
+        null=True,
+        blank=True,
+    )
+    completion_date = models.DateTimeField(
+        _('completion date'),
+        null=True,
+        blank=True,
+    )
+
+    class Meta:
+        verbose_name = _('import shard')
+        verbose_name_plural = _('import shards')
+        ordering = ('import_run', 'number')
+        unique_together = ('import_run', 'number')
+
+    def __str__(self):
+        return '{} - {}: {}'.format(
+            self.import_run_id,
+            self.number,
+            self.status,
+        )
+
+    def get_spooled_file(self):
+        """Return the reference of the spooled shard."""
+        return {
+            'name': self.spool_name,
+            'checksum': self.file_checksum,
+            'size': self.file_size,
+        }
+
+    def get_result(self):
+        """Return the result of the import of a done shard."""
+        return {
+            'index': self.row_count,
+            'provider_ids': self.provider_ids,
+            'stats': self.stats,
+        }
+
+
+class DailyProviderSupply(models.Model):
+    """
+    Level of every (provider, medication ndc) pair day by day, rolled up
+    from the ProviderMedicationNdcThrough entries removed from the table
+    by the retention job and kept in a SupplyHistoryArchive.
+    """
+    date = models.DateField(
+        _('date'),
+    )
+    provider = models.ForeignKey(
+        Provider,
+        related_name='daily_supplies',
+        on_delete=models.CASCADE,
+    )
+    medication_ndc = models.ForeignKey(
+        MedicationNdc,
+        related_name='daily_supplies',
+        on_delete=models.CASCADE,
+    )
+    level = models.SmallIntegerField(
+        _('medication level'),
+        choices=SUPPLY_LEVEL_CHOICES,
+        default=SupplyLevel.NO_SUPPLY.value,
+    )
+    # Id of the archived ProviderMedicationNdcThrough entry valid that day
+    entry_id = models.IntegerField(
+        _('entry id'),
+    )
+
+    class Meta:
+        verbose_name = _('daily provider supply')
+        verbose_name_plural = _('daily provider supplies')
+        unique_together = ('date', 'provider', 'medication_ndc')
+        indexes = [
+            models.Index(fields=['date', 'medication_ndc_id'])
+        ]
+
+    def __str__(self):
+        return '{} - {} - {}: {}'.format(
+            self.date,
+            self.provider_id,
+            self.medication_ndc_id,
+            self.supply,
+        )
+
+    @property
+    def supply(self):
+        """Supply string of the level, as written in the CSV files."""
+        return SupplyLevel.get(self.level).supply
+
+
+class DailySupplyAggregateManager(models.Manager):
+    """Custom manager to fill and read the daily supply aggregates."""
+
+    # Key of the advisory lock serializing the refreshes
+    REFRESH_LOCK_ID = 2071
+
+    def _get_refreshed_providers(self, provider_ids):
+        """
+        Return the ids of the providers sharing the zip codes of the given
+        providers and the filter of their aggregates. The aggregates are per
+        zip code, so the ones of a zip code are recomputed from all its
+        providers.
+        """
+        zipcode_ids = set(
+            Provider.objects.filter(
+                id__in=provider_ids,
+            ).values_list('related_zipcode_id', flat=True)
+        )
+        filters = []
+        providers = Provider.objects.none()
+        if None in zipcode_ids:
+            zipcode_ids.remove(None)
+            filters.append('zipcode_id IS NULL')
+            providers = Provider.objects.filter(related_zipcode__isnull=True)
+        if zipcode_ids:
+            filters.append('zipcode_id = ANY(%(zipcode_ids)s)')
+            providers = providers | Provider.objects.filter(
+                related_zipcode_id__in=zipcode_ids,
+            )
+        return (
+            list(providers.values_list('id', flat=True)),
+            '({})'.format(' OR '.join(filters or ['false'])),
+            list(zipcode_ids),
+        )
+
+    def refresh(self, start_date, end_date, provider_ids=None, medication_ndc_ids=None):
+        """
+        Recompute the aggregates of the days between the start_date and
+        end_date dates from the daily supplies of the providers, read from
+        the DailyProviderSupply rollup for the archived days. Only the
+        aggregates of the zip codes of the provider_ids and of the
+        medication_ndc_ids are recomputed when given. Returns the number of
+        aggregates created.
+
+        The refreshes are serialized, two imports finishing together would
+        both delete the aggregates and then both insert them.
+        """
+        history_manager = ProviderMedicationNdcThrough.objects
+        filtered = provider_ids is not None or medication_ndc_ids is not None
+        params = {}
+        filters = []
+        if provider_ids is not None:
+            provider_ids, zipcode_filter, zipcode_ids = (
+                self._get_refreshed_providers(provider_ids)
+            )
+            params['zipcode_ids'] = zipcode_ids
+            filters.append(zipcode_filter)
+        elif filtered:
+            provider_ids = Provider.objects.values_list('id', flat=True)
+        if medication_ndc_ids is not None:
+            filters.append(
+                'medication_ndc_id = ANY(%(medication_ndc_ids)s)'
+            )
+        elif filtered:
+            medication_ndc_ids = MedicationNdc.objects.values_list(
+                'id',
+                flat=True,
+            )
+        if filtered:
+            params['provider_ids'] = list(provider_ids)
+            params['medication_ndc_ids'] = list(medication_ndc_ids)
+
+        archived_days, days = history_manager._split_at_archived_days(
+            start_date,
+            end_date,
+        )
+        sources = []
+        if archived_days:
+            rollup_sql = (
+                'SELECT date AS day, provider_id, medication_ndc_id, level '
+                'FROM {rollup_table} '
+                'WHERE {filters} '
+                'date >= %(start_date)s AND date <= %(end_date)s'
+            ).format(
+                filters=(
+                    'medication_ndc_id = ANY(%(medication_ndc_ids)s) '
+                    'AND provider_id = ANY(%(provider_ids)s) AND '
+                ) if filtered else '',
+                rollup_table=DailyProviderSupply._meta.db_table,
+            )
+            sources.append((rollup_sql, archived_days))
+        if days:
+            sources.append((
+                history_manager._get_daily_entries_sql(filtered=filtered),
+                days,
+            ))
+
+        row_count = 0
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT pg_advisory_xact_lock(%s)',
+                [self.REFRESH_LOCK_ID],
+            )
+            cursor.execute(
+                'DELETE FROM {} '
+                'WHERE {} date >= %(start_date)s '
+                'AND date <= %(end_date)s'.format(
+                    self.model._meta.db_table,
+                    ''.join(
+                        '{} AND '.format(sql_filter) for sql_filter in filters
+                    ),
+                ),
+                dict(params, start_date=start_date, end_date=end_date),
+            )
+            for daily_supplies, (source_start, source_end) in sources:
+                cursor.execute((
+                    'INSERT INTO {aggregate_table} '
+                    '(date, medication_ndc_id, state_id, county_id,'
+                    ' zipcode_id, provider_type_id, provider_category_id,'
+                    ' active, level, count) '
+                    'SELECT supplies.day, supplies.medication_ndc_id,'
+                    '    provider.related_state_id,'
+                    '    provider.related_county_id,'
+                    '    provider.related_zipcode_id, provider.type_id,'
+                    '    provider.category_id, provider.active,'
+                    '    supplies.level, COUNT(*) '
+                    'FROM ({daily_supplies}) AS supplies '
+                    'JOIN {provider_table} provider'
+                    '    ON provider.id = supplies.provider_id '
+                    'WHERE supplies.medication_ndc_id IS NOT NULL '
+                    'GROUP BY 1, 2, 3, 4, 5, 6, 7, 8, 9'
+                ).format(
+                    aggregate_table=self.model._meta.db_table,
+                    daily_supplies=daily_supplies,
+                    provider_table=Provider._meta.db_table,
+                ), dict(
+                    params,
+                    start_date=source_start,
+                    end_date=source_end,
+                ))
+                row_count += cursor.rowcount
+        return row_count
+
+    def daily_level_counts(self, medication_ndc_ids, provider_category_ids, provider_type_ids, start_date, end_date, state_id=None, zipcode=None, per_medication_ndc=True):
+        """
+        Count the providers supplies of every level day by day between the
+        start_date and end_date dates, optionally in a state or a zip code,
+        per medication ndc unless per_medication_ndc is False. Returns the
+        same dicts as ProviderMedicationNdcThrough.objects.daily_level_counts.
+        """
+        queryset = self.filter(
+            date__gte=start_date,
+            date__lte=end_date,
+            medication_ndc_id__in=medication_ndc_ids,
+            provider_category_id__in=provider_category_ids,
+            provider_type_id__in=provider_type_ids,
+        )
+        # Same geography filters than the providers of the historic views
+        if zipcode:
+            queryset = queryset.filter(zipcode__zipcode=zipcode)
+        if state_id:
+            queryset = queryset.filter(zipcode__state_id=state_id)
+
+        group_by = ['date', 'level']
+        if per_medication_ndc:
+            group_by.append('medication_ndc_id')
+        level_counts = list(
+            queryset.values(
+                *group_by
+            ).annotate(
+                count_for_level=models.Sum('count'),
+            ).order_by(
+                'date',
+            )
+        )
+        for level_count in level_counts:
+            level_count['creation_date_only'] = level_count.pop('date')
+        return level_counts
+
+
+class DailySupplyAggregate(models.Model):
+    """
+    Number of provider supplies of every level day by day, per medication
+    ndc, geography and provider facet, so the historic charts do not
+    depend on the number of providers and the size of the history. Filled
+    at the end of every import and by the
+    backfill_daily_supply_aggregates command.
+    """
+    date = models.DateField(
+        _('date'),
+    )
+    medication_ndc = models.ForeignKey(
+        MedicationNdc,
+        related_name='daily_supply_aggregates',
+        on_delete=models.CASCADE,
+    )
+    state = models.ForeignKey(
+        State,
+        related_name='daily_supply_aggregates',
+        on_delete=models.CASCADE,
+        null=True,
+    )
+    county = models.ForeignKey(
+        County,
+        related_name='daily_supply_aggregates',
+        on_delete=models.CASCADE,
+        null=True,
+    )
+    zipcode = models.ForeignKey(
+        ZipCode,
+        related_name='daily_supply_aggregates',
+        on_delete=models.CASCADE,
+        null=True,
+    )
+    provider_type = models.ForeignKey(
+        ProviderType,
+        related_name='daily_supply_aggregates',
+        on_delete=models.CASCADE,
+        null=True,
+    )
+    provider_category = models.ForeignKey(
+        ProviderCategory,
+        related_name='daily_supply_aggregates',
+        on_delete=models.CASCADE,
+        null=True,
+    )
+    # Active flag of the providers when the aggregate was computed, the
+    # maps only count the active providers
+    active = models.BooleanField(
+        _('active'),
+        default=True,
+    )
+    level = models.SmallIntegerField(
+        _('medication level'),
+        choices=SUPPLY_LEVEL_CHOICES,
+        default=SupplyLevel.NO_SUPPLY.value,
+    )
+    count = models.PositiveIntegerField(
+        _('count'),
+        default=0,
+    )
+
+    objects = DailySupplyAggregateManager()
+
+    class Meta:
+        verbose_name = _('daily supply aggregate')
+        verbose_name_plural = _('daily supply aggregates')
+        indexes = [
+            models.Index(fields=['date', 'medication_ndc_id']),
+            models.Index(fields=['state_id', 'date']),
+        ]
+
+    def __str__(self):
+        return '{} - {}: {} x {}'.format(
+            self.date,
+            self.medication_ndc_id,
+            self.count,
+            self.supply,
+        )
+
+    @property
+    def supply(self):
+        """Supply string of the level, as written in the CSV files."""
+        return SupplyLevel.get(self.level).supply
+
+
+class SupplyHistoryArchiveManager(models.Manager):
+
+    def get_archived_until(self):
+        """
+        Return the first day whose entries are still all in the
+        ProviderMedicationNdcThrough table, None if nothing was archived.
+        """
+        end_date = self.aggregate(
+            end_date=models.Max('end_date'),
+        )['end_date']
+        if end_date is None:
+            return None
+        return end_date + timedelta(days=1)
+
+
+class SupplyHistoryArchive(models.Model):
+    """
+    Compressed columnar file of the ProviderMedicationNdcThrough entries
+    of a range of days, written by the retention job before removing
+    them from the table.
+    """
+    start_date = models.DateField(
+        _('start date'),
+    )
+    end_date = models.DateField(
+        _('end date'),
+    )
+    file_name = models.CharField(
+        _('file name'),
+        max_length=255,
+    )
+    file_checksum = models.CharField(
+        _('file checksum'),
+        max_length=64,
+        help_text=_('SHA-256 checksum of the archive file.'),
+    )
+    file_size = models.BigIntegerField(
+        _('file size'),
+        help_text=_('Size of the archive file, in bytes.'),
+    )
+    row_count = models.PositiveIntegerField(
+        _('archived rows'),
+        default=0,
+    )
+    rollup_row_count = models.PositiveIntegerField(
+        _('rolled up rows'),
+        default=0,
+    )
+    deleted_row_count = models.PositiveIntegerField(
+        _('deleted rows'),
+        default=0,
+    )
+    creation_date = models.DateTimeField(
+        _('creation date'),
+        default=timezone.now,
+    )
+
+    objects = SupplyHistoryArchiveManager()
+
+    class Meta:
+        verbose_name = _('supply history archive')
+        verbose_name_plural = _('supply history archives')
+        ordering = ('start_date',)
+
+    def __str__(self):
+        return '{} - {}'.format(self.start_date, self.end_date)
+
+    def get_archive_file(self):
+        """Return the reference of the archive file."""
+        return {
+            'name': self.file_name,
+            'checksum': self.file_checksum,
+            'size': self.file_size,
+        }
+
 
 class ExistingMedication(models.Model):
     # Model for medication imported from the database.
@@ -0,0 +1,166 @@
+"""
+Monthly range partitions of the ProviderMedicationNdcThrough history table.
+
+The history table is partitioned on its date column, every month has its
+own partition named <table>_pYYYY_MM and a default partition receives the
+rows of the months without one. A month partition is always created on
+its own and attached after moving its rows out of the default partition,
+so the partitions can be created at any time, even once the default
+partition already holds rows of the month.
+
+The functions take a cursor so they can be used by the migration
+partitioning the table as well as by the manager of the model.
+"""
+from datetime import date
+
+
+def get_month(day):
+    return date(day.year, day.month, 1)
+
+
+def add_months(month, months):
+    """Return the first day of the month months after the given one."""
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def get_next_month(month):
+    return add_months(month, 1)
+
+
+def iter_months(start_date, end_date):
+    """Yield the first day of every month between the two dates."""
+    month = get_month(start_date)
+    while month <= end_date:
+        yield month
+        month = get_next_month(month)
+
+
+def get_partition_name(table, month):
+    return '{}_p{:%Y_%m}'.format(table, month)
+
+
+def get_default_partition_name(table):
+    return '{}_default'.format(table)
+
+
+def get_partitions(cursor, table):
+    """
+    Return the (month, name) of the month partitions attached to the
+    table, ordered by month.
+    """
+    prefix = '{}_p'.format(table)
+    cursor.execute(
+        'SELECT child.relname '
+        'FROM pg_inherits '
+        'JOIN pg_class parent ON parent.oid = pg_inherits.inhparent '
+        'JOIN pg_class child ON child.oid = pg_inherits.inhrelid '
+        'WHERE parent.relname = %s',
+        [table],
+    )
+    partitions = []
+    for name, in cursor.fetchall():
+        if not name.startswith(prefix):
+            continue
+        year, month = name[len(prefix):].split('_')
+        partitions.append((date(int(year), int(month), 1), name))
+    return sorted(partitions)
+
+
+def get_default_partition_months(cursor, table):
+    """Return the months of the rows held by the default partition."""
+    cursor.execute(
+        "SELECT DISTINCT date_trunc('month', date)::date "
+        'FROM {} ORDER BY 1'.format(get_default_partition_name(table))
+    )
+    return [month for month, in cursor.fetchall()]
+
+
+def create_default_partition(cursor, table):
+    cursor.execute(
+        'CREATE TABLE IF NOT EXISTS {partition} '
+        'PARTITION OF {table} DEFAULT'.format(
+            partition=get_default_partition_name(table),
+            table=table,
+        )
+    )
+
+
+def create_month_partition(cursor, table, month):
+    """
+    Create and attach the partition of a month, moving the rows of the
+    month out of the default partition. Returns False if the partition
+    already exists.
+    """
+    name = get_partition_name(table, month)
+    cursor.execute('SELECT to_regclass(%s)', [name])
+    if cursor.fetchone()[0]:
+        return False
+
+    params = {
+        'start_date': month,
+        'end_date': get_next_month(month),
+    }
+    cursor.execute(
+        'CREATE TABLE {partition} (LIKE {table} INCLUDING DEFAULTS)'.format(
+            partition=name,
+            table=table,
+        )
+    )
+    cursor.execute(
+        'WITH moved AS ('
+        '    DELETE FROM {default_partition}'
+        '    WHERE date >= %(start_date)s AND date < %(end_date)s'
+        '    RETURNING *'
+        ') '
+        'INSERT INTO {partition} SELECT * FROM moved'.format(
+            default_partition=get_default_partition_name(table),
+            partition=name,
+        ),
+        params,
+    )
+    # The indexes, primary key and foreign keys of the table are created
+    # on the partition when attaching it
+    cursor.execute(
+        'ALTER TABLE {table} ATTACH PARTITION {partition} '
+        'FOR VALUES FROM (%(start_date)s) TO (%(end_date)s)'.format(
+            partition=name,
+            table=table,
+        ),
+        params,
+    )
+    return True
+
+
+def create_month_partitions(cursor, table, start_date, end_date):
+    """
+    Create the missing partitions of the months between the two dates and
+    return the names of the created ones.
+    """
+    return [
+        get_partition_name(table, month)
+        for month in iter_months(start_date, end_date)
+        if create_month_partition(cursor, table, month)
+    ]
+
+
+def detach_month_partitions(cursor, table, older_than, drop=False):
+    """
+    Detach the partitions of the months ending before the older_than
+    date, the detached tables are dropped if drop is True. Returns the
+    names of the detached partitions.
+    """
+    detached = []
+    for month, name in get_partitions(cursor, table):
+        if get_next_month(month) > older_than:
+            continue
+        cursor.execute(
+            'ALTER TABLE {table} DETACH PARTITION {partition}'.format(
+                partition=name,
+                table=table,
+            )
+        )
+        if drop:
+            cursor.execute('DROP TABLE {}'.format(name))
+        detached.append(name)
+    return detached
@@ -0,0 +1,208 @@
+"""
+Rendering and compression of the GeoJSON-heavy responses.
+
+The simplified geometries of the maps are cached already encoded as
+GeoJSON, so the serializers return them as RawJSON fragments instead of
+parsing them, and PreEncodedJSONRenderer splices the fragments into the
+JSON of the rest of the response. The rest is encoded by orjson when it is
+installed, by the json module otherwise.
+
+The rendered responses are then compressed with brotli, when installed, or
+gzip depending on the Accept-Encoding header of the request. The
+compressed bytes of the cached responses are cached as well, so they are
+only compressed once per encoding.
+"""
+import gzip
+import json
+import re
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.cache import patch_vary_headers
+from rest_framework.compat import (
+    INDENT_SEPARATORS,
+    LONG_SEPARATORS,
+    SHORT_SEPARATORS,
+)
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Shorter responses are not worth compressing, like for GZipMiddleware
+COMPRESSION_MIN_LENGTH = 200
+
+
+class RawJSON:
+    """Encoded JSON inserted as is by PreEncodedJSONRenderer."""
+    __slots__ = ('fragment',)
+
+    def __init__(self, fragment):
+        if isinstance(fragment, str):
+            fragment = fragment.encode()
+        self.fragment = fragment
+
+
+class PreEncodedJSONEncoder(JSONRenderer.encoder_class):
+    """
+    Encoder replacing the RawJSON fragments by numbered tokens, the
+    fragments being appended to the fragments list.
+    """
+
+    def __init__(self, *args, fragments=None, token=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fragments = fragments
+        self.token = token
+
+    def default(self, obj):
+        if isinstance(obj, RawJSON):
+            self.fragments.append(obj.fragment)
+            return '{}{}'.format(self.token, len(self.fragments) - 1)
+        return super().default(obj)
+
+
+class PreEncodedJSONRenderer(JSONRenderer):
+    encoder_class = PreEncodedJSONEncoder
+
+    def encode(self, data, indent, fragments, token):
+        if orjson is not None and indent is None and self.compact \
+                and not self.ensure_ascii:
+            try:
+                # The datetimes are encoded like DRF does
+                return orjson.dumps(
+                    data,
+                    default=self.encoder_class(
+                        fragments=fragments,
+                        token=token,
+                    ).default,
+                    option=orjson.OPT_PASSTHROUGH_DATETIME,
+                )
+            except TypeError:
+                # Like non string keys, encoded by the json module
+                del fragments[:]
+
+        if indent is None:
+            separators = SHORT_SEPARATORS if self.compact else LONG_SEPARATORS
+        else:
+            separators = INDENT_SEPARATORS
+        return json.dumps(
+            data,
+            cls=self.encoder_class,
+            indent=indent,
+            ensure_ascii=self.ensure_ascii,
+            allow_nan=not self.strict,
+            separators=separators,
+            fragments=fragments,
+            token=token,
+        ).encode('utf-8')
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return bytes()
+
+        renderer_context = renderer_context or {}
+        indent = self.get_indent(accepted_media_type, renderer_context)
+        fragments = []
+        token = 'raw-json-{}-'.format(uuid.uuid4().hex)
+        ret = self.encode(data, indent, fragments, token)
+        # Escaped like the JSONRenderer does
+        ret = ret.replace(
+            '\u2028'.encode('utf-8'),
+            b'\\u2028',
+        ).replace(
+            '\u2029'.encode('utf-8'),
+            b'\\u2029',
+        )
+        if fragments:
+            ret = re.sub(
+                re.escape('"{}'.format(token).encode()) + br'(\d+)"',
+                lambda match: fragments[int(match.group(1))],
+                ret,
+            )
+        return ret
+
+
+def get_content_encoding(request):
+    """
+    Return the encoding to compress the response to the request with, br
+    or gzip, None if the request accepts neither.
+    """
+    accepted = set()
+    for coding in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        name, _, params = coding.partition(';')
+        try:
+            if float(params.strip().partition('=')[2]) == 0:
+                continue
+        except ValueError:
+            pass
+        accepted.add(name.strip().lower())
+    if brotli is not None and 'br' in accepted:
+        return 'br'
+    if 'gzip' in accepted:
+        return 'gzip'
+    return None
+
+
+def compress(content, encoding):
+    if encoding == 'br':
+        return brotli.compress(
+            content,
+            quality=settings.RESPONSE_BROTLI_QUALITY,
+        )
+    return gzip.compress(content, settings.RESPONSE_GZIP_LEVEL)
+
+
+def compress_response(request, response, cache_key=None):
+    """
+    Compress the content of a rendered successful response if the request
+    accepts it, the compressed bytes being cached under the cache_key of
+    the response if given.
+    """
+    if not settings.RESPONSE_COMPRESSION or response.status_code != 200 \
+            or response.streaming or response.has_header('Content-Encoding'):
+        return response
+
+    patch_vary_headers(response, ('Accept-Encoding',))
+    encoding = get_content_encoding(request)
+    if encoding is None or len(response.content) < COMPRESSION_MIN_LENGTH:
+        return response
+
+    content = None
+    if cache_key:
+        compressed_cache_key = '{}:{}'.format(cache_key, encoding)
+        content = cache.get(compressed_cache_key)
+    if content is None:
+        content = compress(response.content, encoding)
+        if cache_key:
+            cache.set(
+                compressed_cache_key,
+                content,
+                settings.RESPONSE_CACHE_TIMEOUT,
+            )
+    response.content = content
+    response['Content-Encoding'] = encoding
+    response['Content-Length'] = str(len(content))
+    return response
+
+
+class CompressedResponseMixin:
+    """Mixin of the API views compressing their successful responses."""
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(
+            request,
+            response,
+            *args,
+            **kwargs
+        )
+        if response.status_code == 200 and hasattr(response, 'render'):
+            response.render()
+        return compress_response(request, response)
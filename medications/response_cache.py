@@ -0,0 +1,185 @@
+"""
+Cache of the responses of the map, filters and historic endpoints.
+
+The responses only change when the supplies are imported or when the
+reference data is edited, so they are cached rendered under a key made of
+the endpoint, its url kwargs, the normalised query params, the state and
+zip code the user is restricted to, and the supply data version. As the
+version is incremented after every import and every save of the reference
+data, the cached responses are never served once outdated.
+
+The responses are compressed for the requests accepting it, see
+renderers.compress_response, and their compressed bytes cached alongside.
+
+The hits and misses of every endpoint are counted in the cache as well,
+with their total time in microseconds when it is measured.
+"""
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+
+from .renderers import compress_response
+from .utils import force_user_state_id_and_zipcode
+from .versions import get_supply_data_version
+
+
+def normalize_query_params(query_params):
+    """
+    Return the query params as a sorted list of (name, values), the values
+    of the list params like dosages[] being sorted and deduplicated.
+    """
+    params = []
+    for name in sorted(query_params):
+        values = query_params.getlist(name)
+        if name.endswith('[]'):
+            values = sorted(set(values))
+        params.append((name, values))
+    return params
+
+
+def get_response_cache_stats_key(name, counter):
+    return 'response_cache_stats:{}:{}'.format(name, counter)
+
+
+def count_response_cache_access(name, hit, elapsed=None):
+    """
+    Count a hit or a miss of an endpoint and the elapsed seconds it took,
+    if given.
+    """
+    counter = 'hits' if hit else 'misses'
+    key = get_response_cache_stats_key(name, counter)
+    cache.add(key, 0, timeout=None)
+    cache.incr(key)
+    if elapsed is not None:
+        key = get_response_cache_stats_key(name, '{}_time'.format(counter))
+        cache.add(key, 0, timeout=None)
+        cache.incr(key, int(elapsed * 1000000))
+
+
+def get_response_cache_stats(name):
+    """Return the hits, misses and hit rate of an endpoint."""
+    hits = cache.get(get_response_cache_stats_key(name, 'hits'), 0)
+    misses = cache.get(get_response_cache_stats_key(name, 'misses'), 0)
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': hits / (hits + misses) if hits + misses else None,
+    }
+
+
+def get_response_cache_latency(name):
+    """
+    Return the average milliseconds of the hits and of the misses of an
+    endpoint, None when not measured.
+    """
+    latency = {}
+    for counter in ('hits', 'misses'):
+        count = cache.get(get_response_cache_stats_key(name, counter), 0)
+        time = cache.get(
+            get_response_cache_stats_key(name, '{}_time'.format(counter)),
+        )
+        latency[counter] = (
+            time / count / 1000 if count and time is not None else None
+        )
+    return latency
+
+
+def reset_response_cache_stats(name):
+    cache.delete_many([
+        get_response_cache_stats_key(name, counter)
+        for counter in ('hits', 'misses', 'hits_time', 'misses_time')
+    ])
+
+
+class VersionedResponseCacheMixin:
+    """
+    Mixin of the API views caching their successful GET responses until
+    the supply data version changes, response_cache_name naming the
+    endpoint in the cache keys and stats. The views computing their own
+    response implement get_uncached instead of get.
+    """
+    response_cache_name = None
+
+    def get_response_cache_scope(self):
+        """
+        Return the state id and zip code the response is computed for,
+        state level users being restricted to their state.
+        """
+        query_params = self.request.query_params
+        state_id = self.kwargs.get(
+            'state_id',
+            getattr(self, 'state_id', None),
+        ) or query_params.get('state_id')
+        zipcode = self.kwargs.get(
+            'zipcode',
+            getattr(self, 'zipcode', None),
+        ) or query_params.get('zipcode')
+        return force_user_state_id_and_zipcode(
+            self.request.user,
+            state_id,
+            zipcode,
+        )
+
+    def get_response_cache_key(self):
+        state_id, zipcode = self.get_response_cache_scope()
+        key_data = json.dumps(
+            {
+                'format': self.request.accepted_renderer.format,
+                'kwargs': self.kwargs,
+                'query_params': normalize_query_params(
+                    self.request.query_params,
+                ),
+                'state_id': state_id,
+                'zipcode': zipcode,
+            },
+            default=str,
+            sort_keys=True,
+        )
+        return 'response:{}:{}:{}'.format(
+            self.response_cache_name,
+            get_supply_data_version(),
+            hashlib.sha256(key_data.encode()).hexdigest(),
+        )
+
+    def get(self, request, *args, **kwargs):
+        cache_key = self.get_response_cache_key()
+        cached_response = cache.get(cache_key)
+        count_response_cache_access(
+            self.response_cache_name,
+            cached_response is not None,
+        )
+        self.response_cache_key = cache_key
+        self.response_cache_hit = cached_response is not None
+        if cached_response is not None:
+            content, content_type = cached_response
+            return HttpResponse(content, content_type=content_type)
+        return self.get_uncached(request, *args, **kwargs)
+
+    def get_uncached(self, request, *args, **kwargs):
+        """Return the response of a cache miss."""
+        return super().get(request, *args, **kwargs)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(
+            request,
+            response,
+            *args,
+            **kwargs
+        )
+        cache_key = getattr(self, 'response_cache_key', None)
+        if cache_key and response.status_code == 200:
+            if not self.response_cache_hit:
+                # The response is rendered now instead of by the handler,
+                # the rendered content is what is cached
+                response.render()
+                cache.set(
+                    cache_key,
+                    (response.content, response['Content-Type']),
+                    settings.RESPONSE_CACHE_TIMEOUT,
+                )
+            # Compressed once the headers of the view are set
+            response = compress_response(request, response, cache_key)
+        return response
@@ -9,8 +9,9 @@ from django.conf import settings
 from datetime import datetime
 from rest_framework import serializers
 
-from .constants import field_rows
+from .constants import SUPPLY_LEVEL_GROUPS, field_rows
 from .models import (
+    ImportRun,
     Medication,
     MedicationName,
     State,
@@ -18,8 +19,10 @@ from .models import (
     ZipCode,
     Organization,
     ProviderType,
+    SimplifiedGeometry,
 )
-from .utils import get_supplies
+from .renderers import RawJSON
+from .utils import get_supplies, get_supplies_from_counts
 
 
 class CSVUploadSerializer(serializers.Serializer):
@@ -58,9 +61,12 @@ class CSVUploadSerializer(serializers.Serializer):
             raise serializers.ValidationError(
                 {'csv_file': _('Unknown CSV format')}
             )
-        decoded_file = file.read().decode('utf-8').splitlines()
-        reader = csv.DictReader(decoded_file)
-        if set(reader.fieldnames) != set(field_rows):
+        # Only the header is read, the file is streamed to the spool later
+        file.seek(0)
+        header = file.readline().decode('utf-8')
+        file.seek(0)
+        reader = csv.DictReader([header])
+        if set(reader.fieldnames or []) != set(field_rows):
             raise serializers.ValidationError(
                 {
                     'csv_file':
@@ -133,6 +139,7 @@ class GeoStateWithMedicationsListSerializer(serializers.ListSerializer):
         """
         Add GeoJSON compatible formatting to a serialized queryset list
         """
+        self.child.load_geometries(data)
         return OrderedDict((
             ("type", "FeatureCollection"),
             ("zoom", settings.ZOOM_US),
@@ -151,55 +158,47 @@ class GeoCountyWithMedicationsListSerializer(serializers.ListSerializer):
         """
         Add GeoJSON compatible formatting to a serialized queryset list
         """
+        self.child.load_geometries(data)
 
         if data:
             state_data = data[0]
             state_obj = state_data.state
 
-            center = {
-                "type": "Point",
-                "coordinates": [
-                    state_obj.center_lng,
-                    state_obj.center_lat
-                ]
-            }
+            center = get_center(state_obj)
+            bbox = get_bbox(state_obj)
         else:
             center = ''
+            bbox = None
 
-        active_provider_count = 0
-        total_provider_count = 0
-        flatten_medications_levels = []
-
-        for entry in data:
-
-            print(entry)
-            print(entry.__dict__)
-
-            active_provider_count += entry.active_provider_count
-            total_provider_count += entry.total_provider_count
-            if hasattr(state_data, 'medication_levels'):
-                for item in entry.medication_levels:
-                    flatten_medications_levels.append(item)
-
-        if not hasattr(state_data, 'medication_levels'):
+        # The counts of the state are computed with the counts of its
+        # counties by the view
+        state_level_counts = self.context.get('state_level_counts')
+        if state_level_counts is None:
             state_obj = state_data.state
             state = {
                 'name': state_obj.state_name,
                 'id': state_obj.id,
                 'code': state_obj.state_code,
                 'population': state_obj.population,
-                'active_provider_count': active_provider_count,
-                'total_provider_count': total_provider_count,
+                'active_provider_count': sum(
+                    entry.active_provider_count for entry in data
+                ),
+                'total_provider_count': sum(
+                    entry.total_provider_count for entry in data
+                ),
             }
             return OrderedDict((
                 ("type", "FeatureCollection"),
                 ("zoom", settings.ZOOM_STATE),
                 ("center", center),
+                ("bbox", bbox),
                 ("state", state),
                 ("features", [])
             ))
 
-        supplies, supply = get_supplies(flatten_medications_levels)
+        supplies, supply = get_supplies_from_counts(
+            get_level_counts(state_level_counts),
+        )
         state_obj = state_data.state
         state = {
             'name': state_obj.state_name,
@@ -208,19 +207,62 @@ class GeoCountyWithMedicationsListSerializer(serializers.ListSerializer):
             'supplies': supplies,
             'supply': supply,
             'population': state_obj.population,
-            'active_provider_count': active_provider_count,
-            'total_provider_count': total_provider_count,
+            'active_provider_count': state_level_counts['active_provider_count'],
+            'total_provider_count': state_level_counts['total_provider_count'],
 
         }
         return OrderedDict((
             ("type", "FeatureCollection"),
             ("zoom", settings.ZOOM_STATE),
             ("center", center),
+            ("bbox", bbox),
             ("state", state),
             ("features", super().to_representation(data))
         ))
 
 
+def get_geometry(instance, geometries):
+    """
+    Return the GeoJSON geometry of a State, County or ZipCode from its
+    simplified geometries by id, or from its full geometry if it was not
+    simplified. The geometry is kept encoded for PreEncodedJSONRenderer.
+    """
+    geojson = geometries.get(instance.id)
+    if geojson is not None:
+        return RawJSON(geojson)
+    return RawJSON(
+        instance.geometry.geojson
+    ) if instance.geometry else None
+
+
+def get_center(instance):
+    """
+    Return the GeoJSON of the stored centroid of a State, County or ZipCode.
+    """
+    return json.loads(
+        instance.centroid.geojson
+    ) if instance.centroid else None
+
+
+def get_bbox(instance):
+    """
+    Return the [xmin, ymin, xmax, ymax] stored bounding box of a State,
+    County or ZipCode.
+    """
+    return list(instance.bbox.extent) if instance.bbox else None
+
+
+def get_level_counts(counts):
+    """
+    Return the supply counts of every level group from the <group>_count
+    annotations or keys.
+    """
+    return {
+        group: counts['{}_count'.format(group)]
+        for group in SUPPLY_LEVEL_GROUPS
+    }
+
+
 def get_properties(instance, geographic_type=None):
     """
     Get the feature metadata which will be used for the GeoJSON
@@ -241,8 +283,10 @@ def get_properties(instance, geographic_type=None):
             'id': instance.state.id,
             'population': instance.state.population
         }
-    if hasattr(instance, 'medication_levels'):
-        supplies, supply = get_supplies(instance.medication_levels)
+    if hasattr(instance, 'nosupply_count'):
+        supplies, supply = get_supplies_from_counts(
+            get_level_counts(vars(instance)),
+        )
     else:
         # We pass an empty list only to receive that are no supplies
         # in case when med_id is nor in the request. We need to pass
@@ -274,6 +318,17 @@ class GeoJSONWithMedicationsSerializer(serializers.ModelSerializer):
         )
         return list_serializer_class(*args, **list_kwargs)
 
+    def load_geometries(self, instances):
+        """
+        Load the geometries of the instances simplified for the zoom of
+        the serializer at once.
+        """
+        self.geometries = SimplifiedGeometry.objects.get_geojson(
+            self.Meta.model,
+            [instance.id for instance in instances],
+            self.Meta.zoom,
+        )
+
     def to_representation(self, instance):
         """
         Serialize objects -> primitives.
@@ -287,9 +342,10 @@ class GeoJSONWithMedicationsSerializer(serializers.ModelSerializer):
 
         # required geometry attribute
         # MUST be present in output according to GeoJSON spec
-        feature["geometry"] = json.loads(
-            instance.geometry.geojson
-        ) if instance.geometry else None
+        feature["geometry"] = get_geometry(
+            instance,
+            getattr(self, 'geometries', {}),
+        )
 
         # GeoJSON properties
         geographic_type = getattr(
@@ -309,6 +365,7 @@ class GeoStateWithMedicationsSerializer(GeoJSONWithMedicationsSerializer):
         fields = '__all__'
         list_serializer_class = GeoStateWithMedicationsListSerializer
         geographic_type = 'state'
+        zoom = settings.ZOOM_US
 
 
 class GeoCountyWithMedicationsSerializer(GeoJSONWithMedicationsSerializer):
@@ -318,9 +375,11 @@ class GeoCountyWithMedicationsSerializer(GeoJSONWithMedicationsSerializer):
         fields = '__all__'
         list_serializer_class = GeoCountyWithMedicationsListSerializer
         geographic_type = 'county'
+        zoom = settings.ZOOM_STATE
 
 
 class GeoZipCodeWithMedicationsSerializer(serializers.ModelSerializer):
+    bbox = serializers.SerializerMethodField()
     center = serializers.SerializerMethodField()
     geometry = serializers.SerializerMethodField()
     properties = serializers.SerializerMethodField()
@@ -333,6 +392,7 @@ class GeoZipCodeWithMedicationsSerializer(serializers.ModelSerializer):
             'type',
             'zoom',
             'center',
+            'bbox',
             'properties',
             'geometry',
         )
@@ -344,14 +404,24 @@ class GeoZipCodeWithMedicationsSerializer(serializers.ModelSerializer):
         return settings.ZOOM_ZIPCODE
 
     def get_center(self, obj):
-        return json.loads(obj.centroid)
+        return get_center(obj)
+
+    def get_bbox(self, obj):
+        return get_bbox(obj)
 
     def get_properties(self, obj):
         properties = get_properties(obj, 'zipcode')
         return properties
 
     def get_geometry(self, obj):
-        return json.loads(obj.geometry.geojson)
+        return get_geometry(
+            obj,
+            SimplifiedGeometry.objects.get_geojson(
+                ZipCode,
+                [obj.id],
+                settings.ZOOM_ZIPCODE,
+            ),
+        )
 
 
 class ProviderCategoriesSerializer(serializers.Serializer):
@@ -402,3 +472,39 @@ class OrganizationSerializer(serializers.ModelSerializer):
             'website',
             'registration_date',
         )
+
+
+class ImportRunSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = ImportRun
+        fields = (
+            'id',
+            'organization',
+            'user',
+            'file_name',
+            'file_checksum',
+            'file_size',
+            'import_date',
+            'task_id',
+            'status',
+            'error',
+            'creation_date',
+            'start_date',
+            'end_date',
+            'row_count',
+            'rejected_row_count',
+            'unchanged_row_count',
+            'no_report_row_count',
+            'provider_count',
+            'created_provider_count',
+            'shard_count',
+            'rows_per_second',
+            'peak_memory',
+            'read_duration',
+            'parse_duration',
+            'provider_resolution_duration',
+            'no_report_fill_duration',
+            'insert_duration',
+            'finish_duration',
+        )
@@ -1,9 +1,50 @@
 from django.db import transaction
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 
-from .models import ProviderMedicationNdcThrough
-from .tasks import handle_provider_medication_through_post_save_signal
+from .models import (
+    County,
+    Medication,
+    MedicationDosage,
+    MedicationMedicationNameMedicationDosageThrough,
+    MedicationName,
+    MedicationNameEquivalence,
+    MedicationNdc,
+    MedicationType,
+    MedicationTypeMedicationNameThrough,
+    Organization,
+    Provider,
+    ProviderCategory,
+    ProviderMedicationNdcThrough,
+    ProviderType,
+    State,
+    ZipCode,
+)
+from .tasks import (
+    PROVIDER_INDEX_REBUILD_DELAY,
+    handle_provider_medication_through_post_save_signal,
+    rebuild_provider_index,
+)
+from .versions import increment_supply_data_version
+
+# Models of the reference data read by the cached responses
+REFERENCE_DATA_MODELS = (
+    County,
+    Medication,
+    MedicationDosage,
+    MedicationMedicationNameMedicationDosageThrough,
+    MedicationName,
+    MedicationNameEquivalence,
+    MedicationNdc,
+    MedicationType,
+    MedicationTypeMedicationNameThrough,
+    Organization,
+    Provider,
+    ProviderCategory,
+    ProviderType,
+    State,
+    ZipCode,
+)
 
 
 @receiver(post_save, sender=ProviderMedicationNdcThrough)
@@ -21,3 +62,26 @@ def provider_medication_through_post_save(sender, instance, **kwargs):
                 queue='signals',
             )
         )
+
+
+def reference_data_changed(sender, raw=False, **kwargs):
+    # The cached responses computed from the previous reference data are
+    # not served anymore, fixtures being loaded do not count
+    if not raw:
+        increment_supply_data_version()
+
+
+for model in REFERENCE_DATA_MODELS:
+    post_save.connect(reference_data_changed, sender=model)
+    post_delete.connect(reference_data_changed, sender=model)
+
+
+def provider_changed(sender, raw=False, **kwargs):
+    # The providers saved one by one, by the admin or the geocoding of the
+    # imported ones, are rebuilt together in the public finder index
+    if not raw:
+        rebuild_provider_index(delay=PROVIDER_INDEX_REBUILD_DELAY)
+
+
+post_save.connect(provider_changed, sender=Provider)
+post_delete.connect(provider_changed, sender=Provider)
@@ -0,0 +1,114 @@
+"""
+Spool of the supply CSV files waiting to be imported.
+
+Uploaded files are streamed to the default file storage, a local directory
+or S3 depending on the settings, and the import tasks only receive a
+reference to them: a dict with the storage name, the sha256 checksum and
+the size of the file. The shards of an import are spooled the same way.
+"""
+import hashlib
+import os
+import uuid
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.utils import timezone
+from django.utils.text import get_valid_filename
+
+
+def get_spool_name(file_name):
+    return os.path.join(
+        settings.SUPPLY_IMPORT_SPOOL_DIR,
+        '{}_{}'.format(uuid.uuid4().hex, get_valid_filename(file_name)),
+    )
+
+
+def get_checksum(file_obj):
+    """Return the sha256 checksum and the size of a file read by chunks."""
+    checksum = hashlib.sha256()
+    size = 0
+    file_obj.seek(0)
+    for chunk in file_obj.chunks():
+        checksum.update(chunk)
+        size += len(chunk)
+    file_obj.seek(0)
+    return checksum.hexdigest(), size
+
+
+def spool_upload(uploaded_file, checksum=None):
+    """
+    Stream an uploaded file to the spool and return the reference to pass
+    to the import tasks. The checksum is computed unless it is given.
+    """
+    if checksum is None:
+        checksum, size = get_checksum(uploaded_file)
+    else:
+        size = uploaded_file.size
+    name = default_storage.save(
+        get_spool_name(uploaded_file.name),
+        uploaded_file,
+    )
+    return {
+        'name': name,
+        'checksum': checksum,
+        'size': size,
+    }
+
+
+def spool_content(file_name, content):
+    """Spool the bytes of a generated file, like an import shard."""
+    name = default_storage.save(get_spool_name(file_name), ContentFile(content))
+    return {
+        'name': name,
+        'checksum': hashlib.sha256(content).hexdigest(),
+        'size': len(content),
+    }
+
+
+def open_spooled_file(reference):
+    """Open a spooled file for reading, checking it was fully written."""
+    size = default_storage.size(reference['name'])
+    if size != reference['size']:
+        raise IOError(
+            'Spooled file "{}" has {} bytes instead of {}'.format(
+                reference['name'],
+                size,
+                reference['size'],
+            )
+        )
+    return default_storage.open(reference['name'], 'rb')
+
+
+def delete_spooled_files(references):
+    for reference in references:
+        default_storage.delete(reference['name'])
+
+
+def clean_up_spool(days=None, kept_names=()):
+    """
+    Delete the spooled files older than days, SUPPLY_IMPORT_SPOOL_MAX_AGE_DAYS
+    by default, except the kept storage names, and return how many were
+    deleted.
+    """
+    if days is None:
+        days = settings.SUPPLY_IMPORT_SPOOL_MAX_AGE_DAYS
+    if not default_storage.exists(settings.SUPPLY_IMPORT_SPOOL_DIR):
+        return 0
+
+    older_than = timezone.now() - timedelta(days=days)
+    kept_names = set(kept_names)
+    directories, file_names = default_storage.listdir(
+        settings.SUPPLY_IMPORT_SPOOL_DIR,
+    )
+    deleted = 0
+    for file_name in file_names:
+        name = os.path.join(settings.SUPPLY_IMPORT_SPOOL_DIR, file_name)
+        if name in kept_names:
+            continue
+        if default_storage.get_modified_time(name) < older_than:
+            default_storage.delete(name)
+            deleted += 1
+    return deleted
@@ -1,5 +1,6 @@
 import re
 import io
+import itertools
 import boto3
 from botocore.client import Config
 import csv
@@ -7,15 +8,14 @@ import csv
 from datetime import datetime
 from time import sleep
 
-from celery import shared_task
+from celery import chord, shared_task
 from celery.decorators import task
 from datetime import timedelta
 from django.conf import settings
 from django.core.cache import cache
-from django.core.exceptions import MultipleObjectsReturned
 from django.core.mail import send_mail
-from django.db import IntegrityError
-from django.db.models import Count
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Min
 from django.utils import timezone
 from django.utils.timezone import get_current_timezone
 from io import BytesIO
@@ -26,278 +26,706 @@ from auth_ex.models import User
 
 from .models import (
     County,
+    CurrentProviderSupply,
+    DailySupplyAggregate,
     ExistingMedication,
+    ImportRun,
+    ImportShard,
     Medication,
     MedicationMedicationNameMedicationDosageThrough,
     MedicationName,
     MedicationNdc,
-    Organization,
     Provider,
     ProviderMedicationNdcThrough,
     State,
     ZipCode,
 )
-
-
-@shared_task
-# This task can't be atomic because we need to run a post_save signal for
-# every ProviderMedicationThrough object created
-def generate_medications(cache_key, organization_id, email_to, import_date=False):
-
-    def notify_by_email(email_to, beginning_time, index):
-        finnish_time = timezone.now()
-        duration = finnish_time - beginning_time
-        duration_seconds = duration.seconds
-        tz = timezone.pytz.timezone('EST')
-        est_finnish_time = datetime.now(tz)
-
-        msg_plain = (
-            'Completion date time: {}\n'
-            'Duration: {} seconds\n'
-            'Status: {} CSV rows correctly imported.\n'
-        ).format(
-            est_finnish_time.strftime('%Y-%m-%d %H:%M'),
-            duration_seconds,
-            index,
+from .archives import (
+    archive_supply_history as archive_old_supply_history,
+    get_archived_entries,
+)
+from .cache_warmup import warm_response_cache as warm_up_response_cache
+from .constants import SupplyLevel
+from .importers import iter_store_groups, iter_store_shards
+from .instrumentation import ImportStats
+from .spool import (
+    clean_up_spool,
+    delete_spooled_files,
+    open_spooled_file,
+    spool_content,
+)
+from .loaders import SupplyBatch, get_loader
+from .versions import increment_supply_data_version
+
+# Set while a delayed rebuild of the public finder index is scheduled
+PROVIDER_INDEX_REBUILD_KEY = 'provider_index_rebuild'
+# Seconds the provider changes are gathered in a single index rebuild
+PROVIDER_INDEX_REBUILD_DELAY = 60
+
+
+def build_zipcode_index(zipcodes=None):
+    """
+    Return a dict mapping every zip code, or only the given ones, to the
+    (zipcode id, state id, county id) its providers are related to.
+    """
+    zipcode_qs = ZipCode.objects.all()
+    if zipcodes is not None:
+        zipcode_qs = zipcode_qs.filter(zipcode__in=zipcodes)
+
+    county_map = {}
+    for zipcode_id, county_id in ZipCode.counties.through.objects.filter(
+        zipcode__in=zipcode_qs,
+    ).order_by(
+        'id',
+    ).values_list('zipcode_id', 'county_id'):
+        county_map.setdefault(zipcode_id, county_id)
+
+    zipcode_index = {}
+    for zipcode_id, zipcode, state_id in zipcode_qs.order_by(
+        'id',
+    ).values_list('id', 'zipcode', 'state_id'):
+        # Same as ZipCode.objects.filter(zipcode=zipcode)[0]
+        zipcode_index.setdefault(
+            zipcode,
+            (zipcode_id, state_id, county_map.get(zipcode_id)),
         )
-        send_mail(
-            'MedFinder Import Status',
-            msg_plain,
-            settings.FROM_EMAIL,
-            [email_to],
+    return zipcode_index
+
+
+def get_medication_ndcs():
+    """
+    Return the [ndc, medication ndc id, medication id] lists of all the
+    medication ndcs, read once per import and sent to its shards.
+    """
+    return [
+        list(medication_ndc)
+        for medication_ndc in MedicationNdc.objects.order_by(
+            'id',
+        ).values_list('ndc', 'id', 'medication_id')
+    ]
+
+
+def create_missing_providers(stores_data, organization_id, provider_map, zipcode_index):
+    """
+    Create with a single query the providers of the stores not found in
+    provider_map, adding them to it. The new providers are related to
+    their zip code but are not geocoded, which is left to the
+    geocode_providers task. Returns the ids of the new providers.
+    """
+    new_providers = {}
+    for store_data in stores_data:
+        store_number = str(store_data['store_number'])
+        if store_number in provider_map or store_number in new_providers:
+            continue
+
+        zipcode_id, state_id, county_id = zipcode_index.get(
+            store_data['zip'],
+            (None, None, None),
+        )
+        new_providers[store_number] = Provider(
+            organization_id=organization_id,
+            related_zipcode_id=zipcode_id,
+            related_state_id=state_id,
+            related_county_id=county_id,
+            change_coordinates=True,
+            **store_data
         )
 
-    def get_provider_id(store_data, organization_id, provider_map):
-        store_number = store_data['store_number']
+    if not new_providers:
+        return []
 
-        if str(store_number) in provider_map:
-            return provider_map[str(store_number)]
+    Provider.objects.bulk_create(
+        new_providers.values(),
+        batch_size=settings.SUPPLY_IMPORT_BATCH_SIZE,
+    )
+    for store_number, provider in new_providers.items():
+        provider_map[store_number] = provider.id
+    return [provider.id for provider in new_providers.values()]
 
-        provider, created = Provider.objects.get_or_create(
-            defaults=store_data,
-            organization_id=organization_id,
-            store_number=store_number,
+
+def is_delta_import(import_date=False, delta=None):
+    """
+    Return whether an import only writes the supplies that changed, which
+    is only possible when importing the current supplies.
+    """
+    if delta is None:
+        delta = settings.SUPPLY_IMPORT_DELTA
+    return bool(delta and not import_date)
+
+
+def get_import_day(import_date=False):
+    """Return the day of the supplies of an import."""
+    if import_date:
+        return datetime.strptime(import_date[0:10], '%Y-%m-%d').date()
+    return timezone.now().date()
+
+
+def mark_provider_has_active(updated_provider_ids, import_date=False):
+    now = timezone.now()
+    fields = {
+        'last_import_date': now,
+        'active': True,
+    }
+    # Importing past supplies does not confirm the current ones
+    if not import_date:
+        fields['supply_as_of'] = now
+    Provider.objects.filter(
+        id__in=updated_provider_ids,
+    ).update(**fields)
+
+
+def mark_previous_entries_as_past(older_than_me, updated_provider_ids, delta=False):
+    if delta:
+        # Entries of unchanged supplies were not replaced and stay latest
+        ProviderMedicationNdcThrough.objects.mark_replaced_entries_as_past(
+            older_than_me,
+            updated_provider_ids,
         )
+        return
 
-        if created:
-            try:
-                zipcode_obj = ZipCode.objects.get(zipcode=store_data['zip'])
-            except MultipleObjectsReturned:
-                zipcode_obj = ZipCode.objects.filter(
-                    zipcode=store_data['zip'])[0]
-            except ZipCode.DoesNotExist:
-                zipcode_obj = None
-
-            if zipcode_obj:
-                provider.related_zipcode = zipcode_obj
-                provider.save()
-
-        return provider.id
-
-    def find_missing_medication_ids(medication_data, medication_ndc_map, ndc_to_medication_map, medication_id_to_ndc_code_map):
-        all_med_ids = list(set(ndc_to_medication_map.values()))
-
-        medication_ids = []
-        for data in medication_data:
-            medication_ids.append(
-                ndc_to_medication_map[find_medication_ndc_id(data, medication_ndc_map)])
-
-        for medication_id in medication_ids:
-            all_med_ids.remove(medication_id)
-
-        return all_med_ids
-
-    def add_no_report_entries(medication_data, missing_medication_ids, medication_id_to_ndc_code_map):
-        for missing_medication_id in missing_medication_ids:
-            medication_data.append({
-                'level': -1,
-                'ndc_code': medication_id_to_ndc_code_map[missing_medication_id],
-                'supply': 'NO REPORT',
-            })
-        return medication_data
-
-    def prepare_medication_data(provider_id, medication_data, number_of_medication_to_create, import_date, medication_ndc_map, ndc_to_medication_map, medication_id_to_ndc_code_map):
-        if len(medication_data) != number_of_medication_to_create:
-            missing_medication_ids = find_missing_medication_ids(
-                medication_data, medication_ndc_map, ndc_to_medication_map, medication_id_to_ndc_code_map)
-            medication_data = add_no_report_entries(
-                medication_data, missing_medication_ids, medication_id_to_ndc_code_map)
-
-        provider_medication_ndc_throughs = build_ProviderMedicationNdcThrough_objects(
-            provider_id, medication_data, import_date, medication_ndc_map)
-
-        return provider_medication_ndc_throughs
-
-    def find_medication_ndc_id(data, medication_ndc_map):
-        if data['ndc_code'] in medication_ndc_map:
-            return medication_ndc_map[data['ndc_code']]
-        else:
-            return False
+    ProviderMedicationNdcThrough.objects.filter(
+        creation_date__lt=older_than_me,
+        latest=True,
+        provider_id__in=updated_provider_ids,
+    ).update(latest=False)
 
-    def build_ProviderMedicationNdcThrough_objects(provider_id, medication_data, import_date, medication_ndc_map):
-        objects = []
-
-        for data in medication_data:
-            objects.append(build_ProviderMedicationNdcThrough_object(
-                data['supply'], data['level'], provider_id, find_medication_ndc_id(data, medication_ndc_map), import_date))
-
-        return objects
-
-    def build_ProviderMedicationNdcThrough_object(supply, level, provider_id, medication_ndc_id, import_date):
-        if medication_ndc_id:
-            if import_date:
-                return ProviderMedicationNdcThrough(
-                    creation_date=import_date,
-                    date=import_date[0:10],
-                    latest=False,
-                    level=level,
-                    medication_ndc_id=medication_ndc_id,
-                    provider_id=provider_id,
-                    supply=supply,
-                )
-            else:
-                now = timezone.now()
-                return ProviderMedicationNdcThrough(
-                    creation_date=now,
-                    date=now,
-                    latest=True,
-                    level=level,
-                    medication_ndc_id=medication_ndc_id,
-                    provider_id=provider_id,
-                    supply=supply,
-                )
 
-    def prepare_current_store_data(store_data, medication_data, organization_id, number_of_medication_to_create, import_date, medication_ndc_map, ndc_to_medication_map, medication_id_to_ndc_code_map, provider_map):
-        provider_id = get_provider_id(
-            store_data, organization_id, provider_map)
+def rebuild_provider_index(delay=None):
+    """
+    Rebuild the index of the public finder once the supplies are committed,
+    when the API workers search in it. With a delay in seconds, a single
+    rebuild is run for all the changes committed during the delay.
+    """
+    if not settings.PUBLIC_PROVIDER_INDEX_ENABLED:
+        return
+    # The public app reads the supplies of this one
+    from public.tasks import build_provider_index
+    if delay is None:
+        transaction.on_commit(build_provider_index.delay)
+        return
 
-        provider_medication_ndc_throughs = prepare_medication_data(provider_id, medication_data,
-                                                                   number_of_medication_to_create, import_date, medication_ndc_map, ndc_to_medication_map, medication_id_to_ndc_code_map)
+    def schedule_rebuild():
+        if cache.add(PROVIDER_INDEX_REBUILD_KEY, True, delay):
+            build_provider_index.apply_async(countdown=delay)
+
+    transaction.on_commit(schedule_rebuild)
+
+
+def finish_supplies_import(beginning_time, updated_provider_ids, stats=None, import_date=False, delta=None):
+    """
+    Run the steps done once per import after all its rows are loaded,
+    beginning_time being the time the import started at.
+    """
+    stats = stats if stats is not None else ImportStats()
+    with stats.phase('finish'):
+        # Mark previous ProviderMedicationNdcThrough as past
+        mark_previous_entries_as_past(
+            beginning_time,
+            updated_provider_ids,
+            is_delta_import(import_date, delta),
+        )
 
-        return provider_medication_ndc_throughs, provider_id
+        # Copy the new latest entries to the current supplies snapshot
+        CurrentProviderSupply.objects.refresh(
+            provider_ids=updated_provider_ids,
+            since=beginning_time,
+        )
 
-    def mark_provider_has_active(updated_provider_ids):
-        Provider.objects.filter(
-            id__in=updated_provider_ids,
-        ).update(
-            last_import_date=timezone.now(),
-            active=True,
+        # Finally update the last_import_date in all the updated_providers
+        mark_provider_has_active(updated_provider_ids, import_date)
+
+        # Recompute the daily aggregates of the providers of the import on
+        # the days it changed, past supplies are carried forward up to
+        # today. The supply_as_of date of the providers also carries their
+        # other supplies forward, so all their medication ndcs are
+        # recomputed
+        DailySupplyAggregate.objects.refresh(
+            get_import_day(import_date),
+            timezone.now().date(),
+            provider_ids=updated_provider_ids,
         )
 
-    def mark_previous_entries_as_past(older_than_me, updated_provider_ids):
-        ProviderMedicationNdcThrough.objects.filter(
-            creation_date__lt=older_than_me,
-            latest=True,
-            provider_id__in=updated_provider_ids,
-        ).update(latest=False)
+        # The cached maps of the previous supplies are not served anymore
+        increment_supply_data_version()
+        rebuild_provider_index()
 
-    def batch_create_provider_medication_ndc_throughs(provider_medication_ndc_throughs):
-        ProviderMedicationNdcThrough.objects.bulk_create(
-            provider_medication_ndc_throughs)
 
+def import_supplies(file_obj, organization_id, import_date=False, loader=None, stats=None, delta=None):
+    """
+    Import the supply levels of the CSV file_obj for the providers of
+    the given organization, writing them with the given loader backend.
+    Returns the number of CSV rows processed.
+    """
     beginning_time = timezone.now()
+    index, updated_provider_ids = load_supplies(
+        file_obj,
+        organization_id,
+        import_date,
+        loader,
+        stats,
+        delta,
+    )
+    finish_supplies_import(
+        beginning_time,
+        updated_provider_ids,
+        stats,
+        import_date,
+        delta,
+    )
+    return index
+
+
+def load_supplies(file_obj, organization_id, import_date=False, loader=None, stats=None, delta=None, medication_ndcs=None):
+    """
+    Load the supply levels of the CSV file_obj for the providers of the
+    given organization, without the steps run once per import. A delta
+    import only writes the supplies that differ from the current ones.
+    Returns the number of CSV rows processed and the ids of the providers
+    found in the file, the counters and timings are added to stats.
+
+    Only the providers of the stores of the file are read, by batch of
+    stores, and medication_ndcs, as returned by get_medication_ndcs, are
+    read when not given.
+    """
+
+    def get_provider_id(store_data, provider_map):
+        # Missing providers are created beforehand by
+        # create_missing_providers
+        return provider_map[str(store_data['store_number'])]
+
+    def is_unchanged(provider_id, medication_ndc_id, level):
+        return current_supplies.get(
+            (provider_id, medication_ndc_id)
+        ) == level
+
+    def add_store_rows(batch, provider_id, store_rows):
+        reported_medication_ids = set()
+        for row in store_rows:
+            medication_ndc_id = medication_ndc_map.get(row.get('med_code'))
+            # Rows with an unknown NDC code can't be imported
+            if not medication_ndc_id:
+                stats.count('rejected_rows')
+                continue
+            level = SupplyLevel.from_supply(row.get('supply_level'))
+            reported_medication_ids.add(
+                ndc_to_medication_map[medication_ndc_id]
+            )
+            if is_unchanged(provider_id, medication_ndc_id, level):
+                stats.count('unchanged_rows')
+                continue
+            batch.append(provider_id, medication_ndc_id, level)
+        return reported_medication_ids
+
+    def add_no_report_rows(batch, provider_id, reported_medication_ids):
+        # Medications without a row for the store are not reported
+        for medication_id in sorted(
+            all_medication_ids - reported_medication_ids
+        ):
+            medication_ndc_id = medication_id_to_ndc_id[medication_id]
+            if is_unchanged(
+                provider_id,
+                medication_ndc_id,
+                SupplyLevel.NO_REPORT,
+            ):
+                stats.count('unchanged_rows')
+                continue
+            batch.append(provider_id, medication_ndc_id, SupplyLevel.NO_REPORT)
+            stats.count('no_report_rows')
+
+    def load_current_supplies(provider_ids):
+        # Only the current supplies of a batch of stores are kept in memory
+        current_supplies.clear()
+        if not delta:
+            return
+        for provider_id, medication_ndc_id, level in CurrentProviderSupply.objects.filter(
+            provider_id__in=provider_ids,
+        ).values_list('provider_id', 'medication_ndc_id', 'level'):
+            current_supplies[(provider_id, medication_ndc_id)] = level
+
+    def new_supply_batch():
+        # All the rows of an import share the same creation date
+        return SupplyBatch(
+            date=import_date[0:10] if import_date else now.date(),
+            creation_date=import_date or now,
+            latest=not import_date,
+        )
 
-    # A list to update the last_import_date field in
+    stats = stats if stats is not None else ImportStats()
+    delta = is_delta_import(import_date, delta)
+    current_supplies = {}
+
+    # A set to update the last_import_date field in
     # all providers during this import
-    updated_provider_ids = []
+    updated_provider_ids = set()
 
     number_of_medication_to_create = Medication.objects.count()
-    organization = Organization.objects.get(pk=organization_id)
-    existing_ndc_codes = ExistingMedication.objects.values_list(
-        'ndc',
-        flat=True,
-    )
-    provider = None
-    medication_ndc = None
     medication_ndc_map = {}  # Use this map to save queries to the DB
     ndc_to_medication_map = {}
     medication_id_to_ndc_code_map = {}
 
-    for ndc_entry in MedicationNdc.objects.all():
-        medication_ndc_map[ndc_entry.ndc] = ndc_entry.id
-        ndc_to_medication_map[ndc_entry.id] = ndc_entry.medication_id
-        medication_id_to_ndc_code_map[ndc_entry.medication_id] = ndc_entry.ndc
+    if medication_ndcs is None:
+        medication_ndcs = get_medication_ndcs()
+    for ndc, medication_ndc_id, medication_id in medication_ndcs:
+        medication_ndc_map[ndc] = medication_ndc_id
+        ndc_to_medication_map[medication_ndc_id] = medication_id
+        medication_id_to_ndc_code_map[medication_id] = ndc
+
+    all_medication_ids = set(ndc_to_medication_map.values())
+    medication_id_to_ndc_id = {
+        medication_id: medication_ndc_map[ndc_code]
+        for medication_id, ndc_code in medication_id_to_ndc_code_map.items()
+    }
 
     provider_map = {}  # Use this map to save queries to the DB
+    created_provider_ids = []
 
-    for provider in Provider.objects.filter(organization_id=organization_id):
-        provider_map[str(provider.store_number)] = provider.id
+    def resolve_providers(stores_data):
+        store_numbers = {
+            str(store_data['store_number']) for store_data in stores_data
+        } - set(provider_map)
+        for provider_id, store_number in Provider.objects.filter(
+            organization_id=organization_id,
+            store_number__in=store_numbers,
+        ).values_list('id', 'store_number'):
+            provider_map[str(store_number)] = provider_id
 
-    csv_file = cache.get(cache_key)
-    temporary_file_obj = csv_file.open()
-    decoded_file = temporary_file_obj.read().decode('utf-8').splitlines()
-    reader = csv.DictReader(decoded_file)
-    sorted_csv = sorted(reader, key=lambda d: float(d['store #']))
+        missing_stores_data = [
+            store_data for store_data in stores_data
+            if str(store_data['store_number']) not in provider_map
+        ]
+        if missing_stores_data:
+            # Zip codes of the new providers are resolved in memory
+            created_provider_ids.extend(create_missing_providers(
+                missing_stores_data,
+                organization_id,
+                provider_map,
+                build_zipcode_index({
+                    store_data['zip'] for store_data in missing_stores_data
+                }),
+            ))
+
+    def iter_supply_batches():
+        nonlocal index
+        batch = new_supply_batch()
+        # The file is streamed and grouped by store, so only the rows of
+        # a batch of stores and the current SupplyBatch are kept in memory
+        store_groups = iter_store_groups(file_obj)
+        while True:
+            with stats.phase('parse'):
+                store_batch = list(itertools.islice(
+                    store_groups,
+                    settings.SUPPLY_IMPORT_PROVIDER_BATCH_SIZE,
+                ))
+            if not store_batch:
+                break
+
+            with stats.phase('provider_resolution'):
+                resolve_providers(
+                    [store_data for store_data, store_rows in store_batch],
+                )
+                load_current_supplies([
+                    get_provider_id(store_data, provider_map)
+                    for store_data, store_rows in store_batch
+                ])
+
+            for current_store_data, store_rows in store_batch:
+                index += len(store_rows)
+                provider_id = get_provider_id(current_store_data, provider_map)
+                with stats.phase('parse'):
+                    reported_medication_ids = add_store_rows(
+                        batch,
+                        provider_id,
+                        store_rows,
+                    )
+                if len(store_rows) != number_of_medication_to_create:
+                    with stats.phase('no_report_fill'):
+                        add_no_report_rows(
+                            batch,
+                            provider_id,
+                            reported_medication_ids,
+                        )
+                updated_provider_ids.add(provider_id)
+
+                if len(batch) >= supply_loader.chunk_size:
+                    yield batch
+                    batch = new_supply_batch()
+
+        if len(batch):
+            yield batch
+
+    now = timezone.now()
     index = 0
+    supply_loader = get_loader(loader)
+    for batch in iter_supply_batches():
+        # Time spent building the batches is counted in the other phases
+        with stats.phase('insert'):
+            supply_loader.load_batches([batch])
+
+    stats.count('rows', index)
+    stats.count('providers', len(updated_provider_ids))
+    stats.count('created_providers', len(created_provider_ids))
+    stats.measure_peak_memory()
+
+    # Geocoding does an HTTP request per provider, keep it out of the import
+    if created_provider_ids:
+        transaction.on_commit(
+            lambda: geocode_providers.delay(created_provider_ids)
+        )
 
-    currently_processing_store_number = False
-    current_store_data = {}
-    current_store_medications_data = {}
+    return index, updated_provider_ids
 
-    provider_medication_ndc_throughs_to_batch_insert = []
 
-    supply_to_level_map = {
-        'NO REPORT': -1,
-        'NO SUPPLY': 0,
-        '<24': 1,
-        '24': 2,
-        '24-48': 3,
-        '>48': 4,
-    }
+def notify_import_by_email(email_to, beginning_time, index, provider_count, shard_count):
+    finnish_time = timezone.now()
+    duration = finnish_time - beginning_time
+    duration_seconds = int(duration.total_seconds())
+    tz = timezone.pytz.timezone('EST')
+    est_finnish_time = datetime.now(tz)
 
-    for row in sorted_csv:
-        index += 1
+    msg_plain = (
+        'Completion date time: {}\n'
+        'Duration: {} seconds\n'
+        'Status: {} CSV rows correctly imported.\n'
+        'Providers: {} providers updated in {} shards.\n'
+    ).format(
+        est_finnish_time.strftime('%Y-%m-%d %H:%M'),
+        duration_seconds,
+        index,
+        provider_count,
+        shard_count,
+    )
+    send_mail(
+        'MedFinder Import Status',
+        msg_plain,
+        settings.FROM_EMAIL,
+        [email_to],
+    )
 
-        store_number = row.get('store #')
-        supply_level = row.get('supply_level')
-        level = supply_to_level_map.get(supply_level, 0)
 
-        current_medication_data = {
-            'level': level,
-            'ndc_code': row.get('med_code'),
-            'supply': supply_level,
-        }
+def mark_import_run_as_failed(import_run_id, exc):
+    if import_run_id:
+        ImportRun.objects.filter(id=import_run_id).update(
+            end_date=timezone.now(),
+            error=repr(exc),
+            status=ImportRun.FAILED,
+        )
 
-        if currently_processing_store_number == store_number:
-            current_store_medications_data.append(current_medication_data)
-        else:
-            if currently_processing_store_number:
-                provider_medication_ndc_throughs, provider_id = prepare_current_store_data(
-                    current_store_data, current_store_medications_data, organization_id, number_of_medication_to_create, import_date, medication_ndc_map, ndc_to_medication_map, medication_id_to_ndc_code_map, provider_map)
 
-                provider_medication_ndc_throughs_to_batch_insert = provider_medication_ndc_throughs_to_batch_insert + \
-                    provider_medication_ndc_throughs
+@shared_task(bind=True, acks_late=True)
+def generate_medications(self, import_run_id, email_to, import_date=False, loader=None, delta=None):
+    """
+    Split the spooled upload of an ImportRun in shards of whole stores and
+    import them in parallel with a chord, finish_supply_import running
+    once all the shards are imported.
+
+    The task is acknowledged once it returns, so it is delivered again if
+    its worker dies. A started import keeps its shards and only the ones
+    that are not done yet are imported again.
+    """
+    import_run = ImportRun.objects.get(id=import_run_id)
+    if import_run.status in (ImportRun.SUCCESS, ImportRun.SKIPPED):
+        return
+
+    import_run.status = ImportRun.RUNNING
+    import_run.task_id = self.request.id or ''
+    import_run.error = ''
+    import_run.end_date = None
+    # The supplies of the shards already done are older than a restart
+    if not import_run.start_date:
+        import_run.start_date = timezone.now()
+    import_run.save()
+
+    stats = ImportStats()
+    try:
+        if not import_run.shards.exists():
+            with stats.phase('read'):
+                split_import_in_shards(import_run)
+            stats.measure_peak_memory()
+            import_run.read_duration = stats.durations['read']
+            import_run.peak_memory = stats.peak_memory
+            import_run.save()
+    except Exception as exc:
+        mark_import_run_as_failed(import_run_id, exc)
+        raise
+
+    finish_task = finish_supply_import.s(
+        import_run_id,
+        email_to,
+        import_date,
+        delta,
+    )
+    pending_shard_ids = list(
+        import_run.shards.filter(
+            status=ImportShard.PENDING,
+        ).values_list('id', flat=True)
+    )
+    if not pending_shard_ids:
+        finish_task.delay([])
+        return
 
-                if provider_id not in updated_provider_ids:
-                    updated_provider_ids.append(provider_id)
+    # Read once for all the shards
+    medication_ndcs = get_medication_ndcs()
+    chord(
+        import_supply_shard.s(
+            shard_id,
+            import_date,
+            loader,
+            delta,
+            medication_ndcs,
+        )
+        for shard_id in pending_shard_ids
+    )(finish_task)
+
+
+def split_import_in_shards(import_run):
+    """
+    Spool every shard of the upload of an ImportRun on its own so any
+    worker can import it, and create their checkpoints.
+    """
+    shards = []
+    with open_spooled_file(import_run.get_upload()) as csv_file:
+        for shard_number, shard_data in enumerate(
+            iter_store_shards(csv_file)
+        ):
+            spooled_file = spool_content(
+                'shard_{}.csv'.format(shard_number),
+                shard_data,
+            )
+            shards.append(ImportShard(
+                file_checksum=spooled_file['checksum'],
+                file_size=spooled_file['size'],
+                import_run=import_run,
+                number=shard_number,
+                spool_name=spooled_file['name'],
+            ))
+    ImportShard.objects.bulk_create(shards)
+    return shards
+
+
+@shared_task(
+    bind=True,
+    acks_late=True,
+    default_retry_delay=60,
+    max_retries=settings.SUPPLY_IMPORT_SHARD_MAX_RETRIES,
+)
+def import_supply_shard(self, shard_id, import_date=False, loader=None, delta=None, medication_ndcs=None):
+    """
+    Import one spooled shard of an uploaded CSV file. The shard is loaded
+    and marked as done in a single transaction, so a failed shard can be
+    retried on its own and a done shard is never loaded twice.
+    """
+    shard = ImportShard.objects.select_related('import_run').get(id=shard_id)
+    if shard.status == ImportShard.DONE:
+        return shard.get_result()
+
+    stats = ImportStats()
+    try:
+        with open_spooled_file(shard.get_spooled_file()) as shard_file, \
+                transaction.atomic():
+            # Locked so a task delivered twice waits for the first one
+            shard = ImportShard.objects.select_for_update().get(id=shard_id)
+            if shard.status == ImportShard.DONE:
+                return shard.get_result()
+
+            index, updated_provider_ids = load_supplies(
+                shard_file,
+                shard.import_run.organization_id,
+                import_date,
+                loader,
+                stats,
+                delta,
+                medication_ndcs,
+            )
+            shard.status = ImportShard.DONE
+            shard.row_count = index
+            shard.provider_ids = sorted(updated_provider_ids)
+            shard.stats = stats.as_dict()
+            shard.completion_date = timezone.now()
+            shard.save()
+    except Exception as exc:
+        if self.request.retries >= self.max_retries:
+            mark_import_run_as_failed(shard.import_run_id, exc)
+        raise self.retry(exc=exc)
+
+    return shard.get_result()
+
+
+@shared_task(acks_late=True)
+def finish_supply_import(shard_results, import_run_id, email_to, import_date=False, delta=None):
+    """
+    Reduce the results of the shards of an import, run the steps done once
+    per import and delete the spooled files.
+
+    The results are read from the shard checkpoints rather than from the
+    chord, which only contains the shards imported since the last restart.
+    """
+    import_run = ImportRun.objects.get(id=import_run_id)
+    if import_run.status == ImportRun.SUCCESS:
+        return
 
-            currently_processing_store_number = store_number
-            current_store_medications_data = [current_medication_data]
-            current_store_data = {
-                'address': row.get('address'),
-                'city': row.get('city'),
-                'phone': row.get('phone'),
-                'state': row.get('state'),
-                'store_number': store_number,
-                'zip': row.get('zipcode'),
-            }
+    shards = list(import_run.shards.all())
+    stats = ImportStats()
+    stats.durations['read'] = import_run.read_duration
+    stats.peak_memory = import_run.peak_memory or 0
 
-    batch_create_provider_medication_ndc_throughs(
-        provider_medication_ndc_throughs_to_batch_insert)
+    index = 0
+    updated_provider_ids = set()
+    for shard in shards:
+        shard_result = shard.get_result()
+        index += shard_result['index']
+        updated_provider_ids.update(shard_result['provider_ids'])
+        stats.merge(ImportStats.from_dict(shard_result['stats']))
 
-    # Mark previous ProviderMedicationNdcThrough as past
-    mark_previous_entries_as_past(beginning_time, updated_provider_ids)
+    try:
+        finish_supplies_import(
+            import_run.start_date,
+            updated_provider_ids,
+            stats,
+            import_date,
+            delta,
+        )
+    except Exception as exc:
+        mark_import_run_as_failed(import_run_id, exc)
+        raise
+    stats.measure_peak_memory()
+
+    delete_spooled_files(
+        [import_run.get_upload()] +
+        [shard.get_spooled_file() for shard in shards]
+    )
 
-    # Finally update the last_import_date in all the updated_providers
-    mark_provider_has_active(updated_provider_ids)
+    import_run.end_date = timezone.now()
+    import_run.status = ImportRun.SUCCESS
+    import_run.shard_count = len(shards)
+    import_run.record_stats(stats)
+    import_run.save()
 
-    # Make celery delete the csv file in cache
-    if temporary_file_obj:
-        cache.delete(cache_key)
+    if settings.RESPONSE_CACHE_WARM_UP:
+        warm_response_cache.delay()
 
     # Send mail not found ndcs
     if email_to:
-        notify_by_email(email_to, beginning_time, index)
+        notify_import_by_email(
+            email_to,
+            import_run.start_date,
+            index,
+            len(updated_provider_ids),
+            len(shards),
+        )
+
+
+@shared_task
+def geocode_providers(provider_ids):
+    """
+    Geocode the providers created by a supply import, Provider.save
+    computes the coordinates of the providers flagged with
+    change_coordinates.
+    """
+    for provider in Provider.objects.filter(
+        id__in=provider_ids,
+        change_coordinates=True,
+    ):
+        provider.save()
 
 
 # Task that handles the post_save signal asynchronously
@@ -316,6 +744,53 @@ def handle_provider_medication_through_post_save_signal(
     ).update(
         latest=False,
     )
+    CurrentProviderSupply.objects.refresh(
+        provider_ids=[provider_pk],
+        medication_ndc_ids=[medication_ndc_pk],
+    )
+    increment_supply_data_version()
+
+
+@shared_task
+def warm_response_cache(state_ids=None):
+    """
+    Cache the most requested map and filters responses of the current
+    supply data version, run after every import.
+    """
+    return warm_up_response_cache(state_ids)
+
+
+@shared_task
+def archive_supply_history(retention_days=None):
+    """
+    Roll up, archive and remove the supply history entries older than
+    SUPPLY_HISTORY_RETENTION_DAYS days, scheduled daily.
+    """
+    return [
+        archive.id
+        for archive in archive_old_supply_history(retention_days)
+    ]
+
+
+@shared_task
+def clean_up_supply_import_spool(days=None):
+    """
+    Delete the spooled files left by failed or interrupted imports after
+    SUPPLY_IMPORT_SPOOL_MAX_AGE_DAYS days, scheduled daily. The files of
+    the queued and running imports are kept.
+    """
+    import_runs = ImportRun.objects.filter(
+        status__in=(ImportRun.QUEUED, ImportRun.RUNNING),
+    )
+    kept_names = set(
+        import_runs.exclude(spool_name='').values_list('spool_name', flat=True)
+    )
+    kept_names.update(
+        ImportShard.objects.filter(
+            import_run__in=import_runs,
+        ).values_list('spool_name', flat=True)
+    )
+    return clean_up_spool(days, kept_names)
 
 
 @shared_task
@@ -354,11 +829,27 @@ def import_existing_medications():
 @shared_task
 def mark_inactive_providers():
     filter_date = timezone.now() - timedelta(days=15)
-    Provider.objects.filter(
+    providers = Provider.objects.filter(
         last_import_date__lte=filter_date,
-    ).update(
+        active=True,
+    )
+    provider_ids = list(providers.values_list('id', flat=True))
+    if not provider_ids:
+        return
+    providers.update(
         active=False,
     )
+    # The daily aggregates of the maps are split by the active flag
+    first_date = DailySupplyAggregate.objects.aggregate(
+        first_date=Min('date'),
+    )['first_date']
+    if first_date:
+        DailySupplyAggregate.objects.refresh(
+            first_date,
+            timezone.now().date(),
+            provider_ids=provider_ids,
+        )
+    rebuild_provider_index()
 
 
 @shared_task
@@ -375,49 +866,62 @@ def generate_csv_export(filename, file_url, user_id, med_id, dosages, start_date
     print(med_ndc_ids)
     print(list(med_ndc_ids))
 
-    # First we take list of provider medication for this med, we will
+    # First we take list of providers for this export, we will
     # use it for future filters
     if zipcode:
-        provider_medication_qs = ProviderMedicationNdcThrough.objects.filter(  # noqa
-            provider__related_zipcode__zipcode=zipcode,
+        provider_qs = Provider.objects.filter(
+            related_zipcode__zipcode=zipcode,
         )
     elif not zipcode and state_id:
-        provider_medication_qs = ProviderMedicationNdcThrough.objects.filter(  # noqa
-            provider__related_zipcode__state=state_id,
+        provider_qs = Provider.objects.filter(
+            related_zipcode__state=state_id,
         )
     else:
-        provider_medication_qs = ProviderMedicationNdcThrough.objects.all()
+        provider_qs = Provider.objects.all()
 
-    provider_medication_qs = provider_medication_qs.filter(
-        medication_ndc_id__in=med_ndc_ids,
-        provider__active=True,
+    provider_qs = provider_qs.filter(
+        active=True,
     )
 
     if provider_type_list:
-        provider_medication_qs = provider_medication_qs.filter(
-            provider__type__in=provider_type_list,
+        provider_qs = provider_qs.filter(
+            type__in=provider_type_list,
         )
 
     if provider_category_list:
-        provider_medication_qs = provider_medication_qs.filter(
-            provider__category__in=provider_category_list,
+        provider_qs = provider_qs.filter(
+            category__in=provider_category_list,
         )
 
     tz = get_current_timezone()
     end_date = tz.localize(datetime.strptime(end_date, "%Y-%m-%d"))
     start_date = tz.localize(datetime.strptime(start_date, "%Y-%m-%d"))
 
-    qs = provider_medication_qs.filter(
-        date__gte=start_date,
-        date__lte=end_date + timedelta(days=1),
-    ).prefetch_related(
+    # Every entry is exported once for every day it is valid, as delta
+    # imports do not write the supplies unchanged since a previous day
+    daily_entry_ids = ProviderMedicationNdcThrough.objects.daily_entry_ids(
+        med_ndc_ids,
+        provider_qs.values_list('id', flat=True),
+        start_date.date(),
+        (end_date + timedelta(days=1)).date(),
+    )
+    entries = ProviderMedicationNdcThrough.objects.prefetch_related(
         'provider',
         'provider__organization',
         'provider__type',
         'provider__category',
         'medication_ndc__medication',
         'medication_ndc__medication__medication_name',
-    ).order_by('date')
+    ).in_bulk({entry_id for day, entry_id in daily_entry_ids})
+    # The entries older than the retention horizon are read from the
+    # supply history archives
+    missing_entry_ids = {
+        entry_id
+        for day, entry_id in daily_entry_ids
+        if entry_id not in entries
+    }
+    if missing_entry_ids:
+        entries.update(get_archived_entries(missing_entry_ids))
 
     national_level_permission = \
         user.permission_level == User.NATIONAL_LEVEL
@@ -474,10 +978,11 @@ def generate_csv_export(filename, file_url, user_id, med_id, dosages, start_date
     buff = io.StringIO()
     writer = csv.DictWriter(buff, fieldnames=header)
     writer.writeheader()
-    for instance in qs:
+    for day, entry_id in daily_entry_ids:
+        instance = entries[entry_id]
         if national_level_permission:
             data_row = (
-                instance.creation_date.date().isoformat(),
+                day.isoformat(),
                 instance.provider.organization,
                 instance.provider.store_number,
                 instance.provider.name,
@@ -498,7 +1003,7 @@ def generate_csv_export(filename, file_url, user_id, med_id, dosages, start_date
             )
         else:
             data_row = (
-                instance.creation_date.date().isoformat(),
+                day.isoformat(),
 
                 instance.provider.city,
                 instance.provider.state,
@@ -0,0 +1,155 @@
+"""
+CPU and memory benchmark of the columnar SupplyBatch representation of
+an import against the former one object per row representation.
+
+These benchmarks are not collected with the rest of the test suite, run
+them explicitly with:
+
+    py.test medications/tests/bench_batches.py -s
+"""
+import csv
+import io
+import time
+import tracemalloc
+
+from datetime import datetime
+
+from medications.loaders import CopyLoader, SupplyBatch, SupplyRow
+
+NUMBER_OF_STORES = 25000
+NUMBER_OF_MEDICATIONS = 40
+# Every store reports one medication less, filled with a NO REPORT row
+REPORTED_MEDICATIONS = NUMBER_OF_MEDICATIONS - 1
+SUPPLY_LEVELS = [
+    ('NO SUPPLY', 0),
+    ('<24', 1),
+    ('24', 2),
+    ('24-48', 3),
+    ('>48', 4),
+]
+
+
+def iter_store_rows():
+    for provider_id in range(1, NUMBER_OF_STORES + 1):
+        yield provider_id, [
+            {
+                'med_code': medication_id,
+                'supply_level': SUPPLY_LEVELS[
+                    (provider_id + medication_id) % len(SUPPLY_LEVELS)
+                ][0],
+            }
+            for medication_id in range(1, REPORTED_MEDICATIONS + 1)
+        ]
+
+
+supply_to_level_map = dict(SUPPLY_LEVELS, **{'NO REPORT': -1})
+medication_ids = list(range(1, NUMBER_OF_MEDICATIONS + 1))
+
+
+def build_legacy_rows():
+    """Former representation: dicts, list.remove and a tuple per row."""
+    rows = []
+    for provider_id, store_rows in iter_store_rows():
+        medication_data = [
+            {
+                'level': supply_to_level_map.get(row['supply_level'], 0),
+                'ndc_code': row['med_code'],
+                'supply': row['supply_level'],
+            }
+            for row in store_rows
+        ]
+        missing_medication_ids = list(set(medication_ids))
+        for data in medication_data:
+            if data['ndc_code'] in missing_medication_ids:
+                missing_medication_ids.remove(data['ndc_code'])
+        for medication_id in missing_medication_ids:
+            medication_data.append({
+                'level': -1,
+                'ndc_code': medication_id,
+                'supply': 'NO REPORT',
+            })
+        for data in medication_data:
+            now = datetime.now()
+            rows.append(SupplyRow(
+                provider_id=provider_id,
+                medication_ndc_id=data['ndc_code'],
+                level=data['level'],
+                date=now.date(),
+                creation_date=now,
+                latest=True,
+            ))
+    return rows
+
+
+def build_batch():
+    now = datetime.now()
+    batch = SupplyBatch(date=now.date(), creation_date=now, latest=True)
+    all_medication_ids = set(medication_ids)
+    for provider_id, store_rows in iter_store_rows():
+        reported_medication_ids = set()
+        for row in store_rows:
+            supply_level = row['supply_level']
+            batch.append(
+                provider_id,
+                row['med_code'],
+                supply_to_level_map.get(supply_level, 0),
+            )
+            reported_medication_ids.add(row['med_code'])
+        for medication_id in sorted(
+            all_medication_ids - reported_medication_ids
+        ):
+            batch.append(provider_id, medication_id, -1)
+    return batch
+
+
+def format_legacy_rows(rows):
+    buff = io.StringIO()
+    writer = csv.writer(buff)
+    for row in rows:
+        writer.writerow([CopyLoader.format_value(value) for value in row])
+    return buff
+
+
+def format_batch(batch):
+    # format_batch does not touch the database connection
+    loader = CopyLoader.__new__(CopyLoader)
+    return loader.format_batch(batch)
+
+
+def measure(build_function, format_function):
+    tracemalloc.start()
+    beginning_time = time.perf_counter()
+    rows = build_function()
+    build_duration = time.perf_counter() - beginning_time
+    retained_memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    beginning_time = time.perf_counter()
+    buff = format_function(rows)
+    format_duration = time.perf_counter() - beginning_time
+    print(
+        '{}: {} rows, build {:.2f}s, COPY format {:.2f}s, '
+        'retained {:.1f} MB'.format(
+            build_function.__name__,
+            len(rows),
+            build_duration,
+            format_duration,
+            retained_memory / 1024 / 1024,
+        )
+    )
+    return rows, buff, build_duration + format_duration, retained_memory
+
+
+def test_batch_is_smaller_and_faster_than_rows():
+    legacy_rows, legacy_buff, legacy_duration, legacy_memory = measure(
+        build_legacy_rows,
+        format_legacy_rows,
+    )
+    batch, batch_buff, batch_duration, batch_memory = measure(
+        build_batch,
+        format_batch,
+    )
+
+    assert len(batch) == len(legacy_rows)
+    assert batch_memory * 5 < legacy_memory
+    assert batch_duration * 2 < legacy_duration
@@ -0,0 +1,99 @@
+"""
+Memory and throughput benchmark of the supply CSV ingestion.
+
+These benchmarks are not collected with the rest of the test suite, run
+them explicitly with:
+
+    py.test medications/tests/bench_import.py -s
+"""
+import csv
+import io
+import tempfile
+import time
+import tracemalloc
+
+from random import choice, randint
+
+from medications.constants import field_rows
+from medications.importers import iter_store_groups
+
+MEDICATIONS_PER_STORE = 20
+SUPPLY_LEVELS = ['NO SUPPLY', '<24', '24', '24-48', '>48']
+SMALL_FILE_ROWS = 50000
+LARGE_FILE_ROWS = 400000
+SORT_CHUNK_SIZE = 10000
+
+
+def write_synthetic_csv(number_of_rows):
+    csv_file = tempfile.TemporaryFile()
+    text_file = io.TextIOWrapper(csv_file, encoding='utf-8', newline='')
+    writer = csv.writer(text_file)
+    writer.writerow(field_rows)
+    number_of_stores = number_of_rows // MEDICATIONS_PER_STORE
+    for index in range(number_of_rows):
+        # Rows of the same store are spread all over the file
+        store_number = index % number_of_stores
+        writer.writerow([
+            store_number,
+            '{} Main St'.format(store_number),
+            'Springfield',
+            '{:05}'.format(randint(1, 99999)),
+            'MA',
+            '555-555-5555',
+            '0002-1433-{:02}'.format(index // number_of_stores),
+            'medication',
+            choice(SUPPLY_LEVELS),
+        ])
+    text_file.flush()
+    text_file.detach()
+    csv_file.seek(0)
+    return csv_file
+
+
+def legacy_store_groups(file_obj):
+    decoded_file = file_obj.read().decode('utf-8').splitlines()
+    reader = csv.DictReader(decoded_file)
+    sorted_csv = sorted(reader, key=lambda d: float(d['store #']))
+    groups = {}
+    for row in sorted_csv:
+        groups.setdefault(row['store #'], []).append(row)
+    return groups.items()
+
+
+def measure(group_function, number_of_rows):
+    csv_file = write_synthetic_csv(number_of_rows)
+    tracemalloc.start()
+    beginning_time = time.perf_counter()
+    number_of_groups = 0
+    for store_data, store_rows in group_function(csv_file):
+        number_of_groups += 1
+    duration = time.perf_counter() - beginning_time
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    csv_file.close()
+    print(
+        '{}: {} rows, {} stores, {:.0f} rows/s, peak {:.1f} MB'.format(
+            group_function.__name__,
+            number_of_rows,
+            number_of_groups,
+            number_of_rows / duration,
+            peak_memory / 1024 / 1024,
+        )
+    )
+    return peak_memory
+
+
+def streaming_store_groups(file_obj):
+    return iter_store_groups(file_obj, chunk_size=SORT_CHUNK_SIZE)
+
+
+def test_streaming_peak_memory_does_not_depend_on_file_size():
+    small_peak = measure(streaming_store_groups, SMALL_FILE_ROWS)
+    large_peak = measure(streaming_store_groups, LARGE_FILE_ROWS)
+    assert large_peak < small_peak * 1.5
+
+
+def test_streaming_uses_less_memory_than_legacy_ingestion():
+    legacy_peak = measure(legacy_store_groups, LARGE_FILE_ROWS)
+    streaming_peak = measure(streaming_store_groups, LARGE_FILE_ROWS)
+    assert streaming_peak * 4 < legacy_peak
@@ -0,0 +1,91 @@
+"""
+Throughput benchmark of the ProviderMedicationNdcThrough loaders on a
+synthetic 1M rows import.
+
+These benchmarks are not collected with the rest of the test suite, run
+them explicitly with:
+
+    py.test medications/tests/bench_loaders.py -s
+"""
+import time
+
+import pytest
+
+from django.utils import timezone
+
+from medications.loaders import LOADERS, SupplyRow, get_loader
+from medications.models import (
+    Medication,
+    MedicationNdc,
+    Organization,
+    Provider,
+    ProviderMedicationNdcThrough,
+)
+
+pytestmark = pytest.mark.django_db(transaction=True)
+NUMBER_OF_ROWS = 1000000
+NUMBER_OF_MEDICATIONS = 20
+LEVELS = [0, 1, 2, 3, 4]
+
+
+@pytest.fixture()
+def provider_ids():
+    organization = Organization.objects.create(
+        organization_name='benchmark organization',
+    )
+    # bulk_create skips the geocoding done in Provider.save
+    Provider.objects.bulk_create([
+        Provider(
+            organization=organization,
+            store_number=store_number,
+            name='store {}'.format(store_number),
+        )
+        for store_number in range(NUMBER_OF_ROWS // NUMBER_OF_MEDICATIONS)
+    ], batch_size=5000)
+    return list(Provider.objects.values_list('id', flat=True))
+
+
+@pytest.fixture()
+def medication_ndc_ids():
+    ndc_ids = []
+    for index in range(NUMBER_OF_MEDICATIONS):
+        medication = Medication.objects.create(
+            name='medication {}'.format(index),
+        )
+        ndc_ids.append(MedicationNdc.objects.create(
+            medication=medication,
+            ndc='0002-1433-{:02}'.format(index),
+        ).id)
+    return ndc_ids
+
+
+def iter_synthetic_rows(provider_ids, medication_ndc_ids):
+    now = timezone.now()
+    for provider_id in provider_ids:
+        for index, medication_ndc_id in enumerate(medication_ndc_ids):
+            yield SupplyRow(
+                provider_id=provider_id,
+                medication_ndc_id=medication_ndc_id,
+                level=LEVELS[(provider_id + index) % len(LEVELS)],
+                date=now.date(),
+                creation_date=now,
+                latest=True,
+            )
+
+
+@pytest.mark.parametrize('loader_name', sorted(LOADERS))
+def test_loader_throughput(loader_name, provider_ids, medication_ndc_ids):
+    loader = get_loader(loader_name)
+    beginning_time = time.perf_counter()
+    count = loader.load(iter_synthetic_rows(provider_ids, medication_ndc_ids))
+    duration = time.perf_counter() - beginning_time
+    print(
+        '{}: {} rows in {:.1f}s, {:.0f} rows/s'.format(
+            loader_name,
+            count,
+            duration,
+            count / duration,
+        )
+    )
+    assert count == NUMBER_OF_ROWS
+    assert ProviderMedicationNdcThrough.objects.count() == NUMBER_OF_ROWS
@@ -1,13 +1,16 @@
 import os
 import pytest
 import csv
+import gzip
 import json
 
 from random import randint, randrange
 
 from django.contrib.auth import get_user_model
 from django.conf import settings
+from django.core.cache import cache
 from django.contrib.gis.geos import GEOSGeometry
+from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
 
 from celery.task.control import inspect
@@ -18,7 +21,8 @@ from rest_framework_jwt.serializers import (
 )
 
 from auth_ex.utils import jwt_payload_handler
-from medications.models import Organization, MedicationName, State
+from medications.models import ImportRun, Organization, MedicationName, State
+from medications.cache_warmup import warm_response_cache
 from medications.constants import field_rows
 from medications.factories import (
     OrganizationFactory,
@@ -31,11 +35,29 @@ from medications.factories import (
     CountyFactory,
     MedicationNameFactory,
 )
+from medications.renderers import PreEncodedJSONRenderer, RawJSON
+from medications.response_cache import get_response_cache_stats
+from medications.versions import (
+    get_supply_data_version,
+    increment_supply_data_version,
+)
+from public.views import encode_cursor
 
 pytestmark = pytest.mark.django_db()
 User = get_user_model()
 
 
+@pytest.fixture(autouse=True)
+def locmem_cache(settings):
+    # The responses are cached, every test starts with an empty cache
+    settings.CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+    }
+    cache.clear()
+
+
 @pytest.fixture()
 def organization():
     return Organization.objects.create(
@@ -764,3 +786,332 @@ class TestGeoStatsZipCodeGETView:
             path, HTTP_AUTHORIZATION=auth
         )
         assert response.status_code == status.HTTP_200_OK
+
+
+class TestImportRuns:
+    """ Test the import runs list """
+    path = '/api/v1/medications/import_runs/'
+    header_prefix = 'Token '
+
+    @pytest.fixture(autouse=True)
+    def setup_stuff(self, db, testuser):
+        self.factory = APIClient()
+        self.user = testuser
+        path = '/api/v1/accounts/obtain_token/'
+        response = self.factory.post(
+            path,
+            {
+                'email': testuser.email,
+                'password': 'password',
+            }
+        )
+        self.token = response.json().get('token')
+
+    def test_get_import_runs_without_token_unsuccess(self):
+        response = self.factory.get(self.path)
+        assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+    def test_get_import_runs_of_user_organization(self, organization):
+        import_run = ImportRun.objects.create(
+            organization=organization,
+            status=ImportRun.SUCCESS,
+            row_count=2,
+            unchanged_row_count=3,
+        )
+        ImportRun.objects.create(
+            organization=organization,
+            status=ImportRun.FAILED,
+        )
+        ImportRun.objects.create(
+            organization=OrganizationFactory(organization_name='other'),
+            status=ImportRun.SUCCESS,
+        )
+        auth = self.header_prefix + self.token
+        response = self.factory.get(
+            self.path + '?status=success', HTTP_AUTHORIZATION=auth
+        )
+        assert response.status_code == status.HTTP_200_OK
+        assert [
+            result['id'] for result in response.json()['results']
+        ] == [import_run.id]
+        result = response.json()['results'][0]
+        assert result['row_count'] == 2
+        assert result['unchanged_row_count'] == 3
+
+    def test_get_import_runs_by_date(self, organization):
+        import_run = ImportRun.objects.create(
+            organization=organization,
+            status=ImportRun.SUCCESS,
+        )
+        today = import_run.creation_date.astimezone(
+            timezone.get_current_timezone(),
+        ).date()
+        auth = self.header_prefix + self.token
+        response = self.factory.get(
+            self.path + '?start_date={0}&end_date={0}'.format(today),
+            HTTP_AUTHORIZATION=auth,
+        )
+        assert response.status_code == status.HTTP_200_OK
+        assert [
+            result['id'] for result in response.json()['results']
+        ] == [import_run.id]
+
+        response = self.factory.get(
+            self.path + '?start_date=2019-13-45', HTTP_AUTHORIZATION=auth
+        )
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+class TestSupplyTileGETView:
+    path = '/api/v1/medications/tiles/{}/{}/{}/{}.mvt?med_id={}'
+    header_prefix = 'Token '
+
+    @pytest.fixture(autouse=True)
+    def setup_stuff(self, db, testuser):
+        self.factory = APIClient()
+        self.user = testuser
+        path = '/api/v1/accounts/obtain_token/'
+        response = self.factory.post(
+            path,
+            {
+                'email': testuser.email,
+                'password': 'password',
+            }
+        )
+        self.token = response.json().get('token')
+
+    def test_get_tile_with_token_success(self, geographic_object):
+        medication_name = MedicationNameFactory()
+        StateFactory(geometry=geographic_object, state_name='Tiled state')
+        auth = self.header_prefix + self.token
+        response = self.factory.get(
+            self.path.format('state', 0, 0, 0, medication_name.id),
+            HTTP_AUTHORIZATION=auth,
+        )
+        assert response.status_code == status.HTTP_200_OK
+        assert response['Content-Type'] == 'application/vnd.mapbox-vector-tile'
+        assert b'Tiled state' in response.content
+
+    def test_get_tile_without_token_unsuccess(self):
+        medication_name = MedicationNameFactory()
+        response = self.factory.get(
+            self.path.format('state', 0, 0, 0, medication_name.id),
+        )
+        assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+    def test_404_if_wrong_layer_or_tile(self):
+        medication_name = MedicationNameFactory()
+        auth = self.header_prefix + self.token
+        for layer, z, x, y in (('city', 0, 0, 0), ('state', 1, 2, 0)):
+            response = self.factory.get(
+                self.path.format(layer, z, x, y, medication_name.id),
+                HTTP_AUTHORIZATION=auth,
+            )
+            assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+class TestResponseCache:
+    path = '/api/v1/medications/geo_stats/'
+    header_prefix = 'Token '
+
+    @pytest.fixture(autouse=True)
+    def setup_stuff(self, db, testuser):
+        self.factory = APIClient()
+        self.user = testuser
+        path = '/api/v1/accounts/obtain_token/'
+        response = self.factory.post(
+            path,
+            {
+                'email': testuser.email,
+                'password': 'password',
+            }
+        )
+        self.token = response.json().get('token')
+
+    def get_state_names(self, query_string):
+        response = self.factory.get(
+            self.path + query_string,
+            HTTP_AUTHORIZATION=self.header_prefix + self.token,
+        )
+        assert response.status_code == status.HTTP_200_OK
+        return [
+            feature['properties']['name']
+            for feature in response.json().get('features')
+        ]
+
+    def test_response_is_cached_until_data_version_changes(
+        self,
+        geographic_object,
+    ):
+        medication_name = MedicationNameFactory()
+        state = StateFactory(geometry=geographic_object)
+        query_string = '?med_id={}'.format(medication_name.id)
+        names = self.get_state_names(query_string)
+
+        # Updates do not send the save signals
+        State.objects.filter(id=state.id).update(state_name='Renamed state')
+        assert self.get_state_names(query_string) == names
+        assert get_response_cache_stats('geo_stats_states') == {
+            'hits': 1,
+            'misses': 1,
+            'hit_rate': 0.5,
+        }
+
+        increment_supply_data_version()
+        assert 'Renamed state' in self.get_state_names(query_string)
+
+    def test_list_params_order_does_not_matter(self, geographic_object):
+        medication_name = MedicationNameFactory()
+        StateFactory(geometry=geographic_object)
+        self.get_state_names(
+            '?med_id={}&dosages[]=1&dosages[]=2'.format(medication_name.id),
+        )
+        self.get_state_names(
+            '?dosages[]=2&dosages[]=1&med_id={}'.format(medication_name.id),
+        )
+        assert get_response_cache_stats('geo_stats_states')['hits'] == 1
+
+    @pytest.mark.parametrize('path, name', (
+        ('/api/v1/medications/filters/', 'filters'),
+        ('/api/v1/historic/average/', 'historic_average'),
+        ('/api/v1/historic/overall/', 'historic_overall'),
+    ))
+    def test_filters_and_historic_responses_are_cached(self, path, name):
+        medication_name = MedicationNameFactory()
+        query_string = (
+            '?med_id={}&start_date=2019-01-01&end_date=2019-01-31'.format(
+                medication_name.id,
+            )
+        )
+        contents = []
+        for attempt in range(2):
+            response = self.factory.get(
+                path + query_string,
+                HTTP_AUTHORIZATION=self.header_prefix + self.token,
+            )
+            assert response.status_code == status.HTTP_200_OK
+            contents.append(response.content)
+
+        assert contents[0] == contents[1]
+        assert get_response_cache_stats(name) == {
+            'hits': 1,
+            'misses': 1,
+            'hit_rate': 0.5,
+        }
+
+    def test_reference_data_save_changes_data_version(self):
+        version = get_supply_data_version()
+        medication_name = MedicationNameFactory()
+        assert get_supply_data_version() > version
+
+        version = get_supply_data_version()
+        medication_name.delete()
+        assert get_supply_data_version() > version
+
+    def test_provider_save_changes_data_version(self):
+        provider = ProviderFactory(active=True)
+        version = get_supply_data_version()
+        provider.active = False
+        provider.save()
+        assert get_supply_data_version() > version
+
+        version = get_supply_data_version()
+        provider.delete()
+        assert get_supply_data_version() > version
+
+    def test_warm_up_caches_default_filters(self, geographic_object):
+        medication_name = MedicationNameFactory()
+        StateFactory(geometry=geographic_object)
+
+        # The national and state maps and filters of the medication
+        assert warm_response_cache() == 4
+        self.get_state_names('?med_id={}'.format(medication_name.id))
+        assert get_response_cache_stats('geo_stats_states') == {
+            'hits': 1,
+            'misses': 1,
+            'hit_rate': 0.5,
+        }
+
+
+class TestFindProviderPages:
+    path = '/api/v1/public/find_providers/'
+
+    @pytest.fixture(autouse=True)
+    def setup_stuff(self, db):
+        self.factory = APIClient()
+
+    def test_corrupted_cursor_is_a_bad_request(self):
+        query_string = (
+            '?localization=-100,40&distance=10&med_ids[]=all&limit=2&cursor={}'
+        )
+        for cursor in (
+            'not-a-cursor',
+            encode_cursor('nearest', ['far', 1]),
+            encode_cursor('nearest', [1.5]),
+            encode_cursor('unknown', [1.5, 1]),
+        ):
+            response = self.factory.get(
+                self.path + query_string.format(cursor),
+            )
+            assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+class TestCompressedResponses:
+    path = '/api/v1/medications/geo_stats/'
+    header_prefix = 'Token '
+
+    @pytest.fixture(autouse=True)
+    def setup_stuff(self, db, testuser):
+        self.factory = APIClient()
+        self.user = testuser
+        path = '/api/v1/accounts/obtain_token/'
+        response = self.factory.post(
+            path,
+            {
+                'email': testuser.email,
+                'password': 'password',
+            }
+        )
+        self.token = response.json().get('token')
+
+    def test_pre_encoded_fragments_are_spliced(self):
+        content = PreEncodedJSONRenderer().render({
+            'geometry': RawJSON(b'{"type":"Point","coordinates":[1,2]}'),
+            'features': [RawJSON('[]'), 'raw-json'],
+        })
+        assert json.loads(content.decode()) == {
+            'geometry': {'type': 'Point', 'coordinates': [1, 2]},
+            'features': [[], 'raw-json'],
+        }
+
+    def test_response_is_gzipped_for_accepting_requests(
+        self,
+        geographic_object,
+    ):
+        medication_name = MedicationNameFactory()
+        StateFactory(geometry=geographic_object)
+        path = self.path + '?med_id={}'.format(medication_name.id)
+        auth = self.header_prefix + self.token
+        response = self.factory.get(path, HTTP_AUTHORIZATION=auth)
+        assert 'Content-Encoding' not in response
+        assert 'Accept-Encoding' in response['Vary']
+
+        # Compressed when computed and when read from the cache
+        for attempt in range(2):
+            compressed_response = self.factory.get(
+                path,
+                HTTP_AUTHORIZATION=auth,
+                HTTP_ACCEPT_ENCODING='gzip, deflate',
+            )
+            assert compressed_response['Content-Encoding'] == 'gzip'
+            assert json.loads(
+                gzip.decompress(compressed_response.content).decode(),
+            ) == response.json()
+
+        # Not compressed if refused
+        response = self.factory.get(
+            path,
+            HTTP_AUTHORIZATION=auth,
+            HTTP_ACCEPT_ENCODING='gzip;q=0',
+        )
+        assert 'Content-Encoding' not in response
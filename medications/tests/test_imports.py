@@ -0,0 +1,435 @@
+import csv
+import hashlib
+import io
+import os
+import time
+
+import pytest
+import factory
+
+from datetime import timedelta
+
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.utils import timezone
+
+from medications.factories import (
+    CountyFactory,
+    MedicationFactory,
+    MedicationNDCFactory,
+    OrganizationFactory,
+    ProviderFactory,
+    StateFactory,
+    ZipCodeFactory,
+)
+from medications.constants import SupplyLevel, field_rows
+from medications.importers import iter_store_shards
+from medications.spool import (
+    delete_spooled_files,
+    open_spooled_file,
+    spool_upload,
+)
+from medications.loaders import LOADERS, SupplyBatch, SupplyRow, get_loader
+from medications.models import (
+    CurrentProviderSupply,
+    ImportRun,
+    ImportShard,
+    Provider,
+    ProviderMedicationNdcThrough,
+)
+from medications.tasks import (
+    build_zipcode_index,
+    clean_up_supply_import_spool,
+    create_missing_providers,
+    import_supplies,
+    import_supply_shard,
+    split_import_in_shards,
+)
+
+pytestmark = pytest.mark.django_db()
+TEST_NDC = '0002-1433-80'
+
+
+@pytest.fixture()
+def medication_ndc():
+    return MedicationNDCFactory(
+        ndc=TEST_NDC,
+        medication=MedicationFactory(name=factory.Faker('word')),
+    )
+
+
+@pytest.fixture()
+def provider():
+    return ProviderFactory(
+        name=factory.Faker('word'),
+    )
+
+
+def build_csv_file(store_numbers, supply_level='<24'):
+    buff = io.StringIO(newline='')
+    writer = csv.writer(buff)
+    writer.writerow(field_rows)
+    for store_number in store_numbers:
+        writer.writerow([
+            store_number, 'address', 'city', '10001', 'NY', '555-0100',
+            TEST_NDC, 'medication', supply_level,
+        ])
+    return io.BytesIO(buff.getvalue().encode('utf-8'))
+
+
+class TestStoreShards:
+    """ Test the split of the CSV files in shards of whole stores """
+
+    def read_store_numbers(self, shard_data):
+        return [
+            row['store #']
+            for row in csv.DictReader(io.StringIO(shard_data.decode('utf-8')))
+        ]
+
+    def test_stores_are_not_split(self):
+        csv_file = build_csv_file(['3', '1', '2', '1', '3', '2', '3'])
+        shards = [
+            self.read_store_numbers(shard_data)
+            for shard_data in iter_store_shards(
+                csv_file,
+                stores_per_shard=2,
+                chunk_size=2,
+            )
+        ]
+
+        assert shards == [['1', '1', '2', '2'], ['3', '3', '3']]
+
+    def test_empty_file(self):
+        assert list(iter_store_shards(build_csv_file([]))) == []
+
+
+class TestLoaders:
+    """ Test the ProviderMedicationNdcThrough loader backends """
+
+    @pytest.mark.parametrize('loader_name', sorted(LOADERS))
+    def test_load_rows(self, loader_name, provider, medication_ndc):
+        now = timezone.now()
+        rows = [
+            SupplyRow(
+                provider_id=provider.id,
+                medication_ndc_id=medication_ndc.id,
+                level=level,
+                date=now.date(),
+                creation_date=now,
+                latest=True,
+            )
+            for level in (
+                SupplyLevel.LESS_THAN_24_HOURS,
+                SupplyLevel.NO_REPORT,
+            )
+        ]
+        count = get_loader(loader_name, chunk_size=1).load(iter(rows))
+
+        assert count == 2
+        assert [
+            (entry.supply, entry.level, entry.latest, entry.date)
+            for entry in ProviderMedicationNdcThrough.objects.order_by('level')
+        ] == [
+            ('NO REPORT', -1, True, now.date()),
+            ('<24', 1, True, now.date()),
+        ]
+
+    @pytest.mark.parametrize('loader_name', sorted(LOADERS))
+    def test_load_batches(self, loader_name, provider, medication_ndc):
+        now = timezone.now()
+        batches = []
+        for level in (
+            SupplyLevel.LESS_THAN_24_HOURS,
+            SupplyLevel.NO_REPORT,
+        ):
+            batch = SupplyBatch(date=now.date(), creation_date=now, latest=True)
+            batch.append(provider.id, medication_ndc.id, level)
+            batches.append(batch)
+        count = get_loader(loader_name).load_batches(batches)
+
+        assert count == 2
+        assert [
+            (
+                entry.supply,
+                entry.level,
+                entry.latest,
+                entry.date,
+                entry.creation_date,
+            )
+            for entry in ProviderMedicationNdcThrough.objects.order_by('level')
+        ] == [
+            ('NO REPORT', -1, True, now.date(), now),
+            ('<24', 1, True, now.date(), now),
+        ]
+
+    def test_unknown_loader(self):
+        with pytest.raises(ValueError):
+            get_loader('unknown')
+
+
+class TestCurrentProviderSupply:
+    """ Test the refresh of the current supplies snapshot """
+
+    def create_entry(self, provider, medication_ndc, supply, when):
+        return ProviderMedicationNdcThrough.objects.create(
+            provider=provider,
+            medication_ndc=medication_ndc,
+            supply=supply,
+            date=when.date(),
+            creation_date=when,
+            latest=True,
+        )
+
+    def test_refresh_keeps_newest_entry(self, provider, medication_ndc):
+        now = timezone.now()
+        self.create_entry(provider, medication_ndc, '<24', now)
+        CurrentProviderSupply.objects.refresh(provider_ids=[provider.id])
+        self.create_entry(
+            provider, medication_ndc, '>48', now + timedelta(hours=1),
+        )
+        CurrentProviderSupply.objects.refresh(provider_ids=[provider.id])
+
+        current_supply, = CurrentProviderSupply.objects.all()
+        assert (current_supply.supply, current_supply.level) == ('>48', 4)
+
+    def test_refresh_ignores_older_entry(self, provider, medication_ndc):
+        now = timezone.now()
+        self.create_entry(provider, medication_ndc, '>48', now)
+        CurrentProviderSupply.objects.refresh()
+        ProviderMedicationNdcThrough.objects.update(latest=False)
+        self.create_entry(
+            provider, medication_ndc, '<24', now - timedelta(hours=1),
+        )
+        CurrentProviderSupply.objects.refresh()
+
+        current_supply, = CurrentProviderSupply.objects.all()
+        assert (current_supply.supply, current_supply.level) == ('>48', 4)
+
+
+class TestCreateMissingProviders:
+    """ Test the bulk creation of the providers of an import """
+
+    def build_store_data(self, store_number, zipcode):
+        return {
+            'address': 'address',
+            'city': 'city',
+            'phone': '',
+            'state': 'NY',
+            'store_number': str(store_number),
+            'zip': zipcode,
+        }
+
+    def test_create_missing_providers(self, provider):
+        organization = OrganizationFactory()
+        state = StateFactory()
+        county = CountyFactory(state=state)
+        zipcode = ZipCodeFactory(zipcode='10001', state=state)
+        zipcode.counties.add(county)
+        ZipCodeFactory(zipcode='20001', state=state)
+        provider_map = {'1': provider.id}
+        # Only the zip codes of the new providers are read
+        assert list(build_zipcode_index({'10001'})) == ['10001']
+
+        created_provider_ids = create_missing_providers(
+            [
+                self.build_store_data(1, '10001'),
+                self.build_store_data(2, '10001'),
+                self.build_store_data(2, '10001'),
+                self.build_store_data(3, '99999'),
+            ],
+            organization.id,
+            provider_map,
+            build_zipcode_index({'10001', '99999'}),
+        )
+
+        assert len(created_provider_ids) == 2
+        assert provider_map['1'] == provider.id
+        assert sorted(provider_map) == ['1', '2', '3']
+        new_provider = Provider.objects.get(id=provider_map['2'])
+        assert new_provider.organization_id == organization.id
+        assert new_provider.related_zipcode_id == zipcode.id
+        assert new_provider.related_state_id == state.id
+        assert new_provider.related_county_id == county.id
+        # Geocoding is left to the geocode_providers task
+        assert new_provider.change_coordinates
+        assert new_provider.geo_localization is None
+        assert Provider.objects.get(
+            id=provider_map['3'],
+        ).related_zipcode_id is None
+
+
+class TestDeltaImport:
+    """ Test the imports only writing the supplies that changed """
+
+    def test_only_changed_supplies_are_written(self, medication_ndc):
+        organization = OrganizationFactory(organization_name='delta')
+        for supply_level in ('<24', '<24', '>48'):
+            import_supplies(
+                build_csv_file(['1'], supply_level),
+                organization.id,
+                delta=True,
+            )
+
+        assert list(
+            ProviderMedicationNdcThrough.objects.order_by(
+                'creation_date',
+            ).values_list('level', 'latest')
+        ) == [
+            (SupplyLevel.LESS_THAN_24_HOURS, False),
+            (SupplyLevel.MORE_THAN_48_HOURS, True),
+        ]
+        provider = Provider.objects.get(organization=organization)
+        assert provider.supply_as_of is not None
+        assert [
+            current_supply.supply
+            for current_supply in CurrentProviderSupply.objects.all()
+        ] == ['>48']
+
+    def test_unchanged_supplies_are_carried_forward(self, medication_ndc):
+        organization = OrganizationFactory(organization_name='delta')
+        import_supplies(build_csv_file(['1']), organization.id, delta=True)
+        today = timezone.now().date()
+        # The supplies were written two days ago and confirmed today
+        ProviderMedicationNdcThrough.objects.update(
+            creation_date=timezone.now() - timedelta(days=2),
+            date=today - timedelta(days=2),
+        )
+
+        counts = ProviderMedicationNdcThrough.objects.daily_level_counts(
+            [medication_ndc.id],
+            Provider.objects.values_list('id', flat=True),
+            today - timedelta(days=3),
+            today,
+            per_medication_ndc=False,
+        )
+
+        assert [
+            (count['creation_date_only'], count['level'])
+            for count in counts
+        ] == [
+            (today - timedelta(days=days), 1) for days in (2, 1, 0)
+        ]
+
+
+class TestSpool:
+    """ Test the spool of the uploaded files """
+
+    def test_spool_upload(self, settings, tmpdir):
+        settings.MEDIA_ROOT = str(tmpdir)
+        content = build_csv_file(['1', '2']).getvalue()
+        upload = spool_upload(
+            SimpleUploadedFile('supplies.csv', content),
+        )
+
+        assert upload['checksum'] == hashlib.sha256(content).hexdigest()
+        assert upload['size'] == len(content)
+        with open_spooled_file(upload) as spooled_file:
+            assert spooled_file.read() == content
+
+        delete_spooled_files([upload])
+        assert not default_storage.exists(upload['name'])
+
+    def test_truncated_spooled_file(self, settings, tmpdir):
+        settings.MEDIA_ROOT = str(tmpdir)
+        upload = spool_upload(SimpleUploadedFile('supplies.csv', b'data'))
+        upload['size'] += 1
+
+        with pytest.raises(IOError):
+            open_spooled_file(upload)
+
+    def test_clean_up_keeps_running_imports(self, settings, tmpdir):
+        settings.MEDIA_ROOT = str(tmpdir)
+        uploads = {}
+        for status in (ImportRun.RUNNING, ImportRun.FAILED):
+            uploads[status] = spool_upload(
+                SimpleUploadedFile('supplies.csv', b'data'),
+            )
+            ImportRun.objects.create(
+                import_key=status,
+                spool_name=uploads[status]['name'],
+                status=status,
+            )
+            modified_time = time.time() - 8 * 24 * 3600
+            os.utime(
+                default_storage.path(uploads[status]['name']),
+                (modified_time, modified_time),
+            )
+
+        assert clean_up_supply_import_spool(days=7) == 1
+        assert default_storage.exists(uploads[ImportRun.RUNNING]['name'])
+        assert not default_storage.exists(uploads[ImportRun.FAILED]['name'])
+
+
+class TestResumableImport:
+    """ Test the duplicate detection and the shard checkpoints """
+
+    def create_import_run(self, content, **kwargs):
+        organization = OrganizationFactory()
+        upload = spool_upload(SimpleUploadedFile('supplies.csv', content))
+        return ImportRun.objects.create(
+            file_checksum=upload['checksum'],
+            file_size=upload['size'],
+            import_key=ImportRun.get_import_key(
+                upload['checksum'],
+                organization.id,
+            ),
+            organization=organization,
+            spool_name=upload['name'],
+            **kwargs
+        )
+
+    def test_import_key(self):
+        import_date = timezone.now() - timedelta(days=1)
+        key = ImportRun.get_import_key('checksum', 1, import_date)
+
+        assert key == ImportRun.get_import_key('checksum', 1, import_date)
+        assert key != ImportRun.get_import_key('checksum', 2, import_date)
+        assert key != ImportRun.get_import_key('checksum', 1)
+
+    def test_duplicate_of_active_run(self, settings, tmpdir):
+        settings.MEDIA_ROOT = str(tmpdir)
+        import_run = self.create_import_run(
+            build_csv_file(['1']).getvalue(),
+            status=ImportRun.FAILED,
+        )
+        upload = ImportRun(import_key=import_run.import_key)
+        assert upload.get_duplicate() is None
+
+        import_run.status = ImportRun.SUCCESS
+        import_run.save()
+        assert upload.get_duplicate() == import_run
+
+    def test_done_shard_is_not_loaded_again(
+        self, settings, tmpdir, medication_ndc,
+    ):
+        settings.MEDIA_ROOT = str(tmpdir)
+        import_run = self.create_import_run(
+            build_csv_file(['1', '2']).getvalue(),
+        )
+        shard, = split_import_in_shards(import_run)
+
+        first_result = import_supply_shard(shard.id)
+        entry_count = ProviderMedicationNdcThrough.objects.count()
+        second_result = import_supply_shard(shard.id)
+
+        assert ImportShard.objects.get(id=shard.id).status == ImportShard.DONE
+        assert first_result['index'] == 2
+        assert len(first_result['provider_ids']) == 2
+        assert second_result == first_result
+        assert entry_count == 2
+        assert ProviderMedicationNdcThrough.objects.count() == entry_count
+
+    def test_shard_uses_medication_ndcs_of_import(
+        self, settings, tmpdir, medication_ndc,
+    ):
+        settings.MEDIA_ROOT = str(tmpdir)
+        import_run = self.create_import_run(
+            build_csv_file(['1', '2']).getvalue(),
+        )
+        shard, = split_import_in_shards(import_run)
+
+        # Read by generate_medications before the ndc was created
+        result = import_supply_shard(shard.id, medication_ndcs=[])
+
+        assert result['index'] == 2
+        assert ProviderMedicationNdcThrough.objects.count() == 0
@@ -1,18 +1,30 @@
+import io
+import math
 import pytest
 import json
 import factory
+import threading
 
 from random import randint, randrange, choice
 
+from datetime import date, datetime, timedelta
+
+from django.core.cache import cache
+from django.db import connection, models
 from django.utils import timezone
 from django.utils.text import slugify
-from django.contrib.gis.geos import GEOSGeometry
+from django.contrib.gis.geos import GEOSGeometry, Point
+from django.contrib.gis.measure import D
 from django.db.utils import DataError, IntegrityError
 from django.core.exceptions import ValidationError
 from django.contrib.auth import get_user_model
 from django.conf import settings
 from localflavor.us.us_states import STATE_CHOICES
+from rest_framework.renderers import JSONRenderer
 
+from medfinder.management.commands.benchmark_provider_serialization import (
+    get_serializer_queryset,
+)
 from medications.factories import (
     OrganizationFactory,
     ProviderFactory,
@@ -27,12 +39,54 @@ from medications.factories import (
     CountyFactory,
     MedicationNameFactory,
 )
+from medications.archives import (
+    archive_supply_history,
+    build_archive,
+    get_archived_entries,
+    iter_archived_entries,
+    read_archive,
+)
+from medications.geography import update_centers
 from medications.models import (
+    County,
+    CurrentProviderSupply,
+    DailyProviderSupply,
+    DailySupplyAggregate,
     Organization,
     ExistingMedication,
     ProviderMedicationNdcThrough,
     Provider,
+    SimplifiedGeometry,
+    State,
+)
+from medications.tiles import (
+    WEB_MERCATOR_HALF_SIZE,
+    build_tile,
+    get_tile,
+    get_tile_bounds,
 )
+from medications.versions import (
+    get_supply_data_version,
+    increment_supply_data_version,
+)
+from public.features import build_feature
+from public.provider_index import (
+    PROVIDER_INDEX_BUILD_KEY,
+    Candidate,
+    ProviderIndex,
+    clear_provider_index,
+    get_distance,
+    get_features,
+    get_provider_index,
+    store_provider_index,
+)
+from public.search_cache import (
+    get_cached_candidates,
+    get_cell_margin,
+    get_search_cell,
+)
+from public.serializers import FindProviderSerializer
+from public.views import get_database_rows
 
 pytestmark = pytest.mark.django_db()
 ORGANIZATION_NAME = 'Test organization'
@@ -559,6 +613,51 @@ class TestCounty:
             geometry=geographic_object,
         )
 
+    def get_square(self, x, y):
+        return GEOSGeometry(json.dumps({
+            'type': 'Polygon',
+            'coordinates': [[
+                [x, y], [x + 2, y], [x + 2, y + 2], [x, y + 2], [x, y],
+            ]],
+        }))
+
+    def test_centers_follow_geometry(self):
+        county = CountyFactory(
+            state=StateFactory(),
+            geometry=self.get_square(-100, 40),
+        )
+        assert county.centroid.coords == (-99, 41)
+        assert county.bbox.extent == (-100, 40, -98, 42)
+
+        county.geometry = self.get_square(-90, 30)
+        county.save()
+        county.refresh_from_db()
+        assert county.centroid.coords == (-89, 31)
+        assert county.bbox.extent == (-90, 30, -88, 32)
+
+        county.geometry = None
+        county.save()
+        county.refresh_from_db()
+        assert county.centroid is None
+        assert county.bbox is None
+
+    def test_update_centers(self):
+        county = CountyFactory(
+            state=StateFactory(),
+            geometry=self.get_square(-100, 40),
+        )
+        County.objects.update(geometry=self.get_square(-90, 30))
+
+        with connection.cursor() as cursor:
+            assert update_centers(
+                cursor,
+                County._meta.db_table,
+                [county.id],
+            ) == 1
+        county.refresh_from_db()
+        assert county.centroid.coords == (-89, 31)
+        assert county.bbox.extent == (-90, 30, -88, 32)
+
 
 class TestMedicationName:
     """ Test medication name model """
@@ -704,13 +803,14 @@ class TestProviderMedicationNdcThrough:
         )
         assert str(pmt) == provider_medication_str
 
-    def test_level_not_editable_after_save(self, medication_ndc, provider):
+    def test_unknown_level_is_not_saved(self, medication_ndc, provider):
         pmt = ProviderMedicationNdcThrough.objects.create(
-            level=randint(1, 100),
+            level=randint(5, 100),
             medication_ndc=medication_ndc,
             provider=provider,
         )
         assert pmt.level == 0
+        assert pmt.supply == 'NO SUPPLY'
 
     def test_supply_level_mapping(self, medication_ndc, provider):
         supply_to_level_map = {
@@ -726,6 +826,7 @@ class TestProviderMedicationNdcThrough:
                 provider=provider,
             )
             assert pmt.level == level
+            assert pmt.supply == supply
 
     def test_incorrect_supply_string_makes_level_0(
         self,
@@ -740,13 +841,19 @@ class TestProviderMedicationNdcThrough:
         )
         assert pmt.level == 0
 
-    def test_supply_max_lenght(self, provider, medication_ndc, long_str):
-        with pytest.raises(DataError):
-            ProviderMedicationNdcThroughFactory(
-                supply=long_str,
-                provider=provider,
-                medication_ndc=medication_ndc,
-            )
+    def test_long_supply_string_makes_level_0(
+        self,
+        provider,
+        medication_ndc,
+        long_str,
+    ):
+        # Only the level is stored, there is no supply column to overflow
+        pmt = ProviderMedicationNdcThroughFactory(
+            supply=long_str,
+            provider=provider,
+            medication_ndc=medication_ndc,
+        )
+        assert pmt.level == 0
 
     def test_creation_date(self, provider, medication_ndc):
         now = timezone.now()
@@ -761,3 +868,977 @@ class TestProviderMedicationNdcThrough:
             ProviderMedicationNdcThroughFactory(
                 medication_ndc=medication_ndc,
             )
+
+
+class TestProviderMedicationNdcThroughPartitions:
+    """
+    Test the monthly partitions of the ProviderMedicationNdcThrough table
+    """
+
+    def create_entry(self, provider, medication_ndc, day):
+        return ProviderMedicationNdcThrough.objects.create(
+            date=day,
+            medication_ndc=medication_ndc,
+            provider=provider,
+            supply='<24',
+        )
+
+    def explain(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN ' + sql, params)
+            return '\n'.join(row[0] for row in cursor.fetchall())
+
+    def test_range_query_is_pruned(self, provider, medication_ndc):
+        ProviderMedicationNdcThrough.objects.create_partitions(
+            date(2018, 1, 1),
+            date(2018, 4, 1),
+        )
+        for month in range(1, 5):
+            self.create_entry(provider, medication_ndc, date(2018, month, 10))
+
+        plan = self.explain(
+            ProviderMedicationNdcThrough.objects.filter(
+                date__gte=date(2018, 2, 5),
+                date__lte=date(2018, 3, 20),
+            )
+        )
+
+        table = ProviderMedicationNdcThrough._meta.db_table
+        assert '{}_p2018_02'.format(table) in plan
+        assert '{}_p2018_03'.format(table) in plan
+        assert '{}_p2018_01'.format(table) not in plan
+        assert '{}_p2018_04'.format(table) not in plan
+        assert '{}_default'.format(table) not in plan
+
+    def test_partition_takes_rows_of_default_partition(
+        self, provider, medication_ndc,
+    ):
+        entry = self.create_entry(provider, medication_ndc, date(2017, 6, 1))
+        manager = ProviderMedicationNdcThrough.objects
+        assert manager.get_default_partition_months() == [date(2017, 6, 1)]
+
+        created = manager.create_partitions(date(2017, 6, 1), date(2017, 6, 1))
+
+        assert created == [
+            '{}_p2017_06'.format(ProviderMedicationNdcThrough._meta.db_table)
+        ]
+        assert manager.get_default_partition_months() == []
+        assert (date(2017, 6, 1), created[0]) in manager.get_partitions()
+        assert manager.filter(id=entry.id).exists()
+        # Creating an existing partition does nothing
+        assert manager.create_partitions(
+            date(2017, 6, 1),
+            date(2017, 6, 1),
+        ) == []
+
+    def test_detach_partitions(self, provider, medication_ndc):
+        manager = ProviderMedicationNdcThrough.objects
+        manager.create_partitions(date(2016, 1, 1), date(2016, 2, 1))
+        self.create_entry(provider, medication_ndc, date(2016, 1, 10))
+
+        detached = manager.detach_partitions(date(2016, 2, 1), drop=True)
+
+        assert detached == [
+            '{}_p2016_01'.format(ProviderMedicationNdcThrough._meta.db_table)
+        ]
+        assert date(2016, 1, 1) not in dict(manager.get_partitions())
+        assert date(2016, 2, 1) in dict(manager.get_partitions())
+        assert not manager.filter(date__year=2016).exists()
+
+
+class TestSupplyHistoryArchive:
+    """
+    Test the rollup and archive of the old ProviderMedicationNdcThrough
+    entries
+    """
+
+    def create_entry(self, provider, medication_ndc, day, supply):
+        return ProviderMedicationNdcThrough.objects.create(
+            creation_date=timezone.make_aware(
+                datetime(day.year, day.month, day.day, 12),
+            ),
+            date=day,
+            medication_ndc=medication_ndc,
+            provider=provider,
+            supply=supply,
+        )
+
+    def test_archive_round_trip(self):
+        creation_date = timezone.make_aware(datetime(2018, 1, 2, 10, 30))
+        rows = [
+            (1, 10, 100, 4, date(2018, 1, 2), creation_date, True),
+            (2, 11, 101, -1, date(2018, 1, 3), creation_date, False),
+        ]
+
+        content, row_count = build_archive(rows)
+        entries = list(iter_archived_entries(
+            read_archive(io.BytesIO(content))
+        ))
+
+        assert row_count == 2
+        assert [tuple(entry) for entry in entries] == rows
+
+    def test_archive_keeps_daily_levels(
+        self, settings, tmpdir, provider, medication_ndc,
+    ):
+        settings.MEDIA_ROOT = str(tmpdir)
+        today = timezone.now().date()
+        # The supplies were confirmed up to today by delta imports
+        Provider.objects.filter(id=provider.id).update(
+            supply_as_of=timezone.now(),
+        )
+        start_date = today - timedelta(days=60)
+        entries = [
+            self.create_entry(provider, medication_ndc, start_date, '<24'),
+            self.create_entry(
+                provider,
+                medication_ndc,
+                start_date + timedelta(days=2),
+                '>48',
+            ),
+        ]
+        manager = ProviderMedicationNdcThrough.objects
+        counts_args = (
+            [medication_ndc.id],
+            [provider.id],
+            start_date,
+            start_date + timedelta(days=4),
+        )
+        level_counts = manager.daily_level_counts(*counts_args)
+        entry_ids = manager.daily_entry_ids(*counts_args)
+
+        archives = archive_supply_history(retention_days=30)
+
+        assert archives
+        assert sum(archive.row_count for archive in archives) == 2
+        assert DailyProviderSupply.objects.filter(
+            date__lt=today - timedelta(days=30),
+        ).count() == 30
+        # The last entry is carried forward to the following days
+        assert list(manager.values_list('id', flat=True)) == [entries[1].id]
+        assert manager.daily_level_counts(*counts_args) == level_counts
+        assert manager.daily_entry_ids(*counts_args) == entry_ids
+
+        archived_entries = get_archived_entries([entries[0].id])
+        assert list(archived_entries) == [entries[0].id]
+        archived_entry = archived_entries[entries[0].id]
+        assert archived_entry.supply == '<24'
+        assert archived_entry.provider == provider
+        assert archived_entry.creation_date == entries[0].creation_date
+
+
+class TestDailySupplyAggregate:
+    """
+    Test the daily supply aggregates per geography and provider facet
+    """
+
+    def test_refresh_matches_history_counts(
+        self, provider, provider_type, provider_category, medication_ndc,
+    ):
+        Provider.objects.filter(id=provider.id).update(
+            category=provider_category,
+            type=provider_type,
+        )
+        today = timezone.now().date()
+        for days, supply in ((3, '<24'), (1, '>48')):
+            ProviderMedicationNdcThrough.objects.create(
+                creation_date=timezone.now() - timedelta(days=days),
+                date=today - timedelta(days=days),
+                medication_ndc=medication_ndc,
+                provider=provider,
+                supply=supply,
+            )
+        Provider.objects.filter(id=provider.id).update(
+            supply_as_of=timezone.now(),
+        )
+        start_date = today - timedelta(days=4)
+
+        DailySupplyAggregate.objects.refresh(start_date, today)
+
+        assert DailySupplyAggregate.objects.daily_level_counts(
+            [medication_ndc.id],
+            [provider_category.id],
+            [provider_type.id],
+            start_date,
+            today,
+        ) == ProviderMedicationNdcThrough.objects.daily_level_counts(
+            [medication_ndc.id],
+            [provider.id],
+            start_date,
+            today,
+        )
+        # Refreshing a day again replaces its aggregates
+        DailySupplyAggregate.objects.refresh(today, today)
+        assert DailySupplyAggregate.objects.filter(date=today).count() == 1
+
+    def test_refresh_of_providers_keeps_other_zip_codes(
+        self, provider, medication_ndc,
+    ):
+        today = timezone.now().date()
+        ProviderMedicationNdcThrough.objects.create(
+            creation_date=timezone.now(),
+            date=today,
+            medication_ndc=medication_ndc,
+            provider=provider,
+            supply='<24',
+        )
+        other_aggregate = DailySupplyAggregate.objects.create(
+            count=5,
+            date=today,
+            medication_ndc=medication_ndc,
+            zipcode=ZipCodeFactory(state=StateFactory()),
+        )
+
+        DailySupplyAggregate.objects.refresh(
+            today,
+            today,
+            provider_ids=[provider.id],
+        )
+
+        assert DailySupplyAggregate.objects.get(
+            id=other_aggregate.id,
+        ).count == 5
+        aggregate = DailySupplyAggregate.objects.get(zipcode__isnull=True)
+        assert aggregate.count == 1
+
+    def test_overlapping_refreshes_are_serialized(
+        self, transactional_db, provider, medication_ndc,
+    ):
+        today = timezone.now().date()
+        ProviderMedicationNdcThrough.objects.create(
+            creation_date=timezone.now(),
+            date=today,
+            medication_ndc=medication_ndc,
+            provider=provider,
+            supply='<24',
+        )
+
+        def refresh():
+            try:
+                DailySupplyAggregate.objects.refresh(
+                    today,
+                    today,
+                    provider_ids=[provider.id],
+                )
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=refresh) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # Without the lock both refreshes would insert the aggregate
+        aggregate, = DailySupplyAggregate.objects.filter(date=today)
+        assert aggregate.count == 1
+
+
+class TestSupplyIndexes:
+    """
+    Test the indexes used by the queries of the public, geo_stats and
+    historic views. The test tables are tiny, so sequential scans are
+    disabled to see which index the planner would pick.
+    """
+
+    def explain(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute('EXPLAIN ' + sql, params)
+            return '\n'.join(row[0] for row in cursor.fetchall())
+
+    def get_index_names(self, index_name):
+        """Return the index and the indexes of the partitions using it."""
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT child.relname FROM pg_inherits '
+                'JOIN pg_class child ON child.oid = pg_inherits.inhrelid '
+                'WHERE pg_inherits.inhparent = %s::regclass',
+                [index_name],
+            )
+            return [index_name] + [name for name, in cursor.fetchall()]
+
+    def assert_uses_index(self, queryset, *index_names):
+        plan = self.explain(queryset)
+        assert any(
+            name in plan
+            for index_name in index_names
+            for name in self.get_index_names(index_name)
+        ), plan
+
+    def test_latest_supplies_use_partial_index(self, medication_ndc):
+        self.assert_uses_index(
+            ProviderMedicationNdcThrough.objects.filter(
+                latest=True,
+                medication_ndc_id__in=[medication_ndc.id],
+            ).values('provider_id', 'level'),
+            'medications_providermedicationndcthrough_latest_supply',
+        )
+
+    def test_map_date_supplies_use_brin_index(self, medication_ndc):
+        ProviderMedicationNdcThrough.objects.create_partitions(
+            date(2018, 3, 1),
+            date(2018, 3, 1),
+        )
+        # Subquery of the geo_stats views for a map date
+        self.assert_uses_index(
+            ProviderMedicationNdcThrough.objects.filter(
+                date=date(2018, 3, 10),
+                medication_ndc_id__in=[medication_ndc.id],
+            ).values('provider_id'),
+            'medications_providermedicationndcthrough_date_brin',
+        )
+
+    def test_history_range_uses_brin_index(self):
+        ProviderMedicationNdcThrough.objects.create_partitions(
+            date(2018, 3, 1),
+            date(2018, 3, 1),
+        )
+        self.assert_uses_index(
+            ProviderMedicationNdcThrough.objects.filter(
+                creation_date__gte=timezone.make_aware(
+                    datetime(2018, 3, 1),
+                ),
+                creation_date__lt=timezone.make_aware(
+                    datetime(2018, 3, 8),
+                ),
+            ),
+            'medications_providermedicationndcthrough_creation_date_brin',
+        )
+
+    def test_import_provider_lookup_uses_index(self):
+        self.assert_uses_index(
+            Provider.objects.filter(
+                organization_id=1,
+            ).values_list('id', 'store_number'),
+            'medications_organiz_aeb07c_idx',
+        )
+
+    def test_public_current_supplies_use_index(self, medication_ndc):
+        self.assert_uses_index(
+            CurrentProviderSupply.objects.filter(
+                medication_ndc_id__in=[medication_ndc.id],
+            ),
+            'medications_medicat_6be3b0_idx',
+        )
+
+    def test_historic_counts_use_aggregate_index(self, medication_ndc):
+        self.assert_uses_index(
+            DailySupplyAggregate.objects.filter(
+                date__gte=date(2018, 1, 1),
+                date__lte=date(2018, 12, 31),
+                medication_ndc_id__in=[medication_ndc.id],
+            ).values('date', 'level').annotate(
+                count_for_level=models.Sum('count'),
+            ),
+            'medications_date_2f5d73_idx',
+        )
+
+    def test_geo_stats_levels_use_aggregate_index(self, medication_ndc):
+        sql, params, columns = Provider.objects.get_supply_level_counts_sql(
+            'related_state',
+            [medication_ndc.id],
+            [1],
+            [1],
+            date=date(2018, 3, 10),
+        )
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute('EXPLAIN ' + sql, params)
+            plan = '\n'.join(row[0] for row in cursor.fetchall())
+        assert 'medications_date_2f5d73_idx' in plan, plan
+
+    def test_nearest_providers_use_geography_index(self):
+        sql, key_columns = Provider.objects.get_nearest_providers_sql(
+            [1],
+            [1],
+            [4],
+            order='nearest',
+        )
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute('EXPLAIN ' + sql, {
+                'distance': 1000,
+                'limit': 10,
+                'location': Point(-100, 40, srid=4326).ewkt,
+                'medication_ndc_ids': [1],
+                'organization_ids': [1],
+                'vaccine_finder_types': [4],
+            })
+            plan = '\n'.join(row[0] for row in cursor.fetchall())
+        assert 'medications_provider_geo_localization_geography' in plan, plan
+
+
+class TestSupplyLevelCounts:
+    """
+    Test the counts of providers and supply levels of the geo_stats views
+    """
+
+    def test_county_and_state_counts(
+        self, provider_type, provider_category, medication_ndc,
+    ):
+        state = StateFactory()
+        counties = [CountyFactory(state=state) for _ in range(2)]
+        providers = [
+            ProviderFactory(
+                active=True,
+                category=provider_category,
+                related_county=county,
+                type=provider_type,
+            )
+            for county in counties + counties[:1]
+        ]
+        ProviderFactory(related_county=counties[1], active=False)
+        for provider, level in zip(providers, (1, 4, 2)):
+            CurrentProviderSupply.objects.create(
+                creation_date=timezone.now(),
+                date=timezone.now().date(),
+                level=level,
+                medication_ndc=medication_ndc,
+                provider=provider,
+            )
+
+        counts, state_counts = Provider.objects.supply_level_counts(
+            'related_county',
+            [medication_ndc.id],
+            [provider_category.id],
+            [provider_type.id],
+            geography_ids=[county.id for county in counties],
+        )
+
+        assert counts[counties[0].id] == {
+            'total_provider_count': 2,
+            'active_provider_count': 2,
+            'noreport_count': 0,
+            'nosupply_count': 0,
+            'low_count': 1,
+            'medium_count': 1,
+            'high_count': 0,
+        }
+        assert counts[counties[1].id]['total_provider_count'] == 2
+        assert counts[counties[1].id]['active_provider_count'] == 1
+        assert counts[counties[1].id]['high_count'] == 1
+        assert state_counts == {
+            'total_provider_count': 4,
+            'active_provider_count': 3,
+            'noreport_count': 0,
+            'nosupply_count': 0,
+            'low_count': 1,
+            'medium_count': 1,
+            'high_count': 1,
+        }
+
+    def test_map_date_counts_match_current_counts(
+        self, provider_type, provider_category, medication_ndc,
+    ):
+        county = CountyFactory(state=StateFactory())
+        today = timezone.now().date()
+        for active, level in ((True, 1), (True, 4), (False, 2)):
+            provider = ProviderFactory(
+                active=active,
+                category=provider_category,
+                related_county=county,
+                supply_as_of=timezone.now(),
+                type=provider_type,
+            )
+            # Written by the import of yesterday only, like the unchanged
+            # supplies of a delta import
+            ProviderMedicationNdcThrough.objects.create(
+                creation_date=timezone.now() - timedelta(days=1),
+                date=today - timedelta(days=1),
+                level=level,
+                medication_ndc=medication_ndc,
+                provider=provider,
+            )
+            CurrentProviderSupply.objects.create(
+                creation_date=timezone.now() - timedelta(days=1),
+                date=today - timedelta(days=1),
+                level=level,
+                medication_ndc=medication_ndc,
+                provider=provider,
+            )
+        DailySupplyAggregate.objects.refresh(today - timedelta(days=1), today)
+
+        counts = [
+            Provider.objects.supply_level_counts(
+                'related_county',
+                [medication_ndc.id],
+                [provider_category.id],
+                [provider_type.id],
+                date=map_date,
+            )
+            for map_date in (None, today)
+        ]
+
+        assert counts[0] == counts[1]
+        assert counts[1][0][county.id]['active_provider_count'] == 2
+        # The supply of the inactive provider is not counted
+        assert counts[1][0][county.id]['low_count'] == 1
+        assert counts[1][0][county.id]['medium_count'] == 0
+
+
+class TestNearestProviders:
+    """
+    Test the pages of the providers nearest to a location of the public
+    finder
+    """
+
+    @pytest.fixture()
+    def providers(self):
+        organization = OrganizationFactory(
+            organization_name=ORGANIZATION_NAME,
+        )
+        providers = []
+        # From about 850 meters to 170 km east of the location
+        for longitude in (-99.99, -99.95, -99.9, -98):
+            provider = ProviderFactory(organization=organization, active=True)
+            Provider.objects.filter(id=provider.id).update(
+                geo_localization=Point(longitude, 40, srid=4326),
+            )
+            providers.append(provider)
+        return providers
+
+    def get_page(self, providers, medication_ndc_ids=(), **kwargs):
+        return Provider.objects.nearest_providers(
+            Point(-100, 40, srid=4326),
+            20000,
+            medication_ndc_ids,
+            [providers[0].organization_id],
+            [],
+            **kwargs
+        )
+
+    def test_nearest_order_pages(self, providers):
+        page, after = self.get_page(providers, order='nearest', limit=2)
+        assert [entry['id'] for entry in page] == [
+            provider.id for provider in providers[:2]
+        ]
+        assert 800 < page[0]['distance'] < 900
+
+        page, after = self.get_page(
+            providers,
+            order='nearest',
+            after=after,
+            limit=2,
+        )
+        # The last provider is too far
+        assert [entry['id'] for entry in page] == [providers[2].id]
+        assert after is None
+
+    def test_supply_order_pages(self, providers, medication_ndc):
+        Provider.objects.filter(id=providers[0].id).update(active=False)
+        for provider, level in ((providers[0], 5), (providers[2], 4)):
+            CurrentProviderSupply.objects.create(
+                creation_date=timezone.now(),
+                date=timezone.now().date(),
+                level=level,
+                medication_ndc=medication_ndc,
+                provider=provider,
+            )
+
+        page, after = self.get_page(
+            providers,
+            [medication_ndc.id],
+            limit=2,
+        )
+        assert [entry['id'] for entry in page] == [
+            providers[2].id,
+            providers[1].id,
+        ]
+        assert page[0]['total_supply'] == 4
+        assert page[0]['amount_medications'] == 1
+
+        # The supplies of the inactive providers do not count
+        page, after = self.get_page(
+            providers,
+            [medication_ndc.id],
+            after=after,
+            limit=2,
+        )
+        assert [entry['id'] for entry in page] == [providers[0].id]
+        assert page[0]['total_supply'] == 0
+        assert after is None
+
+    def test_invalid_sort_key(self, providers):
+        with pytest.raises(ValueError):
+            self.get_page(providers, after=[1, 2], limit=2)
+        # Values of the wrong type are not sent to the database
+        for after in (['far', 1], [1.5, '1'], [float('nan'), 1], [1, 2 ** 40]):
+            with pytest.raises(ValueError):
+                self.get_page(
+                    providers,
+                    order='nearest',
+                    after=after,
+                    limit=2,
+                )
+
+
+class TestProviderIndex:
+    """
+    Test the in-process index of the providers of the public finder
+    """
+
+    @pytest.fixture()
+    def locmem_cache(self, settings):
+        settings.CACHES = {
+            'default': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            },
+        }
+        cache.clear()
+        clear_provider_index()
+        yield
+        clear_provider_index()
+
+    @pytest.fixture()
+    def providers(self):
+        providers = []
+        # From about 850 meters to 170 km east of the location
+        for longitude in (-99.99, -99.95, -99.9, -98):
+            provider = ProviderFactory(vaccine_finder_type=4, active=True)
+            Provider.objects.filter(id=provider.id).update(
+                geo_localization=Point(longitude, 40, srid=4326),
+            )
+            providers.append(provider)
+        # Not a provider of the finder
+        other_provider = ProviderFactory(vaccine_finder_type=1, active=True)
+        Provider.objects.filter(id=other_provider.id).update(
+            geo_localization=Point(-99.99, 40, srid=4326),
+        )
+        return providers
+
+    def test_distance_matches_sphere_distance(self):
+        assert get_distance(-100, 40, -100, 40) == 0
+        assert abs(get_distance(-100, 40, -99.99, 40) - 851.8) < 1
+
+    def test_search_sorts_like_finder(self, providers, medication_ndc):
+        Provider.objects.filter(id=providers[0].id).update(active=False)
+        for provider, level in ((providers[0], 5), (providers[2], 4)):
+            CurrentProviderSupply.objects.create(
+                creation_date=timezone.now(),
+                date=timezone.now().date(),
+                level=level,
+                medication_ndc=medication_ndc,
+                provider=provider,
+            )
+
+        index = ProviderIndex(cell_size=0.05).build()
+        assert len(index) == 4
+        features = index.search(-100, 40, 20000, [medication_ndc.id])
+
+        # The supplies of the inactive providers do not count and the last
+        # provider is too far
+        assert [
+            feature['properties']['id'] for feature in features
+        ] == [providers[2].id, providers[1].id, providers[0].id]
+        assert features[0]['properties']['drugs'][0]['id'] == (
+            medication_ndc.medication.id
+        )
+        assert features[1]['properties']['drugs'] == []
+        assert features[2]['properties']['drugs'] == []
+        assert 0.5 < features[2]['properties']['distance'] < 0.6
+        assert features[0]['geometry']['coordinates'] == [-99.9, 40]
+
+        # Other medications are not shown
+        features = index.search(-100, 40, 20000, [])
+        assert features[0]['properties']['id'] == providers[1].id
+        assert features[2]['properties']['drugs'] == []
+
+    def test_stored_index_is_loaded_by_workers(
+        self,
+        locmem_cache,
+        providers,
+        medication_ndc,
+    ):
+        CurrentProviderSupply.objects.create(
+            creation_date=timezone.now(),
+            date=timezone.now().date(),
+            level=4,
+            medication_ndc=medication_ndc,
+            provider=providers[2],
+        )
+        # The searches use the database until a build stores an index
+        cache.set(PROVIDER_INDEX_BUILD_KEY, True)
+        assert get_provider_index() is None
+
+        built_index = ProviderIndex().build()
+        store_provider_index(built_index)
+        index = get_provider_index()
+        assert get_provider_index() is index
+        assert index.to_data() == built_index.to_data()
+        assert index.search(-100, 40, 20000, [medication_ndc.id]) == (
+            built_index.search(-100, 40, 20000, [medication_ndc.id])
+        )
+
+        # The supplies saved one by one do not rebuild it
+        increment_supply_data_version()
+        assert get_provider_index() is index
+
+        store_provider_index(ProviderIndex().build())
+        assert get_provider_index() is not index
+        assert len(get_provider_index()) == 4
+
+    def test_cell_candidates_give_exact_search(self, providers):
+        index = ProviderIndex().build()
+        cell = get_search_cell(-99.951, 40.001, 0.02)
+        margin = get_cell_margin(cell, 0.02)
+        # The distance from the center of the cell to its corners
+        assert 1350 < margin < 1450
+
+        candidates = index.get_candidates(-99.95, 40.01, 5000 + margin, [])
+        assert get_features(candidates, -99.951, 40.001, 5000, []) == (
+            index.search(-99.951, 40.001, 5000, [])
+        )
+
+
+class TestProviderFeatures:
+    """
+    Test the features of the public finder built from plain rows
+    """
+
+    def test_features_match_serializer(self, medication_ndc):
+        providers = []
+        for longitude, active in ((-99.99, True), (-99.95, False), (-99.9, True)):
+            provider = ProviderFactory(vaccine_finder_type=4, active=active)
+            Provider.objects.filter(id=provider.id).update(
+                geo_localization=Point(longitude, 40.123456789, srid=4326),
+            )
+            CurrentProviderSupply.objects.create(
+                creation_date=timezone.now(),
+                date=timezone.now().date(),
+                level=4,
+                medication_ndc=medication_ndc,
+                provider=provider,
+            )
+            providers.append(provider)
+        location_point = Point(-100, 40, srid=4326)
+        distance = D(m=20000)
+
+        rows = get_database_rows(location_point, distance, [medication_ndc.id])
+        features = [build_feature(row, row['distance']) for row in rows]
+        serialized_providers = {
+            provider.id: provider
+            for provider in get_serializer_queryset(
+                location_point,
+                distance,
+                [medication_ndc.id],
+            )
+        }
+        serialized = [
+            FindProviderSerializer(serialized_providers[row['id']]).data
+            for row in rows
+        ]
+
+        assert [feature['properties']['id'] for feature in features] == [
+            providers[0].id,
+            providers[2].id,
+            providers[1].id,
+        ]
+        assert features[0]['properties']['drugs']
+        assert features[2]['properties']['drugs'] == []
+        renderer = JSONRenderer()
+        assert renderer.render(features) == renderer.render(serialized)
+
+
+class TestSearchCache:
+    """
+    Test the cache of the public finder searches by cell
+    """
+
+    @pytest.fixture()
+    def locmem_cache(self, settings):
+        settings.CACHES = {
+            'default': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            },
+        }
+        settings.PUBLIC_SEARCH_CACHE_CELL_SIZE = 0.02
+        cache.clear()
+
+    def test_candidates_are_cached_by_cell(self, locmem_cache):
+        searches = []
+
+        def get_candidates(longitude, latitude, distance):
+            searches.append((longitude, latitude, distance))
+            return []
+
+        assert get_cached_candidates(
+            -99.951, 40.001, 1000, [2, 1], [3], get_candidates,
+        ) == ([], False)
+        assert get_cached_candidates(
+            -99.959, 40.019, 1000, [1, 2], [3], get_candidates,
+        ) == ([], True)
+        # The center of the cell and the distance plus the margin
+        assert len(searches) == 1
+        assert searches[0][:2] == pytest.approx((-99.95, 40.01))
+        assert 2350 < searches[0][2] < 2450
+
+        # Other cell, filters or data version
+        get_cached_candidates(-99.931, 40.001, 1000, [1, 2], [3], get_candidates)
+        get_cached_candidates(-99.951, 40.001, 1000, 'all', [], get_candidates)
+        increment_supply_data_version()
+        get_cached_candidates(-99.951, 40.001, 1000, [1, 2], [3], get_candidates)
+        assert len(searches) == 4
+
+    def test_cached_cells_are_capped(self, locmem_cache, settings):
+        settings.PUBLIC_SEARCH_CACHE_MAX_CANDIDATES = 1
+        settings.PUBLIC_SEARCH_CACHE_MAX_ENTRIES = 2
+        candidate = Candidate(4, True, 1, -99.95, 40.01, 1)
+
+        # Too many candidates to be cached
+        for hit in (False, False):
+            assert get_cached_candidates(
+                -99.951, 40.001, 1000, [1], [3],
+                lambda *args: [candidate, candidate],
+            ) == ([candidate, candidate], hit)
+
+        for longitude in (-99.951, -99.931, -99.911):
+            get_cached_candidates(
+                longitude, 40.001, 1000, [2], [3], lambda *args: [candidate],
+            )
+        assert get_cached_candidates(
+            -99.931, 40.001, 1000, [2], [3], lambda *args: [],
+        ) == ([candidate], True)
+        # More cells than the entries of the data version
+        assert get_cached_candidates(
+            -99.911, 40.001, 1000, [2], [3], lambda *args: [],
+        ) == ([], False)
+
+
+class TestSimplifiedGeometry:
+    """
+    Test the geometries simplified for the zoom levels of the maps
+    """
+
+    @pytest.fixture()
+    def locmem_cache(self, settings):
+        settings.CACHES = {
+            'default': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            },
+        }
+
+    def get_circle(self, points):
+        # A detailed polygon, most of its points are closer than a pixel
+        # at the national zoom
+        return GEOSGeometry(json.dumps({
+            'type': 'Polygon',
+            'coordinates': [[
+                [
+                    -100 + math.cos(2 * math.pi * index / points),
+                    40 + math.sin(2 * math.pi * index / points),
+                ]
+                for index in list(range(points)) + [0]
+            ]],
+        }))
+
+    def test_generate_and_read_geojson(self, locmem_cache):
+        state = StateFactory(geometry=self.get_circle(2000))
+
+        assert SimplifiedGeometry.objects.generate(State, 3) == 1
+
+        geojson = SimplifiedGeometry.objects.get_geojson(
+            State,
+            [state.id],
+            3,
+        )
+        geometry = json.loads(geojson[state.id].decode())
+        assert geometry['type'] == 'Polygon'
+        assert 4 <= len(geometry['coordinates'][0]) < 100
+        # Other zoom levels are not generated
+        assert SimplifiedGeometry.objects.get_geojson(State, [state.id], 7) == {}
+
+    def test_geojson_is_cached_until_generated_again(self, locmem_cache):
+        state = StateFactory(geometry=self.get_circle(200))
+        SimplifiedGeometry.objects.generate(State, 7)
+        geojson = SimplifiedGeometry.objects.get_geojson(State, [state.id], 7)
+
+        SimplifiedGeometry.objects.update(geojson='{}')
+        assert SimplifiedGeometry.objects.get_geojson(
+            State,
+            [state.id],
+            7,
+        ) == geojson
+
+        SimplifiedGeometry.objects.generate(State, 7)
+        assert SimplifiedGeometry.objects.get_geojson(
+            State,
+            [state.id],
+            7,
+        ) == geojson
+        assert SimplifiedGeometry.objects.get(
+            geography_id=state.id,
+        ).geojson.encode() == geojson[state.id]
+
+
+class TestSupplyTiles:
+    """
+    Test the vector tiles of the supply maps
+    """
+
+    @pytest.fixture()
+    def locmem_cache(self, settings):
+        settings.CACHES = {
+            'default': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            },
+        }
+
+    @pytest.fixture()
+    def state(self):
+        # A square around (-100, 40), in the 2/0/1 tile
+        return StateFactory(
+            state_name='Tiled state',
+            geometry=GEOSGeometry(json.dumps({
+                'type': 'Polygon',
+                'coordinates': [[
+                    [-101, 39], [-99, 39], [-99, 41], [-101, 41], [-101, 39],
+                ]],
+            })),
+        )
+
+    def get_tile(self, layer, z, x, y, **filters):
+        return build_tile(layer, z, x, y, [], [], [], **filters)
+
+    def test_tile_bounds(self):
+        size = WEB_MERCATOR_HALF_SIZE
+        assert get_tile_bounds(0, 0, 0) == (-size, -size, size, size)
+        assert get_tile_bounds(1, 1, 0) == (0, 0, size, size)
+        assert get_tile_bounds(1, 0, 1) == (-size, -size, 0, 0)
+
+    def test_build_tile(self, state):
+        tile = self.get_tile('state', 2, 0, 1)
+
+        assert b'state' in tile
+        assert b'Tiled state' in tile
+        assert b'active_provider_count' in tile
+        assert self.get_tile('state', 2, 3, 0) == b''
+
+    def test_tile_of_other_state_is_empty(self, state):
+        other_state = StateFactory()
+
+        assert self.get_tile('state', 2, 0, 1, state_id=state.id)
+        assert self.get_tile('state', 2, 0, 1, state_id=other_state.id) == b''
+
+    def test_tile_below_layer_minimum_zoom_is_empty(self, state):
+        CountyFactory(geometry=state.geometry, state=state)
+
+        assert self.get_tile('county', 2, 0, 1) == b''
+        assert self.get_tile('county', 4, 3, 6)
+
+    def test_tile_is_cached_until_data_version_changes(self, locmem_cache, state):
+        filters = {
+            'medication_ndc_ids': [],
+            'provider_category_ids': [],
+            'provider_type_ids': [],
+        }
+        tile = get_tile('state', 2, 0, 1, filters)
+
+        State.objects.filter(id=state.id).update(state_name='Renamed state')
+        assert get_tile('state', 2, 0, 1, filters) == tile
+
+        version = get_supply_data_version()
+        assert increment_supply_data_version() == version + 1
+        assert b'Renamed state' in get_tile('state', 2, 0, 1, filters)
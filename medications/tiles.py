@@ -0,0 +1,231 @@
+"""
+Mapbox Vector Tiles of the supply maps.
+
+A tile holds the states, counties or zip codes intersecting it, with the
+supply summary of the map filters as feature properties. The features are
+encoded by PostGIS with ST_AsMVT, the geometries being clipped to the tile
+and snapped to its grid by ST_AsMVTGeom, while the summary comes from the
+same Provider.objects.supply_level_counts query than the geo_stats views.
+
+The tiles are cached by filters, supply data version and z/x/y, so a new
+import is served right away and the old tiles expire on their own.
+"""
+import hashlib
+import json
+
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+
+from .constants import SUPPLY_LEVEL_GROUPS
+from .models import County, Provider, State, ZipCode
+from .utils import get_supplies_from_counts
+from .versions import get_supply_data_version
+
+TILE_CONTENT_TYPE = 'application/vnd.mapbox-vector-tile'
+TILE_EXTENT = 4096
+TILE_BUFFER = 64
+MAX_ZOOM = 22
+# Half the width of the Web Mercator projection, in meters
+WEB_MERCATOR_HALF_SIZE = 20037508.342789244
+
+TileLayer = namedtuple(
+    'TileLayer',
+    ['model', 'geography_field', 'name_field', 'state_field', 'min_zoom'],
+)
+
+# The tiles below the minimum zoom of a layer are empty, they would carry
+# too many features
+TILE_LAYERS = {
+    'state': TileLayer(State, 'related_state', 'state_name', 'id', 0),
+    'county': TileLayer(County, 'related_county', 'county_name', 'state_id', 4),
+    'zipcode': TileLayer(ZipCode, 'related_zipcode', 'zipcode', 'state_id', 8),
+}
+
+
+def is_valid_tile(z, x, y):
+    return 0 <= z <= MAX_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+
+def get_tile_bounds(z, x, y):
+    """Return the Web Mercator (xmin, ymin, xmax, ymax) bounds of a tile."""
+    size = 2 * WEB_MERCATOR_HALF_SIZE / 2 ** z
+    xmin = -WEB_MERCATOR_HALF_SIZE + x * size
+    ymax = WEB_MERCATOR_HALF_SIZE - y * size
+    return xmin, ymax - size, xmin + size, ymax
+
+
+def get_tile_cache_key(layer, z, x, y, filters):
+    """
+    Return the cache key of a tile, the filters being a dict of the map
+    filters and the state the user is restricted to.
+    """
+    filters_hash = hashlib.sha256(
+        json.dumps(filters, sort_keys=True).encode(),
+    ).hexdigest()
+    return 'supply_tile:{}:{}:{}:{}:{}:{}'.format(
+        layer,
+        filters_hash,
+        get_supply_data_version(),
+        z,
+        x,
+        y,
+    )
+
+
+def get_tile_geography_ids(layer, bounds, state_id=None):
+    """
+    Return the ids of the geographies of a layer intersecting the bounds,
+    through the spatial index of their geometry.
+    """
+    sql = (
+        'SELECT id FROM {table} '
+        'WHERE geometry && ST_Transform('
+        '    ST_MakeEnvelope(%(xmin)s, %(ymin)s, %(xmax)s, %(ymax)s, 3857),'
+        '    4326'
+        ') {state_filter} '
+        'ORDER BY id'
+    ).format(
+        state_filter=(
+            'AND {} = %(state_id)s'.format(layer.state_field)
+            if state_id else ''
+        ),
+        table=layer.model._meta.db_table,
+    )
+    xmin, ymin, xmax, ymax = bounds
+    with connection.cursor() as cursor:
+        cursor.execute(sql, {
+            'state_id': state_id,
+            'xmax': xmax,
+            'xmin': xmin,
+            'ymax': ymax,
+            'ymin': ymin,
+        })
+        return [geography_id for geography_id, in cursor]
+
+
+def get_tile_properties(geography_ids, level_counts):
+    """
+    Return the supply properties of the features as a dict of lists, in
+    the order of the geography ids. The supply of the geographies without
+    supplies is None, which leaves it out of their feature.
+    """
+    properties = {
+        name: [] for name in (
+            'supply',
+            'nosupply',
+            'low',
+            'medium',
+            'high',
+            'total_provider_count',
+            'active_provider_count',
+        )
+    }
+    empty_counts = dict.fromkeys(
+        ['total_provider_count', 'active_provider_count'] + [
+            '{}_count'.format(group) for group in SUPPLY_LEVEL_GROUPS
+        ],
+        0,
+    )
+    for geography_id in geography_ids:
+        counts = level_counts.get(geography_id, empty_counts)
+        supplies, supply = get_supplies_from_counts({
+            group: counts['{}_count'.format(group)]
+            for group in SUPPLY_LEVEL_GROUPS
+        })
+        properties['supply'].append(supply)
+        for name, count in supplies.items():
+            properties[name].append(count)
+        properties['total_provider_count'].append(
+            counts['total_provider_count'],
+        )
+        properties['active_provider_count'].append(
+            counts['active_provider_count'],
+        )
+    return properties
+
+
+def build_tile(layer_name, z, x, y, medication_ndc_ids, provider_category_ids, provider_type_ids, date=None, state_id=None):
+    """
+    Return the bytes of the vector tile of a layer for the map filters,
+    restricted to the geographies of a state if state_id is given.
+    """
+    layer = TILE_LAYERS[layer_name]
+    if z < layer.min_zoom:
+        return b''
+    bounds = get_tile_bounds(z, x, y)
+    geography_ids = get_tile_geography_ids(layer, bounds, state_id)
+    if not geography_ids:
+        return b''
+
+    level_counts = Provider.objects.supply_level_counts(
+        layer.geography_field,
+        medication_ndc_ids,
+        provider_category_ids,
+        provider_type_ids,
+        date=date,
+        geography_ids=geography_ids,
+    )[0]
+    properties = get_tile_properties(geography_ids, level_counts)
+    sql = (
+        'SELECT ST_AsMVT(features, %(layer)s, %(extent)s, %(geometry)s) '
+        'FROM ('
+        '    SELECT geography.id, geography.{name_field} AS name,'
+        '        geography.population, properties.supply,'
+        '        properties.nosupply, properties.low, properties.medium,'
+        '        properties.high, properties.total_provider_count,'
+        '        properties.active_provider_count,'
+        '        ST_AsMVTGeom('
+        '            ST_Transform(geography.geometry, 3857),'
+        '            ST_MakeEnvelope('
+        '                %(xmin)s, %(ymin)s, %(xmax)s, %(ymax)s, 3857'
+        '            ),'
+        '            %(extent)s, %(buffer)s, true'
+        '        ) AS geometry'
+        '    FROM {table} geography'
+        '    JOIN unnest('
+        '        %(ids)s::int[], %(supply)s::text[], %(nosupply)s::int[],'
+        '        %(low)s::int[], %(medium)s::int[], %(high)s::int[],'
+        '        %(total_provider_count)s::int[],'
+        '        %(active_provider_count)s::int[]'
+        '    ) AS properties(id, supply, nosupply, low, medium, high,'
+        '        total_provider_count, active_provider_count)'
+        '        ON properties.id = geography.id'
+        ') AS features '
+        'WHERE geometry IS NOT NULL'
+    ).format(
+        name_field=layer.name_field,
+        table=layer.model._meta.db_table,
+    )
+    xmin, ymin, xmax, ymax = bounds
+    params = {
+        'buffer': TILE_BUFFER,
+        'extent': TILE_EXTENT,
+        'geometry': 'geometry',
+        'ids': geography_ids,
+        'layer': layer_name,
+        'xmax': xmax,
+        'xmin': xmin,
+        'ymax': ymax,
+        'ymin': ymin,
+    }
+    params.update(properties)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        tile, = cursor.fetchone()
+    return bytes(tile or b'')
+
+
+def get_tile(layer_name, z, x, y, filters):
+    """
+    Return the bytes of a vector tile from the cache, building and caching
+    it if missing. The filters are the keyword arguments of build_tile.
+    """
+    cache_key = get_tile_cache_key(layer_name, z, x, y, filters)
+    tile = cache.get(cache_key)
+    if tile is None:
+        tile = build_tile(layer_name, z, x, y, **filters)
+        cache.set(cache_key, tile, settings.SUPPLY_TILE_CACHE_TIMEOUT)
+    return tile
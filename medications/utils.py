@@ -8,6 +8,8 @@ from urllib.request import urlopen
 from django.utils.translation import ugettext_lazy as _
 from rest_registration.exceptions import BadRequest
 
+from .constants import SUPPLY_LEVEL_GROUPS
+
 
 def get_lat_lng(location):
     # Helper method to geocode address using Google Geocoder
@@ -45,22 +47,22 @@ def get_dominant_supply(noreport, nosupply, low, medium, high, total):
 
 
 def get_supplies(supply_levels):
-    noreport = 0
-    nosupply = 0
-    low = 0
-    medium = 0
-    high = 0
+    level_counts = dict.fromkeys(SUPPLY_LEVEL_GROUPS, 0)
     for level in supply_levels:
-        if level == -1:
-            noreport += 1
-        if level == 0:
-            nosupply += 1
-        if level == 1:
-            low += 1
-        elif level == 2 or level == 3:
-            medium += 1
-        elif level == 4:
-            high += 1
+        for group, levels in SUPPLY_LEVEL_GROUPS.items():
+            if level in levels:
+                level_counts[group] += 1
+    return get_supplies_from_counts(level_counts)
+
+
+def get_supplies_from_counts(level_counts):
+    # Same as get_supplies from the number of supplies of every level
+    # group, as counted by the database
+    noreport = level_counts['noreport']
+    nosupply = level_counts['nosupply']
+    low = level_counts['low']
+    medium = level_counts['medium']
+    high = level_counts['high']
     dominant = get_dominant_supply(
         noreport,
         nosupply,
@@ -0,0 +1,22 @@
+"""
+Version of the supply data served by the maps.
+
+The version is a counter kept in the cache and incremented every time the
+supplies change, after an import or a single supply update. The cached
+map responses have the version in their key, so they are never served
+once the data they were computed from has changed and simply expire.
+"""
+from django.core.cache import cache
+
+SUPPLY_DATA_VERSION_KEY = 'supply_data_version'
+
+
+def get_supply_data_version():
+    # The counter starts at 1 when missing from the cache
+    cache.add(SUPPLY_DATA_VERSION_KEY, 1, timeout=None)
+    return cache.get(SUPPLY_DATA_VERSION_KEY, 1)
+
+
+def increment_supply_data_version():
+    cache.add(SUPPLY_DATA_VERSION_KEY, 1, timeout=None)
+    return cache.incr(SUPPLY_DATA_VERSION_KEY)
@@ -6,15 +6,14 @@ import time
 from datetime import datetime, timedelta
 
 from django.conf import settings
+from django.db import IntegrityError, transaction
 from django.db.models import Q, Count, Prefetch
-from django.contrib.postgres.aggregates import ArrayAgg
-from django.contrib.gis.db.models.functions import Centroid, AsGeoJSON
-from django.core.cache import cache
 from django.core.exceptions import MultipleObjectsReturned
-
+from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
 
 from rest_framework import status, viewsets, views
+from rest_framework.exceptions import NotFound
 from rest_registration.exceptions import BadRequest
 from rest_framework.response import Response
 from rest_framework.generics import (
@@ -22,7 +21,9 @@ from rest_framework.generics import (
     ListAPIView,
     RetrieveAPIView,
 )
+from rest_framework.pagination import LimitOffsetPagination
 from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.renderers import BrowsableAPIRenderer
 from rest_framework.views import APIView
 from django.http import HttpResponse
 
@@ -30,6 +31,7 @@ from epidemic.models import Epidemic
 from medications.tasks import generate_medications, generate_csv_export
 from .serializers import (
     CSVUploadSerializer,
+    ImportRunSerializer,
     MedicationNameSerializer,
     StateSerializer,
     SimpleStateSerializer,
@@ -42,6 +44,8 @@ from .serializers import (
 )
 from .models import (
     County,
+    CurrentProviderSupply,
+    ImportRun,
     Medication,
     MedicationMedicationNameMedicationDosageThrough,
     MedicationName,
@@ -58,12 +62,18 @@ from .models import (
     ZipCode,
 )
 
+from .constants import SUPPLY_LEVEL_GROUPS
+
 from .permissions import (
     NationalLevel,
     SelfStatePermissionLevel,
     SelfZipCodePermissionLevel,
 )
 
+from .renderers import PreEncodedJSONRenderer
+from .response_cache import VersionedResponseCacheMixin
+from .spool import delete_spooled_files, get_checksum, spool_upload
+from .tiles import TILE_CONTENT_TYPE, TILE_LAYERS, get_tile, is_valid_tile
 from .utils import force_user_state_id_and_zipcode
 
 
@@ -77,12 +87,69 @@ class CSVUploadView(GenericAPIView):
         csv_file = serializer.validated_data.pop('csv_file')
         organization_id = serializer.validated_data.pop('organization_id')
         import_date = serializer.validated_data.pop('import_date')
-        cache_key = '{}_{}_{}'.format(
-            csv_file.name, request.user.id, organization_id)
-        cache.set(cache_key, csv_file, None)
-        generate_medications.delay(
-            cache_key,
+        checksum, size = get_checksum(csv_file)
+        import_key = ImportRun.get_import_key(
+            checksum,
             organization_id,
+            import_date or None,
+        )
+        import_run = ImportRun(
+            file_checksum=checksum,
+            file_name=csv_file.name,
+            file_size=size,
+            import_date=import_date or None,
+            import_key=import_key,
+            organization_id=organization_id,
+            user=request.user,
+        )
+        if import_run.get_duplicate():
+            import_run.status = ImportRun.SKIPPED
+            import_run.save()
+            return Response(
+                {'status': _('This file has already been imported')},
+                status=status.HTTP_200_OK,
+            )
+
+        # A failed import of the same file is resumed from its last done
+        # shard instead of loading the whole file again
+        failed_import_run = ImportRun.objects.filter(
+            import_key=import_key,
+            status=ImportRun.FAILED,
+        ).first()
+        # Only a reference to the spooled file is sent to the task
+        replaced_upload = None
+        spooled_upload = None
+        if failed_import_run:
+            import_run = failed_import_run
+            import_run.status = ImportRun.QUEUED
+            if not import_run.shards.exists():
+                if import_run.spool_name:
+                    replaced_upload = import_run.get_upload()
+                spooled_upload = spool_upload(csv_file, checksum)
+        else:
+            spooled_upload = spool_upload(csv_file, checksum)
+        if spooled_upload is not None:
+            import_run.spool_name = spooled_upload['name']
+        try:
+            with transaction.atomic():
+                import_run.save()
+        except IntegrityError:
+            if spooled_upload is not None:
+                delete_spooled_files([spooled_upload])
+            # The same file was uploaded at the same time
+            return Response(
+                {'status': _('This file has already been imported')},
+                status=status.HTTP_200_OK,
+            )
+        except Exception:
+            if spooled_upload is not None:
+                delete_spooled_files([spooled_upload])
+            raise
+        if replaced_upload is not None:
+            delete_spooled_files([replaced_upload])
+
+        generate_medications.delay(
+            import_run.id,
             request.user.email,
             import_date,
         )
@@ -180,10 +247,11 @@ def medication_name_dosage_type_filters():
     return options.values()
 
 
-class MedicationFiltersView(GenericAPIView):
+class MedicationFiltersView(VersionedResponseCacheMixin, GenericAPIView):
     permission_classes = (IsAuthenticated,)
+    response_cache_name = 'filters'
 
-    def get(self, request, *args, **kwargs):
+    def get_uncached(self, request, *args, **kwargs):
         # 1 - Extract all request params
         date = self.request.query_params.get('map_date', False)
         dosages = self.request.query_params.getlist('dosages[]', [])
@@ -360,6 +428,54 @@ class StateViewSet(viewsets.ModelViewSet):
         return states_qs
 
 
+def is_current_supply_query(query_params):
+    # Queries without a map date or a date range ask for the current
+    # supplies, any other query has to look into the history
+    return not (
+        query_params.get('map_date', False) or (
+            query_params.get('start_date', False) and
+            query_params.get('end_date', False)
+        )
+    )
+
+
+def get_day_start(query_params, param, days=0):
+    """
+    Return the aware start of the day of a YYYY-MM-DD query param, moved
+    by days, or None without the param.
+    """
+    value = query_params.get(param)
+    if not value:
+        return None
+    try:
+        day = datetime.strptime(value, '%Y-%m-%d')
+    except ValueError as e:
+        raise BadRequest(_('Incorrect date: {}').format(e))
+    return timezone.make_aware(day + timedelta(days=days))
+
+
+def set_level_counts(geographies, level_counts):
+    """
+    Set the provider and supply level counts of Provider.objects.
+    supply_level_counts on the states or counties, as the serializers read
+    them like annotations.
+    """
+    geographies = list(geographies)
+    empty_counts = dict.fromkeys(
+        ['total_provider_count', 'active_provider_count'] + [
+            '{}_count'.format(group) for group in SUPPLY_LEVEL_GROUPS
+        ],
+        0,
+    )
+    for geography in geographies:
+        for name, count in level_counts.get(
+            geography.id,
+            empty_counts,
+        ).items():
+            setattr(geography, name, count)
+    return geographies
+
+
 def get_provider_medication_id(query_params, field='id'):
     # Method use to save many line codes in the geo_stats views
     date = query_params.get('map_date', False)
@@ -388,7 +504,14 @@ def get_provider_medication_id(query_params, field='id'):
     # We create a list of the ids of the provider medication objects that
     # we have after filtering.
 
-    provider_medication_qs = ProviderMedicationNdcThrough.objects.filter(
+    # Without dates we only need the current supplies, which are kept in
+    # their own table instead of the whole history
+    if is_current_supply_query(query_params):
+        provider_medication_qs = CurrentProviderSupply.objects.all()
+    else:
+        provider_medication_qs = ProviderMedicationNdcThrough.objects.all()
+
+    provider_medication_qs = provider_medication_qs.filter(
         medication_ndc_id__in=med_ndc_ids,
         provider__active=True,
         provider__category__in=provider_category_filters,
@@ -407,10 +530,6 @@ def get_provider_medication_id(query_params, field='id'):
             date__gte=start_date,
             date__lte=end_date + timedelta(days=1),
         )
-    else:
-        provider_medication_qs = provider_medication_qs.filter(
-            latest=True,
-        )
 
     provider_medication_ids = provider_medication_qs.values_list(
         field,
@@ -420,10 +539,12 @@ def get_provider_medication_id(query_params, field='id'):
     return provider_medication_ids
 
 
-class GeoStatsStatesWithMedicationsView(ListAPIView):
+class GeoStatsStatesWithMedicationsView(VersionedResponseCacheMixin, ListAPIView):
     serializer_class = GeoStateWithMedicationsSerializer
     permission_classes = (IsAuthenticated,)
+    renderer_classes = (PreEncodedJSONRenderer, BrowsableAPIRenderer)
     allowed_methods = ['GET']
+    response_cache_name = 'geo_stats_states'
 
     def get_queryset(self):
         '''
@@ -452,39 +573,28 @@ class GeoStatsStatesWithMedicationsView(ListAPIView):
             'medication__ndc_codes',
         ).distinct().values_list('medication__ndc_codes', flat=True)
 
-        qs = State.objects.all().annotate(
-            active_provider_count=Count(
-                'providers__id',
-                filter=Q(
-                    providers__active=True,
-                    providers__category__in=provider_category_filters,
-                    providers__provider_medication__date=date,
-                    providers__provider_medication__medication_ndc_id__in=med_ndc_ids,
-                    providers__type__in=provider_type_filters,
-                ),
-                distinct=True
-            ),
-            total_provider_count=Count(
-                'providers__id',
-                distinct=True
-            ),
-            medication_levels=ArrayAgg(
-                'providers__provider_medication__level',
-                filter=Q(
-                    providers__active=True,
-                    providers__category__in=provider_category_filters,
-                    providers__provider_medication__date=date,
-                    providers__provider_medication__medication_ndc_id__in=med_ndc_ids,
-                    providers__type__in=provider_type_filters,)
-            ),
+        # The level counts are computed by the database instead of
+        # aggregating the level of every supply
+        level_counts = Provider.objects.supply_level_counts(
+            'related_state',
+            med_ndc_ids,
+            provider_category_filters,
+            provider_type_filters,
+            date=date,
+        )[0]
+        # The serializer reads the simplified geometries
+        return set_level_counts(
+            State.objects.defer('geometry'),
+            level_counts,
         )
-        return qs
 
 
-class GeoStatsCountiesWithMedicationsView(ListAPIView):
+class GeoStatsCountiesWithMedicationsView(VersionedResponseCacheMixin, ListAPIView):
     serializer_class = GeoCountyWithMedicationsSerializer
     permission_classes = (SelfStatePermissionLevel,)
+    renderer_classes = (PreEncodedJSONRenderer, BrowsableAPIRenderer)
     allowed_methods = ['GET']
+    response_cache_name = 'geo_stats_counties'
 
     def get_queryset(self):
         '''
@@ -549,44 +659,42 @@ class GeoStatsCountiesWithMedicationsView(ListAPIView):
             'medication__ndc_codes',
         ).distinct().values_list('medication__ndc_codes', flat=True)
 
-        qs = County.objects.filter(
+        counties = County.objects.filter(
             state_id=state_id,
         ).select_related(
             'state',
-        ).annotate(
-            active_provider_count=Count(
-                'providers__id',
-                filter=Q(
-                    providers__active=True,
-                    providers__category__in=provider_category_filters,
-                    providers__provider_medication__date=date,
-                    providers__provider_medication__medication_ndc_id__in=med_ndc_ids,
-                    providers__type__in=provider_type_filters,
-                ),
-                distinct=True
-            ),
-            total_provider_count=Count(
-                'providers__id',
-                distinct=True
-            ),
-            medication_levels=ArrayAgg(
-                'providers__provider_medication__level',
-                filter=Q(
-                    providers__active=True,
-                    providers__category__in=provider_category_filters,
-                    providers__provider_medication__date=date,
-                    providers__provider_medication__medication_ndc_id__in=med_ndc_ids,
-                    providers__type__in=provider_type_filters,
-                )
-            )
+        ).defer(
+            'geometry',
+            'state__geometry',
+        )
+        # The counts of the state come from the same query than the counts
+        # of its counties
+        level_counts, self.state_level_counts = Provider.objects.supply_level_counts(
+            'related_county',
+            med_ndc_ids,
+            provider_category_filters,
+            provider_type_filters,
+            date=date,
+            geography_ids=counties.values_list('id', flat=True),
         )
-        return qs
+        return set_level_counts(counties, level_counts)
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['state_level_counts'] = getattr(
+            self,
+            'state_level_counts',
+            None,
+        )
+        return context
 
 
-class GeoZipCodeWithMedicationsView(RetrieveAPIView):
+class GeoZipCodeWithMedicationsView(VersionedResponseCacheMixin, RetrieveAPIView):
     serializer_class = GeoZipCodeWithMedicationsSerializer
     permission_classes = (SelfZipCodePermissionLevel,)
+    renderer_classes = (PreEncodedJSONRenderer, BrowsableAPIRenderer)
     lookup_field = 'zipcode'
+    response_cache_name = 'geo_stats_zipcode'
 
     def get_queryset(self):
         '''
@@ -617,9 +725,7 @@ class GeoZipCodeWithMedicationsView(RetrieveAPIView):
         try:
             int(med_id)
         except (ValueError, TypeError):
-            return ZipCode.objects.filter(zipcode=zipcode).annotate(
-                centroid=AsGeoJSON(Centroid('geometry')),
-            )
+            return ZipCode.objects.filter(zipcode=zipcode)
         provider_medication_ids = get_provider_medication_id(
             self.request.query_params,
         )
@@ -632,6 +738,24 @@ class GeoZipCodeWithMedicationsView(RetrieveAPIView):
         else:
             zipcode_qs = ZipCode.objects.filter(zipcode=zipcode)
 
+        if is_current_supply_query(self.request.query_params):
+            supplies_relation = 'providers__current_supplies'
+        else:
+            supplies_relation = 'providers__provider_medication'
+
+        # Count the supplies of every level group in the database
+        level_counts = {
+            '{}_count'.format(group): Count(
+                supplies_relation + '__id',
+                filter=Q(
+                    **{
+                        supplies_relation + '__id__in': provider_medication_ids,
+                        supplies_relation + '__level__in': levels,
+                    }
+                ),
+            )
+            for group, levels in SUPPLY_LEVEL_GROUPS.items()
+        }
         zipcode_qs = zipcode_qs.annotate(
             active_provider_count=Count(
                 'providers__id',
@@ -639,7 +763,7 @@ class GeoZipCodeWithMedicationsView(RetrieveAPIView):
                     providers__active=True,
                     providers__category__id__isnull=False,
                     providers__type__id__isnull=False,
-                    providers__provider_medication__id__in=provider_medication_ids
+                    **{supplies_relation + '__id__in': provider_medication_ids}
                 ),
                 distinct=True
             ),
@@ -647,13 +771,7 @@ class GeoZipCodeWithMedicationsView(RetrieveAPIView):
                 'providers__id',
                 distinct=True
             ),
-            medication_levels=ArrayAgg(
-                'providers__provider_medication__level',
-                filter=Q(
-                    providers__provider_medication__id__in=provider_medication_ids  # noqa
-                )
-            ),
-            centroid=AsGeoJSON(Centroid('geometry')),
+            **level_counts
         )
 
         return zipcode_qs
@@ -669,6 +787,99 @@ class GeoZipCodeWithMedicationsView(RetrieveAPIView):
         return Response(serializer.data, status=status.HTTP_200_OK)
 
 
+class SupplyTileView(APIView):
+    permission_classes = (IsAuthenticated,)
+    allowed_methods = ['GET']
+
+    def get(self, request, layer, z, x, y):
+        '''
+        kwargs: layer (state, county or zipcode), z, x, y
+
+        query_params:
+            - dosages: list of Dosage ids
+            - map_date: day of the supplies, the current ones by default
+            - med_id: MedicationName id
+            - provider_type: list of ProviderType ids
+            - provider_category: list of ProviderCategory ids
+        '''
+        if layer not in TILE_LAYERS or not is_valid_tile(z, x, y):
+            raise NotFound()
+
+        dosages = request.query_params.getlist('dosages[]', [])
+        med_id = request.query_params.get('med_id', None)
+        provider_category_filters = request.query_params.getlist(
+            'provider_categories[]', [])
+        provider_type_filters = request.query_params.getlist(
+            'provider_types[]', [])
+        # State level users only get the geographies of their state
+        state_id, zipcode = force_user_state_id_and_zipcode(
+            request.user, None, None)
+
+        # Find NDC code based on dosage and medication name
+        med_ndc_ids = MedicationMedicationNameMedicationDosageThrough.objects.filter(
+            medication_name_id=med_id,
+            medication_dosage_id__in=dosages
+        ).select_related(
+            'medication__ndc_codes',
+        ).distinct().values_list('medication__ndc_codes', flat=True)
+
+        # The filters are sorted as they are part of the cache key
+        tile = get_tile(layer, z, x, y, {
+            'medication_ndc_ids': sorted(
+                ndc_id for ndc_id in set(med_ndc_ids) if ndc_id is not None
+            ),
+            'provider_category_ids': sorted(set(provider_category_filters)),
+            'provider_type_ids': sorted(set(provider_type_filters)),
+            'date': request.query_params.get('map_date') or None,
+            'state_id': state_id,
+        })
+        return HttpResponse(tile, content_type=TILE_CONTENT_TYPE)
+
+
+class ImportRunViewSet(viewsets.ReadOnlyModelViewSet):
+    serializer_class = ImportRunSerializer
+    permission_classes = (IsAuthenticated,)
+    pagination_class = LimitOffsetPagination
+
+    def get_queryset(self):
+        user = self.request.user
+        query_params = self.request.query_params
+        import_runs_qs = ImportRun.objects.all()
+
+        # Only staff users can see the imports of other organizations
+        if not user.is_staff:
+            import_runs_qs = import_runs_qs.filter(
+                organization_id=getattr(user, 'organization_id', None),
+            )
+        elif query_params.get('organization'):
+            import_runs_qs = import_runs_qs.filter(
+                organization_id=query_params.get('organization'),
+            )
+
+        status_filter = query_params.get('status')
+        if status_filter:
+            import_runs_qs = import_runs_qs.filter(status=status_filter)
+
+        task_id = query_params.get('task_id')
+        if task_id:
+            import_runs_qs = import_runs_qs.filter(task_id=task_id)
+
+        start_date = get_day_start(query_params, 'start_date')
+        if start_date:
+            import_runs_qs = import_runs_qs.filter(
+                creation_date__gte=start_date,
+            )
+
+        # Until the start of the day after the end date
+        end_date = get_day_start(query_params, 'end_date', days=1)
+        if end_date:
+            import_runs_qs = import_runs_qs.filter(
+                creation_date__lt=end_date,
+            )
+
+        return import_runs_qs
+
+
 class OrganizationViewSet(viewsets.ModelViewSet):
     serializer_class = OrganizationSerializer
     permission_classes = (AllowAny,)
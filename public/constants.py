@@ -0,0 +1,6 @@
+# SPECIAL INSTRUCTION
+# Exclude providers from vaccine finder organization ID 4504 (4383 in medfinder)
+# vaccine finder type needs to be 4 (pharamacy), exclude all other
+# More info at https://www.pivotaltracker.com/story/show/162711148
+FINDER_ORGANIZATION_IDS = (4383,)
+FINDER_VACCINE_FINDER_TYPES = (4,)
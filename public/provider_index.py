@@ -0,0 +1,362 @@
+"""
+In-process spatial index of the providers of the public finder.
+
+Every API worker can hold the providers of the finder in flat arrays, with
+a grid of cells of PUBLIC_PROVIDER_INDEX_CELL_SIZE degrees over their
+longitude and latitude, and answer the radius, medication and dosage
+searches in memory instead of querying the database.
+
+The current supplies of the active providers are stored in compressed
+sparse rows: the supplies of the provider at a position are between
+supply_offsets[position] and supply_offsets[position + 1] in the
+supply_ndc_ids and supply_levels arrays. The supplies of the inactive
+providers are never counted nor shown, so they are not stored. The index
+only finds and sorts the providers, the features of the found ones are
+built from their rows afterwards.
+
+The index is built by the build_provider_index task after every import
+and stored in the cache, the workers load it once a newer one is stored.
+The supplies saved one by one are shown by the features but only sorted
+by the next index.
+"""
+import math
+import threading
+import uuid
+
+from array import array
+from collections import namedtuple
+
+from django.conf import settings
+from django.contrib.gis.measure import D
+from django.core.cache import cache
+from django.db.models import Q
+
+from medications.models import CurrentProviderSupply, Provider
+
+from .constants import FINDER_ORGANIZATION_IDS, FINDER_VACCINE_FINDER_TYPES
+from .features import annotate_coordinates, build_feature, get_provider_rows
+
+# Radius used by ST_DistanceSphere, so the distances match the ORM path
+EARTH_RADIUS = 6370986
+METERS_PER_DEGREE = EARTH_RADIUS * math.pi / 180
+
+PROVIDER_INDEX_TOKEN_KEY = 'provider_index_token'
+# Set while a build requested by a worker is pending
+PROVIDER_INDEX_BUILD_KEY = 'provider_index_build'
+PROVIDER_INDEX_BUILD_TIMEOUT = 10 * 60
+# Arrays of the index and their type codes
+INDEX_ARRAYS = (
+    ('provider_ids', 'i'),
+    ('longitudes', 'd'),
+    ('latitudes', 'd'),
+    ('actives', 'b'),
+    ('supply_offsets', 'i'),
+    ('supply_ndc_ids', 'i'),
+    ('supply_levels', 'b'),
+)
+
+
+# A provider found by a search, with its sort values
+Candidate = namedtuple('Candidate', [
+    'total_supply',
+    'active',
+    'amount_medications',
+    'longitude',
+    'latitude',
+    'provider_id',
+])
+
+
+def get_finder_providers():
+    return Provider.objects.filter(
+        Q(organization_id__in=FINDER_ORGANIZATION_IDS) |
+        Q(vaccine_finder_type__in=FINDER_VACCINE_FINDER_TYPES),
+        geo_localization__isnull=False,
+    )
+
+
+def get_distance(longitude, latitude, other_longitude, other_latitude):
+    """Return the haversine distance in meters between two points."""
+    longitude, latitude, other_longitude, other_latitude = map(
+        math.radians,
+        (longitude, latitude, other_longitude, other_latitude),
+    )
+    a = (
+        math.sin((other_latitude - latitude) / 2) ** 2 +
+        math.cos(latitude) * math.cos(other_latitude) *
+        math.sin((other_longitude - longitude) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS * math.asin(min(1, math.sqrt(a)))
+
+
+def get_features(candidates, longitude, latitude, distance,
+                 medication_ndc_ids):
+    """
+    Return the GeoJSON features of the candidates within distance meters of
+    the point, sorted like the finder: by total supply, active, amount of
+    medications and distance, with the drugs of the medication ndc ids.
+    """
+    results = []
+    for candidate in candidates:
+        candidate_distance = get_distance(
+            longitude,
+            latitude,
+            candidate.longitude,
+            candidate.latitude,
+        )
+        if candidate_distance <= distance:
+            results.append((
+                -candidate.total_supply,
+                -candidate.active,
+                -candidate.amount_medications,
+                candidate_distance,
+                candidate.provider_id,
+            ))
+    if not results:
+        return []
+    results.sort()
+
+    rows = {
+        row['id']: row
+        for row in get_provider_rows(
+            Provider.objects.filter(id__in=[result[4] for result in results]),
+            medication_ndc_ids,
+        )
+    }
+    # The providers deleted since the index was built are skipped
+    return [
+        build_feature(rows[result[4]], D(m=result[3]))
+        for result in results
+        if result[4] in rows
+    ]
+
+
+class ProviderIndex:
+
+    def __init__(self, cell_size=None, token=None):
+        self.cell_size = cell_size or settings.PUBLIC_PROVIDER_INDEX_CELL_SIZE
+        # Token of the stored index it was loaded from
+        self.token = token
+        for name, typecode in INDEX_ARRAYS:
+            setattr(self, name, array(typecode))
+        self.supply_offsets.append(0)
+        # (x, y) cell -> positions of its providers
+        self.cells = {}
+
+    def __len__(self):
+        return len(self.provider_ids)
+
+    def get_cell(self, longitude, latitude):
+        return (
+            int(math.floor(longitude / self.cell_size)),
+            int(math.floor(latitude / self.cell_size)),
+        )
+
+    def add_cells(self):
+        for position, (longitude, latitude) in enumerate(
+            zip(self.longitudes, self.latitudes),
+        ):
+            self.cells.setdefault(
+                self.get_cell(longitude, latitude),
+                array('i'),
+            ).append(position)
+
+    def build(self):
+        providers = get_finder_providers()
+        supplies = iter(
+            CurrentProviderSupply.objects.filter(
+                provider__in=providers.filter(active=True),
+            ).order_by(
+                'provider_id',
+            ).values_list(
+                'provider_id',
+                'medication_ndc_id',
+                'level',
+            ).iterator()
+        )
+        supply = next(supplies, None)
+
+        for provider_id, active, longitude, latitude in annotate_coordinates(
+            providers,
+        ).order_by(
+            'id',
+        ).values_list(
+            'id',
+            'active',
+            'longitude',
+            'latitude',
+        ).iterator():
+            self.provider_ids.append(provider_id)
+            self.longitudes.append(longitude)
+            self.latitudes.append(latitude)
+            self.actives.append(active)
+            while supply is not None and supply[0] <= provider_id:
+                # Skips the providers deactivated between the two queries
+                if supply[0] == provider_id and active:
+                    self.supply_ndc_ids.append(supply[1])
+                    self.supply_levels.append(supply[2])
+                supply = next(supplies, None)
+            self.supply_offsets.append(len(self.supply_ndc_ids))
+        self.add_cells()
+        return self
+
+    def to_data(self):
+        """Return the arrays of the index as bytes, to be cached."""
+        data = {'cell_size': self.cell_size}
+        for name, typecode in INDEX_ARRAYS:
+            data[name] = getattr(self, name).tobytes()
+        return data
+
+    @classmethod
+    def from_data(cls, data, token=None):
+        index = cls(data['cell_size'], token)
+        for name, typecode in INDEX_ARRAYS:
+            values = array(typecode)
+            values.frombytes(data[name])
+            setattr(index, name, values)
+        index.add_cells()
+        return index
+
+    def iter_positions(self, longitude, latitude, distance):
+        """
+        Yield the positions of the providers of the cells overlapping the
+        bounding box of the circle.
+        """
+        latitude_delta = distance / METERS_PER_DEGREE
+        max_latitude = min(90, abs(latitude) + latitude_delta)
+        cosine = math.cos(math.radians(max_latitude))
+        if max_latitude >= 90 or latitude_delta / cosine >= 180:
+            longitude_delta = 180
+        else:
+            longitude_delta = latitude_delta / cosine
+
+        min_x, min_y = self.get_cell(
+            longitude - longitude_delta,
+            latitude - latitude_delta,
+        )
+        max_x, max_y = self.get_cell(
+            longitude + longitude_delta,
+            latitude + latitude_delta,
+        )
+        # Around the antimeridian all the longitudes are searched
+        if abs(longitude) + longitude_delta > 180:
+            min_x = self.get_cell(-180, 0)[0]
+            max_x = self.get_cell(180, 0)[0]
+
+        if (max_x - min_x + 1) * (max_y - min_y + 1) > len(self.cells):
+            for cell, positions in self.cells.items():
+                if min_x <= cell[0] <= max_x and min_y <= cell[1] <= max_y:
+                    yield from positions
+            return
+        for x in range(min_x, max_x + 1):
+            for y in range(min_y, max_y + 1):
+                yield from self.cells.get((x, y), ())
+
+    def get_candidates(self, longitude, latitude, distance,
+                       medication_ndc_ids):
+        """
+        Return the candidates of the providers within distance meters of
+        the point, with the supplies of the medication ndc ids.
+        """
+        medication_ndc_ids = set(medication_ndc_ids)
+        candidates = []
+        for position in self.iter_positions(longitude, latitude, distance):
+            provider_longitude = self.longitudes[position]
+            provider_latitude = self.latitudes[position]
+            if get_distance(
+                longitude,
+                latitude,
+                provider_longitude,
+                provider_latitude,
+            ) > distance:
+                continue
+            total_supply = 0
+            amount_medications = 0
+            for supply in range(
+                self.supply_offsets[position],
+                self.supply_offsets[position + 1],
+            ):
+                if self.supply_ndc_ids[supply] in medication_ndc_ids:
+                    total_supply += self.supply_levels[supply]
+                    amount_medications += 1
+            candidates.append(Candidate(
+                total_supply=total_supply,
+                active=bool(self.actives[position]),
+                amount_medications=amount_medications,
+                longitude=provider_longitude,
+                latitude=provider_latitude,
+                provider_id=self.provider_ids[position],
+            ))
+        return candidates
+
+    def search(self, longitude, latitude, distance, medication_ndc_ids):
+        """
+        Return the GeoJSON features of the providers within distance meters
+        of the point, sorted like the finder.
+        """
+        return get_features(
+            self.get_candidates(
+                longitude,
+                latitude,
+                distance,
+                medication_ndc_ids,
+            ),
+            longitude,
+            latitude,
+            distance,
+            medication_ndc_ids,
+        )
+
+
+def get_provider_index_key(token):
+    return 'provider_index:{}'.format(token)
+
+
+def store_provider_index(index):
+    """
+    Store the index in the cache, the workers load it on their next search.
+    """
+    previous_token = cache.get(PROVIDER_INDEX_TOKEN_KEY)
+    token = uuid.uuid4().hex
+    cache.set(get_provider_index_key(token), index.to_data(), timeout=None)
+    cache.set(PROVIDER_INDEX_TOKEN_KEY, token, timeout=None)
+    # The workers still loading it keep their index until the next search
+    if previous_token:
+        cache.delete(get_provider_index_key(previous_token))
+    return token
+
+
+def request_provider_index_build():
+    """Build the index in a task, once until it is stored."""
+    if cache.add(PROVIDER_INDEX_BUILD_KEY, True, PROVIDER_INDEX_BUILD_TIMEOUT):
+        # The tasks module imports this one
+        from .tasks import build_provider_index
+        build_provider_index.delay()
+
+
+_provider_index = None
+_provider_index_lock = threading.Lock()
+
+
+def get_provider_index():
+    """
+    Return the index of the worker, loaded again once a newer index is
+    stored, or None until an index is built.
+    """
+    global _provider_index
+    token = cache.get(PROVIDER_INDEX_TOKEN_KEY)
+    if token is None:
+        request_provider_index_build()
+    elif _provider_index is None or _provider_index.token != token:
+        with _provider_index_lock:
+            if _provider_index is None or _provider_index.token != token:
+                data = cache.get(get_provider_index_key(token))
+                if data is not None:
+                    _provider_index = ProviderIndex.from_data(data, token)
+    return _provider_index
+
+
+def clear_provider_index():
+    global _provider_index
+    with _provider_index_lock:
+        _provider_index = None
@@ -0,0 +1,137 @@
+"""
+Cache of the public finder searches by cell.
+
+The searches come from browsers with arbitrary coordinates, so they are
+snapped to a cell of a grid of PUBLIC_SEARCH_CACHE_CELL_SIZE degrees. The
+candidates of a cell, the providers within the distance plus the distance
+from the center of the cell to its farthest corner, are computed once and
+cached under the cell, the distance, the medications, the dosages and the
+supply data version. Every search then only filters and sorts the cached
+candidates by its exact distance, and builds the features of the found
+providers.
+
+Only the sort values, coordinates and ids of the candidates are cached, as
+plain tuples. The cells with more than PUBLIC_SEARCH_CACHE_MAX_CANDIDATES
+candidates are not cached, and at most PUBLIC_SEARCH_CACHE_MAX_ENTRIES
+cells are cached per supply data version. The cache is disabled by default.
+
+The hits and misses of the searches are counted with the response cache
+stats, with their latency.
+"""
+import hashlib
+import json
+import math
+
+from django.conf import settings
+from django.core.cache import cache
+
+from medications.versions import get_supply_data_version
+
+from .provider_index import Candidate, get_distance
+
+SEARCH_CACHE_NAME = 'find_provider'
+
+
+def get_search_cell(longitude, latitude, cell_size):
+    return (
+        int(math.floor(longitude / cell_size)),
+        int(math.floor(latitude / cell_size)),
+    )
+
+
+def get_cell_center(cell, cell_size):
+    return (
+        (cell[0] + 0.5) * cell_size,
+        (cell[1] + 0.5) * cell_size,
+    )
+
+
+def get_cell_margin(cell, cell_size):
+    """
+    Return the distance in meters from the center of the cell to its
+    farthest corner, the one closest to the equator.
+    """
+    longitude, latitude = get_cell_center(cell, cell_size)
+    return max(
+        get_distance(
+            longitude,
+            latitude,
+            longitude + cell_size / 2,
+            latitude + corner * cell_size / 2,
+        )
+        for corner in (-1, 1)
+    )
+
+
+def get_search_cache_key(version, cell, cell_size, distance, med_ids,
+                         dosages):
+    """
+    Return the cache key of the candidates of a cell, med_ids being a list
+    of medication name ids or 'all'.
+    """
+    key_data = json.dumps([
+        cell,
+        cell_size,
+        distance,
+        med_ids if med_ids == 'all' else sorted(set(med_ids)),
+        sorted(set(dosages)),
+    ])
+    return '{}:{}:{}'.format(
+        SEARCH_CACHE_NAME,
+        version,
+        hashlib.sha256(key_data.encode()).hexdigest(),
+    )
+
+
+def add_search_cache_entry(version):
+    """
+    Return whether one more cell can be cached for the supply data version.
+    """
+    count_key = '{}:{}:entries'.format(SEARCH_CACHE_NAME, version)
+    cache.add(count_key, 0, settings.PUBLIC_SEARCH_CACHE_TIMEOUT)
+    try:
+        count = cache.incr(count_key)
+    except ValueError:
+        # Expired in between
+        return False
+    return count <= settings.PUBLIC_SEARCH_CACHE_MAX_ENTRIES
+
+
+def get_cached_candidates(longitude, latitude, distance, med_ids, dosages,
+                          get_candidates):
+    """
+    Return the cached candidates of the cell of the point and whether they
+    were cached, get_candidates(longitude, latitude, distance) computing
+    them otherwise.
+    """
+    version = get_supply_data_version()
+    cell_size = settings.PUBLIC_SEARCH_CACHE_CELL_SIZE
+    cell = get_search_cell(longitude, latitude, cell_size)
+    cache_key = get_search_cache_key(
+        version,
+        cell,
+        cell_size,
+        distance,
+        med_ids,
+        dosages,
+    )
+    cached_candidates = cache.get(cache_key)
+    if cached_candidates is not None:
+        return [Candidate(*values) for values in cached_candidates], True
+
+    center_longitude, center_latitude = get_cell_center(cell, cell_size)
+    candidates = get_candidates(
+        center_longitude,
+        center_latitude,
+        distance + get_cell_margin(cell, cell_size),
+    )
+    if (
+        len(candidates) <= settings.PUBLIC_SEARCH_CACHE_MAX_CANDIDATES and
+        add_search_cache_entry(version)
+    ):
+        cache.set(
+            cache_key,
+            [tuple(candidate) for candidate in candidates],
+            settings.PUBLIC_SEARCH_CACHE_TIMEOUT,
+        )
+    return candidates, False
@@ -3,7 +3,7 @@ import json
 from collections import OrderedDict
 from rest_framework import serializers
 
-from medications.models import ProviderMedicationNdcThrough, Provider
+from medications.models import CurrentProviderSupply, Provider
 from medications.utils import get_supplies
 
 
@@ -18,7 +18,7 @@ class ProviderMedicationSimpleSerializer(serializers.ModelSerializer):
     supply_level = serializers.SerializerMethodField()
 
     class Meta:
-        model = ProviderMedicationNdcThrough
+        model = CurrentProviderSupply
         fields = (
             'id',
             'medication_name',
@@ -107,7 +107,7 @@ class FindProviderSerializer(serializers.ModelSerializer):
         properties['website'] = instance.website
         if active_provider:
             properties['drugs'] = ProviderMedicationSimpleSerializer(
-                instance.provider_medication.all(),
+                instance.current_supplies.all(),
                 many=True,
             ).data
         else:
@@ -0,0 +1,20 @@
+from celery import shared_task
+from django.core.cache import cache
+
+from .provider_index import (
+    PROVIDER_INDEX_BUILD_KEY,
+    ProviderIndex,
+    store_provider_index,
+)
+
+
+@shared_task
+def build_provider_index():
+    """
+    Build the index of the providers of the public finder and store it for
+    the API workers, run after every import.
+    """
+    index = ProviderIndex().build()
+    store_provider_index(index)
+    cache.delete(PROVIDER_INDEX_BUILD_KEY)
+    return len(index)
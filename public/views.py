@@ -1,11 +1,20 @@
+import base64
+import json
+import time
+
+from collections import OrderedDict
+
 from rest_framework import status
-from rest_framework.generics import ListAPIView, GenericAPIView
+from rest_framework.generics import GenericAPIView
 from rest_registration.exceptions import BadRequest
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.permissions import AllowAny
+from rest_framework.renderers import BrowsableAPIRenderer
+from rest_framework.utils.urls import replace_query_param
+from django.conf import settings
 from django.contrib.gis.geos import Point
-from django.db.models import Prefetch, Sum, Count, Q
+from django.db.models import Sum, Count, Q
 from django.db.models.functions import Coalesce
 from django.core.mail import send_mail
 from django.contrib.gis.db.models.functions import Distance
@@ -19,122 +28,352 @@ from medications.models import (
     MedicationType,
     MedicationTypeMedicationNameThrough,
     MedicationMedicationNameMedicationDosageThrough,
-    ProviderMedicationNdcThrough,
     Provider,
     Medication,
 )
 
+from medications.renderers import (
+    CompressedResponseMixin,
+    PreEncodedJSONRenderer,
+)
+from medications.response_cache import count_response_cache_access
 from medications.views import (
     medication_name_dosage_type_filters,
 )
 
-from .serializers import FindProviderSerializer, ContactFormSerializer
+from .constants import FINDER_ORGANIZATION_IDS, FINDER_VACCINE_FINDER_TYPES
+from .features import (
+    annotate_coordinates,
+    build_feature,
+    get_provider_rows,
+    get_row_sort_key,
+)
+from .provider_index import Candidate, get_features, get_provider_index
+from .search_cache import SEARCH_CACHE_NAME, get_cached_candidates
+from .serializers import ContactFormSerializer
+
+
+def get_location_point(query_params):
+    try:
+        location = list(
+            map(float, query_params.get('localization').split(','))
+        )
+        return Point(
+            location[0], location[1], srid=4326,
+        )
+    except (IndexError, ValueError, AttributeError):
+        raise BadRequest(
+            'Location should be provided and be a list of 2 coordinates'
+        )
+
+
+def get_medication_ndc_ids(query_params):
+    med_ids = query_params.getlist('med_ids[]', None)
+    dosages = query_params.getlist('dosages[]', None)
+
+    # Support for all the medications
+    if len(med_ids) == 1 and med_ids[0] == 'all':
+        med_ndc_qs = MedicationMedicationNameMedicationDosageThrough.objects.all()
+    else:
+        med_ndc_qs = MedicationMedicationNameMedicationDosageThrough.objects.filter(
+            medication_name_id__in=med_ids,
+            medication_dosage_id__in=dosages
+        )
+    return med_ndc_qs.select_related(
+        'medication__ndc_codes',
+    ).distinct().values_list('medication__ndc_codes', flat=True)
+
+
+def encode_cursor(order, key):
+    return base64.urlsafe_b64encode(
+        json.dumps([order] + key).encode(),
+    ).decode()
+
+
+def decode_cursor(cursor):
+    """Return the order and the sort key of a cursor."""
+    try:
+        order, *key = json.loads(
+            base64.urlsafe_b64decode(cursor.encode()).decode(),
+        )
+    except (TypeError, ValueError):
+        raise BadRequest(_('Invalid cursor'))
+    return order, key
+
+
+def get_nearby_providers(location_point, distance):
+    return Provider.objects.filter(
+        Q(organization_id__in=FINDER_ORGANIZATION_IDS) |
+        Q(vaccine_finder_type__in=FINDER_VACCINE_FINDER_TYPES)
+    ).filter(
+        geo_localization__distance_lte=(
+            location_point,
+            distance,
+        ),
+    ).annotate(
+        distance=Distance(
+            'geo_localization',
+            location_point,
+        ),
+    )
+
+
+def get_database_rows(location_point, distance, med_ndc_ids):
+    """
+    Return the feature rows of the providers within distance, a Distance,
+    of the point, sorted like the finder.
+    """
+    return sorted(
+        get_provider_rows(
+            get_nearby_providers(location_point, distance),
+            med_ndc_ids,
+            'distance',
+        ),
+        key=lambda row: get_row_sort_key(row, row['distance']),
+    )
+
+
+def get_database_candidates(longitude, latitude, distance, med_ndc_ids):
+    """
+    Return the search candidates of the providers within distance meters
+    of the point, found by the database.
+    """
+    supply_filter = Q(
+        current_supplies__medication_ndc_id__in=list(med_ndc_ids),
+        active=True,
+    )
+    return [
+        Candidate(*values)
+        for values in annotate_coordinates(
+            get_nearby_providers(
+                Point(longitude, latitude, srid=4326),
+                D(m=distance),
+            ),
+        ).annotate(
+            total_supply=Coalesce(
+                Sum('current_supplies__level', filter=supply_filter),
+                0,
+            ),
+            amount_medications=Count('current_supplies', filter=supply_filter),
+        ).order_by().values_list(
+            'total_supply',
+            'active',
+            'amount_medications',
+            'longitude',
+            'latitude',
+            'id',
+        )
+    ]
 
 
-class FindProviderMedicationView(ListAPIView):
-    serializer_class = FindProviderSerializer
+class FindProviderMedicationView(CompressedResponseMixin, APIView):
     permission_classes = (AllowAny,)
+    renderer_classes = (PreEncodedJSONRenderer, BrowsableAPIRenderer)
     allowed_methods = ['GET']
+    default_limit = 50
+    max_limit = 200
+    orders = ('supply', 'nearest')
 
-    def get_queryset(self):
+    def get(self, request, *args, **kwargs):
         '''
+        Pages of providers are returned when a limit is given, with the
+        url of the next page in the "next" key of the FeatureCollection.
+
         query_params:
             - med_ids: list of MedicaitonName ids
             - dosages: list of Dosage ids
             - localization: list of 2 coordinates (must be int or float)
             - distance: int, in miles
+            - limit: int, number of providers of the page
+            - order: supply (default) or nearest, to only sort by distance
+            - cursor: str, position of the page, from the "next" url
         '''
-        med_ids = self.request.query_params.getlist('med_ids[]', None)
-        dosages = self.request.query_params.getlist('dosages[]', None)
-        location = self.request.query_params.get('localization')
-        distance = self.request.query_params.get('distance')
+        # Without a limit all the providers within distance are returned
+        if 'limit' not in request.query_params:
+            if settings.PUBLIC_SEARCH_CACHE_CELL_SIZE:
+                return self.list_from_search_cache(request)
+            if settings.PUBLIC_PROVIDER_INDEX_ENABLED:
+                return self.list_from_index(request)
+            return self.list_from_database(request)
 
-        # 1 - validate location
         try:
-            location = list(
-                map(float, location.split(','))
+            limit = min(int(request.query_params['limit']), self.max_limit)
+            distance = D(mi=float(request.query_params.get('distance'))).m
+        except (TypeError, ValueError):
+            raise BadRequest(_('limit and distance should be numbers'))
+        if limit <= 0:
+            limit = self.default_limit
+
+        order = request.query_params.get('order', 'supply')
+        after = None
+        cursor = request.query_params.get('cursor')
+        if cursor:
+            order, after = decode_cursor(cursor)
+        if order not in self.orders:
+            raise BadRequest(_('Invalid order'))
+
+        location_point = get_location_point(request.query_params)
+        med_ndc_ids = list(get_medication_ndc_ids(request.query_params))
+
+        # The page is found by the database with the providers sort keys
+        # only, the providers of the page are loaded afterwards
+        try:
+            page, next_key = Provider.objects.nearest_providers(
+                location_point,
+                distance,
+                med_ndc_ids,
+                FINDER_ORGANIZATION_IDS,
+                FINDER_VACCINE_FINDER_TYPES,
+                order=order,
+                after=after,
+                limit=limit,
             )
-            location_point = Point(
-                location[0], location[1], srid=4326,
+        except ValueError:
+            raise BadRequest(_('Invalid cursor'))
+        rows = {
+            row['id']: row
+            for row in get_provider_rows(
+                Provider.objects.filter(
+                    id__in=[entry['id'] for entry in page],
+                ),
+                med_ndc_ids,
             )
-        except (IndexError, ValueError, AttributeError):
+        }
+        data = OrderedDict((
+            ('type', 'FeatureCollection'),
+            ('features', [
+                build_feature(rows[entry['id']], D(m=entry['distance']))
+                for entry in page
+            ]),
+        ))
+        data['next'] = replace_query_param(
+            request.build_absolute_uri(),
+            'cursor',
+            encode_cursor(order, next_key),
+        ) if next_key else None
+        return Response(data)
+
+    def get_search_params(self, request):
+        '''
+        Return the location point, the distance in meters, the medication
+        name ids or 'all' and the dosage ids of a search.
+        '''
+        location_point = get_location_point(request.query_params)
+        med_ids = request.query_params.getlist('med_ids[]')
+        dosages = request.query_params.getlist('dosages[]')
+        try:
+            distance = D(mi=float(request.query_params.get('distance'))).m
+            # Support for all the medications
+            if med_ids == ['all']:
+                med_ids = 'all'
+                dosages = []
+            else:
+                med_ids = [int(med_id) for med_id in med_ids]
+                dosages = [int(dosage) for dosage in dosages]
+        except (TypeError, ValueError):
             raise BadRequest(
-                'Location should be provided and be a list of 2 coordinates'
+                _('distance, medications and dosages should be numbers'),
             )
+        return location_point, distance, med_ids, dosages
 
-        # 2 - fetch ndc codes from filters: med id and dosage + support for all
-        if len(med_ids) == 1 and med_ids[0] == 'all':
-            med_ndc_qs = MedicationMedicationNameMedicationDosageThrough.objects.all()
-        else:
-            med_ndc_qs = MedicationMedicationNameMedicationDosageThrough.objects.filter(
-                medication_name_id__in=med_ids,
-                medication_dosage_id__in=dosages
-            )
-        med_ndc_ids = med_ndc_qs.select_related(
-            'medication__ndc_codes',
-        ).distinct().values_list('medication__ndc_codes', flat=True)
-
-        # 2 - fetch provider medication entries (supply levels) for the ndc ndc_codes
-        # and filter by distance
-        provider_medication_ids = ProviderMedicationNdcThrough.objects.filter(
-            latest=True,
-            medication_ndc_id__in=med_ndc_ids,
-            provider__geo_localization__distance_lte=(
-                location_point,
-                D(mi=distance),
-            ),
-        ).values_list('id', flat=True,)
+    def list_from_database(self, request):
+        '''
+        Search the providers in the database, building the features from
+        plain rows instead of the serializer.
+        '''
+        location_point, distance, med_ids, dosages = self.get_search_params(
+            request,
+        )
+        rows = get_database_rows(
+            location_point,
+            D(m=distance),
+            list(get_medication_ndc_ids(request.query_params)),
+        )
+        return Response(OrderedDict((
+            ('type', 'FeatureCollection'),
+            ('features', [
+                build_feature(row, row['distance']) for row in rows
+            ]),
+        )))
 
-        # SPECIAL INSTRUCTION
-        # Exclude providers from vaccine finder organization ID 4504 (4383 in medfinder)
-        # vaccine finder type needs to be 4 (pharamacy), exclude all other
-        # More info at https://www.pivotaltracker.com/story/show/162711148
+    def list_from_index(self, request):
+        '''
+        Search the providers in the in-process index of the worker, the
+        response is the same as the one of the database.
+        '''
+        location_point, distance, med_ids, dosages = self.get_search_params(
+            request,
+        )
+        index = get_provider_index()
+        # Until the first index is stored
+        if index is None:
+            return self.list_from_database(request)
+        features = index.search(
+            location_point.x,
+            location_point.y,
+            distance,
+            list(get_medication_ndc_ids(request.query_params)),
+        )
+        return Response(OrderedDict((
+            ('type', 'FeatureCollection'),
+            ('features', features),
+        )))
 
-        provider_qs = Provider.objects.filter(
-            Q(organization_id=4383) | Q(vaccine_finder_type=4)
-        ).filter(
-            geo_localization__distance_lte=(
-                location_point,
-                D(mi=distance),
-            ),
-        ).annotate(
-            distance=Distance(
-                'geo_localization',
-                location_point,
-            ),
-            total_supply=Coalesce(
-                Sum(
-                    'provider_medication__level',
-                    filter=Q(
-                        provider_medication__id__in=provider_medication_ids,
-                        provider_medication__latest=True,
-                        active=True,
-                    ),
-                ),
-                0,
-            ),
-            amount_medications=Count(
-                'provider_medication',
-                filter=Q(
-                    provider_medication__id__in=provider_medication_ids,
-                    provider_medication__latest=True,
-                    active=True,
-                ),
-            )
-        ).prefetch_related(
-            Prefetch(
-                'provider_medication',
-                queryset=ProviderMedicationNdcThrough.objects.filter(
-                    latest=True,
-                    id__in=provider_medication_ids,
-                ).select_related(
-                    'medication_ndc__medication',
-                    'medication_ndc__medication__medication_name',
-                ).order_by('-level', '-medication_ndc__medication__drug_type')
+    def list_from_search_cache(self, request):
+        '''
+        Search the providers among the cached candidates of the cell of the
+        location, found by the index or the database on a miss, and sort
+        them by their exact distance.
+        '''
+        start = time.perf_counter()
+        location_point, distance, med_ids, dosages = self.get_search_params(
+            request,
+        )
+
+        med_ndc_ids = list(get_medication_ndc_ids(request.query_params))
+
+        def get_candidates(longitude, latitude, candidate_distance):
+            index = None
+            if settings.PUBLIC_PROVIDER_INDEX_ENABLED:
+                index = get_provider_index()
+            if index is not None:
+                return index.get_candidates(
+                    longitude,
+                    latitude,
+                    candidate_distance,
+                    med_ndc_ids,
+                )
+            return get_database_candidates(
+                longitude,
+                latitude,
+                candidate_distance,
+                med_ndc_ids,
             )
-        ).order_by('-total_supply', '-active', '-amount_medications', 'distance')
 
-        return provider_qs
+        candidates, hit = get_cached_candidates(
+            location_point.x,
+            location_point.y,
+            distance,
+            med_ids,
+            dosages,
+            get_candidates,
+        )
+        features = get_features(
+            candidates,
+            location_point.x,
+            location_point.y,
+            distance,
+            med_ndc_ids,
+        )
+        count_response_cache_access(
+            SEARCH_CACHE_NAME,
+            hit,
+            time.perf_counter() - start,
+        )
+        return Response(OrderedDict((
+            ('type', 'FeatureCollection'),
+            ('features', features),
+        )))
 
 
 class BasicInfoView(APIView):